@@ -1,6 +1,22 @@
-import streamlit as st
+import contextlib
+import html
+import json
+import os
+import uuid
+
 import pandas as pd
-import numpy as np
+import streamlit as st
+
+from exports import EXPORT_FORMATS, export_bytes
+from fulltext import make_snippet
+from instrumentation import MetricsRegistry, SpanRecorder, append_jsonl, write_textfile
+from refresh import LiveEngine
+from school_html import FRAGMENT_CSS, LABEL_MAP, TAB_RENDERERS, FragmentCache, available_tabs, format_value
+from search_engine import (
+    CACHE_DIR, COL_MAP, COMPARE_MAX_SCHOOLS, FULLTEXT_BOOSTS, PERCENT_COLS, QUERY_DEFAULTS, SCORE_KEYS,
+    SCORE_PREFERENCE_FACETS, ResultCache, canonical_spec, compare_schools, is_valid_data,
+    normalize_query, normalize_school_name, query_key, suggest_school_names, top_k_rows,
+)
 
 # --- 頁面設定 ---
 st.set_page_config(page_title="小學概覽選校搜尋器", layout="wide")
@@ -65,50 +81,6 @@ st.markdown("""
         display: none;
     }
     
-    /* 3. HTML 表格基本樣式 (通用於所有clean-table，解決響應式對齊問題) */
-    .clean-table {
-        width: 100%;
-        border-collapse: collapse;
-        margin-bottom: 1em;
-        table-layout: auto; 
-        min-width: 400px; /* 確保在手機上仍有最小寬度以保持對齊 */
-    }
-    .clean-table th, .clean-table td {
-        padding: 8px 12px;
-        text-align: left;
-        border: none; 
-        border-bottom: 1px solid #eee; /* 增加行分隔線 */
-        vertical-align: top;
-    }
-    .clean-table th {
-        font-weight: 600;
-        background-color: #f7f7f7;
-        border-bottom: 2px solid #ccc; /* 標題下雙分隔線 */
-    }
-    
-    /* 4. 測驗次數/班級結構 表格樣式優化 */
-    .clean-table.class-table td:nth-child(n+2), .clean-table.class-table th:nth-child(n+2) {
-        text-align: center;
-    }
-    .clean-table.class-table td:nth-child(1), .clean-table.assessment-table td:nth-child(1) {
-        font-weight: bold; /* 讓第一欄文字粗體顯示 */
-        width: 30%; 
-    }
-    
-    /* 5. 政策列表樣式 - 單欄堆疊，確保內容清晰 */
-    .policy-list-item {
-        padding: 8px 0px;
-        border-bottom: 1px solid #eee;
-    }
-    .policy-list-item:last-child {
-        border-bottom: none;
-    }
-    .policy-list-item strong {
-        display: block; 
-        margin-bottom: 2px;
-        color: #333;
-    }
-
     /* 6. 側邊欄展開/摺疊按鈕優化 */
     /* 針對側邊欄展開按鈕 (通常在左上角) */
     button[data-testid="baseButton-headerNoPadding"] {
@@ -131,32 +103,10 @@ st.markdown("""
     button[data-testid="stSidebarCloseButton"]:hover {
         color: #3498db !important; /* 懸停時變為藍色 */
     }
-    /* 新增：統一 info-table 樣式 */
-    .info-table {
-        width: 100%;
-        border-collapse: collapse;
-        margin-bottom: 15px;
-    }
-    .info-table th {
-        background-color: #f7f7f7;
-        font-weight: 600;
-        border-bottom: 2px solid #ccc;
-        padding: 8px 12px;
-        text-align: left;
-        width: 50%; /* 確保兩欄平均分配 */
-    }
-    .info-table td {
-        padding: 6px 12px;
-        border-bottom: 1px solid #eee;
-        text-align: left;
-        width: 50%;
-    }
-    .info-table td:nth-child(2) {
-        text-align: right; /* 數字靠右顯示 */
-        font-weight: bold;
-    }
     </style>
 """, unsafe_allow_html=True)
+# 詳細資料分頁 HTML 片段的樣式 (與列印報告共用)
+st.markdown(f"<style>{FRAGMENT_CSS}</style>", unsafe_allow_html=True)
 # --- 注入 CSS 結束 ---
 
 # --- Logo 及 主標題 ---
@@ -172,115 +122,32 @@ st.markdown(f"""
     </div>
     """, unsafe_allow_html=True)
 
-# --- 載入與處理資料 (簡化至純文字邏輯) ---
-@st.cache_data
-def load_data():
-    try:
-        # 使用您最新的檔案名稱
-        school_df = pd.read_csv("database_school_info.csv") 
-        article_df = pd.read_csv("database_related_article.csv")
-        
-        school_df.columns = school_df.columns.str.strip()
-        article_df.columns = article_df.columns.str.strip()
-        
-        school_df.rename(columns={"學校類別1": "資助類型", "學校類別2": "上課時間"}, inplace=True)
-        
-        # 將所有列強制轉為字串並移除空格，以確保一致的純文字讀取
-        for col in school_df.columns:
-            school_df[col] = school_df[col].astype(str).str.strip()
+# --- 載入與處理資料 ---
+# 資料解析、索引及查詢都在 search_engine.py；所有 session 共用同一個 LiveEngine (st.cache_resource 不會複製返回值)。
+# 替換 CSV 後，第一個 rerun 的 session 以 refresh.py 增量建立新版本，完成後所有 session 一次過切換，毋須重新啟動
+# 以多個進程 (負載平衡) 部署時設定此環境變數為 "1"：資料及索引由一個進程寫成共用資料段，其他進程附加 (見 segments.py)
+SHARED_ENV = "SCHOOL_SEARCH_SHARED"
 
-        # 處理 HTML 換行符
-        for col in school_df.select_dtypes(include=['object']).columns:
-            school_df[col] = school_df[col].str.replace('<br>', '\n', regex=False).str.strip()
-        
-        if '學校名稱' in school_df.columns:
-            school_df['學校名稱'] = school_df['學校名稱'].str.replace(r'\s+', ' ', regex=True).str.strip()
-            
-        return school_df, article_df
+@st.cache_resource
+def get_live_engine():
+    return LiveEngine(fragment_cache=get_fragment_cache(), shared=os.environ.get(SHARED_ENV) == "1")
+
+def load_engine():
+    # 返回目前的 SearchEngine (唯讀，見 FrozenDataFrame)；每次 rerun 只取一次，整個 rerun 使用同一個版本
+    try:
+        return get_live_engine().current()
         
     except FileNotFoundError:
         # 🚨 修正點：如果找不到檔案，明確拋出錯誤訊息
         st.error("錯誤：找不到資料檔案。請確保 'database_school_info.csv' 和 'database_related_article.csv' 檔案與 app.py 在同一個資料夾中。")
-        return None, None
+        return None
     except Exception as e:
         st.error(f"處理資料時發生錯誤：{e}。請檢查您的 CSV 檔案格式是否正確。")
-        return None, None
+        return None
 
 # --- [START] 輔助函數 ---
-# 這裡修改 LABEL_MAP (不變)
-LABEL_MAP = { 
-    "校監_校管會主席姓名": "校監", 
-    "校長姓名": "校長",
-    "舊生會_校友會": "舊生會／校友會", 
-    "上課時間_": "一般上學時間",
-    "放學時間": "一般放學時間",
-    "午膳時間": "午膳開始時間",
-    "午膳結束時間": "午膳結束時間",
-    # 這些欄位將作為純文字顯示
-    "核准編制教師職位數目": "核准編制教師職位數目", 
-    "教師總人數": "教師總人數", 
-    "已接受師資培訓人數百分率": "已接受師資培訓 (%)", # 在顯示名稱中保留百分比提示
-    "學士人數百分率": "學士學位 (%)",
-    "碩士／博士或以上人數百分率": "碩士/博士學位 (%)",
-    "特殊教育培訓人數百分率": "特殊教育培訓 (%)",
-    "0至4年年資人數百分率": "0-4年年資 (%)", 
-    "5至9年年資人數百分率": "5-9年年資 (%)", 
-    "10年年資或以上人數百分率": "10+年年資 (%)", 
-    "課室數目": "課室",
-    "禮堂數目": "禮堂",
-    "操場數目": "操場",
-    "圖書館數目": "圖書館",
-    "學費": "學費",
-    "堂費": "堂費",
-    "家長教師會費": "家長教師會費",
-    "非標準項目的核准收費": "非標準項目的核准收費",
-    "其他收費_費用": "其他",
-    "一條龍中學": "一條龍中學",
-    "直屬中學": "直屬中學",
-    "聯繫中學": "聯繫中學",
-    "校訓": "校訓",
-    # 新增/移動的欄位名稱
-    "健康校園生活": "健康校園生活",
-    "學校生活備註": "學校生活備註",
-    "全方位學習": "全方位學習",
-    "家校合作": "家校合作",
-    "全校參與照顧學生的多樣性": "全校參與照顧學生的多樣性",
-    "全校參與模式融合教育": "全校參與模式融合教育",
-    "非華語學生的教育支援": "非華語學生的教育支援",
-    "學費減免": "學費減免",
-    "環保政策": "環保政策",
-    "校風": "校風",
-    "學校發展計劃": "學校發展計劃",
-    "學校管理架構": "學校管理架構",
-    "法團校董會_校管會_校董會": "法團校董會/校管會/校董會",
-    "學校特色_其他": "其他學校特色",
-    "課程剪裁及調適措施": "課程剪裁及調適措施",
-    "正確價值觀_態度和行為的培養": "正確價值觀、態度和行為的培養",
-    "共通能力的培養": "共通能力的培養",
-    "小學教育課程更新重點的發展": "小學教育課程更新重點的發展",
-    "學習和教學策略": "學習和教學策略",
-    "學校關注事項": "學校關注事項",
-}
-
-def is_valid_data(value):
-    # 🚨 修正：在進行任何字串操作前，強制將值轉換為字串。
-    # 這可以避免 'float' object has no attribute 'strip' 錯誤，因為 numpy.nan 是 float 類型。
-    value_str = str(value).strip() 
-    
-    # 檢查是否為非空字串，且不是字串 'nan' 或 '-'
-    return bool(value_str) and value_str.lower() not in ['nan', '-']
-
-# 僅顯示評估數字（現簡化為顯示純文字）
-def display_assessment_count(value):
-    # 由於 is_valid_data 已經確保 value 是一個清理過的字串
-    if is_valid_data(value):
-        return str(value)
-    return "-"
-
-# 格式化篩選器按鈕的高亮樣式 (保持不變)
-def style_filter_button(label, value, filter_key):
-    is_selected = st.session_state[filter_key] == value
-    style = """
+# 篩選器按鈕的高亮樣式：每次 rerun 只在師資按鈕組之前注入一次 (不必每個按鈕重複)
+FILTER_BUTTON_CSS = """
         <style>
         /* This ensures the CSS is applied to all buttons in the section */
         div.stButton > button {
@@ -300,223 +167,599 @@ def style_filter_button(label, value, filter_key):
         }
         </style>
         """
-    st.markdown(style, unsafe_allow_html=True)
-    
+
+def style_filter_button(label, value, filter_key):
+    is_selected = st.session_state[filter_key] == value
     # 設置按鈕類型以應用高亮樣式
     button_type = "primary" if is_selected else "secondary"
     
-    if st.button(label, type=button_type, key=f"btn_{filter_key}_{value}"):
-        # 如果點擊的按鈕已經被選中，則取消選擇
-        if is_selected:
-            st.session_state[filter_key] = 0
-        else:
-            st.session_state[filter_key] = value
-        st.rerun()
+    # 以 on_click 回呼更新選擇：回呼在 rerun 開始前執行，毋須再呼叫 st.rerun()
+    st.button(label, type=button_type, key=f"btn_{filter_key}_{value}", on_click=toggle_filter_value, args=(filter_key, value))
 
-# 簡化後的 display_info 函數：直接顯示文字內容
-def display_info(label, value, is_fee=False):
-    # 獲取顯示標籤 (可能包含百分比/費用的提示)
-    display_label = LABEL_MAP.get(label, label) 
-    display_value = "沒有" # 預設值
+def toggle_filter_value(filter_key, value):
+    # 如果點擊的按鈕已經被選中，則取消選擇
+    st.session_state[filter_key] = 0 if st.session_state[filter_key] == value else value
 
-    if is_valid_data(value):
-        val_str = str(value)
-        
-        # 處理網址
-        if "網頁" in label and "http" in val_str:
-            st.markdown(f"**{display_label}：** [{value}]({value})")
-            return 
-        else:
-            # 直接顯示原始文字內容
-            display_value = val_str
-    
-    elif is_fee:
-        # 由於是純文字，我們不能確定它是 0 還是空，所以只在明確為學費/堂費/家教會費時顯示 $0
-        if label in ["學費", "堂費", "家長教師會費"]:
-             display_value = "$0"
-        else:
-             display_value = "沒有"
-    
-    elif label == "關聯學校":
-        st.markdown(f"**{display_label}：** {display_value}")
-        return
-
-    st.markdown(f"**{display_label}：** {display_value}")
 # --- [END] 輔助函數 ---
 
-# --- 篩選執行函數 (RUN SEARCH LOGIC) ---
-def run_search(school_df, col_map):
-    mask = pd.Series(True, index=school_df.index)
-    
-    # 1. 學校名稱篩選
-    query = st.session_state.school_name_search.strip() if 'school_name_search' in st.session_state else ""
-    if query: mask &= school_df["學校名稱"].str.contains(query, case=False, na=False)
-
-    # 2. 側邊欄篩選 (略過細節，保持原邏輯)
-    selected_region = st.session_state.get("region", [])
-    selected_net = st.session_state.get("net", [])
-    selected_cat1 = st.session_state.get("cat1", [])
-    selected_gender = st.session_state.get("gender", [])
-    selected_religion = st.session_state.get("religion", [])
-    selected_language = st.session_state.get("lang", [])
-    selected_related = st.session_state.get("related", [])
-    selected_transport = st.session_state.get("transport", [])
-    
-    if selected_region: mask &= school_df["區域"].isin(selected_region)
-    if selected_cat1: mask &= school_df["資助類型"].isin(selected_cat1)
-    if selected_gender: mask &= school_df["學生性別"].isin(selected_gender)
-    if selected_religion: mask &= school_df["宗教"].isin(selected_religion)
-    if selected_language: mask &= school_df["教學語言"].isin(selected_language)
-    if selected_net: mask &= school_df["小一學校網"].isin(selected_net)
-    
-    if selected_related:
-        related_mask = pd.Series(False, index=school_df.index)
-        for col in selected_related:
-            if col in school_df.columns: 
-                related_mask |= school_df[col].apply(lambda x: is_valid_data(x))
-        mask &= related_mask
-    
-    if selected_transport:
-        transport_mask = pd.Series(False, index=school_df.index)
-        for col in selected_transport:
-            if col in school_df.columns: transport_mask |= (school_df[col] == "有")
-        mask &= transport_mask
-    
-    # 3. 課業和師資篩選 (使用 session state 獲取值)
-    def apply_assessment_filter_text(mask, column, selection):
-        if selection == "0次": return mask & (school_df[column] == "0")
-        elif selection == "不多於1次": return mask & ((school_df[column] == "1") | (school_df[column] == "0"))
-        elif selection == "不多於2次": return mask & ((school_df[column] == "2") | (school_df[column] == "1") | (school_df[column] == "0"))
-        elif selection == "3次": return mask & (school_df[column] == "3")
-        return mask
-    
-    # 🚨 修正：確保所有 session state 鍵都有預設值
-    selected_g1_tests = st.session_state.get('g1_tests', "不限")
-    selected_g1_exams = st.session_state.get('g1_exams', "不限")
-    selected_g2_6_tests = st.session_state.get('g2_6_tests', "不限")
-    selected_g2_6_exams = st.session_state.get('g2_6_exams', "不限")
-    use_diverse_assessment = st.session_state.get('diverse', False)
-    has_tutorial_session = st.session_state.get('tutorial', False)
-    
-    mask = apply_assessment_filter_text(mask, col_map["g1_tests"], selected_g1_tests)
-    mask = apply_assessment_filter_text(mask, col_map["g1_exams"], selected_g1_exams)
-    mask = apply_assessment_filter_text(mask, col_map["g2_6_tests"], selected_g2_6_tests)
-    mask = apply_assessment_filter_text(mask, col_map["g2_6_exams"], selected_g2_6_exams)
-    
-    if use_diverse_assessment: mask &= (school_df[col_map["g1_diverse_assessment"]] == "是")
-    if has_tutorial_session: mask &= (school_df[col_map["tutorial_session"]] == "有")
-    
-    st.session_state.filtered_schools = school_df[mask]
-    
-    # 🚨 修正：執行篩選後，強制重新運行以更新結果顯示
-    st.rerun() 
-
+# --- 名稱建議及全文摘錄 ---
+def apply_name_suggestion():
+    # pills 的 on_change 回呼：把選取的建議填入名稱搜尋欄
+    if st.session_state.get("name_suggestion"):
+        st.session_state.school_name_search = st.session_state.name_suggestion
+    st.session_state.name_suggestion = None
+
+def fulltext_snippet(row, query):
+    # 由權重最高的欄位開始，找出第一個含查詢詞的欄位並返回 (欄位, HTML 摘錄)
+    for col in sorted(FULLTEXT_BOOSTS, key=FULLTEXT_BOOSTS.get, reverse=True):
+        snippet = make_snippet(row.get(col), query)
+        if snippet:
+            return col, snippet
+    return None
+
+# --- 附近學校 (位置搜尋) ---
+# 使用者輸入的位置在 on_change 時轉為坐標，存於 session state 的 "near_point"；無法解析時為 None
+NEAR_MAX_RADIUS_KM = 50.0
+NEAR_MAX_K = 200
+DISTANCE_COL = "距離 (公里)"
+
+def resolve_near_location(engine):
+    st.session_state.near_point = engine.locate(st.session_state.get("near_location", ""))
+
+# --- 由 session state 組成查詢規格 ---
+# 師資按鈕的 session state 鍵 -> 對應百分率欄位
+TEACHER_BUTTON_FILTERS = {
+    "master_filter": "碩士／博士或以上人數百分率",
+    "exp_filter": "10年年資或以上人數百分率",
+    "sen_filter": "特殊教育培訓人數百分率",
+}
+# 各師資按鈕的門檻 (%)
+TEACHER_BUTTON_STEPS = {
+    "master_filter": (5, 15, 25),
+    "exp_filter": (20, 40, 60),
+    "sen_filter": (10, 20, 30),
+}
+# 其餘百分率欄位以滑桿設定最低門檻 (session state 鍵為 "min_" + 欄位名稱)
+TEACHER_SLIDER_COLS = [col for col in PERCENT_COLS if col not in TEACHER_BUTTON_FILTERS.values()]
+TEACHER_SLIDER_STEP = 5
+
+def snap_teacher_threshold(state_key, value):
+    # 網址中的門檻對齊到最接近的按鈕 / 滑桿刻度 (相同距離時取較低者)，令還原後的介面與實際篩選條件一致
+    steps = (0, *TEACHER_BUTTON_STEPS[state_key]) if state_key in TEACHER_BUTTON_STEPS else range(0, 101, TEACHER_SLIDER_STEP)
+    return min(steps, key=lambda step: (abs(step - value), step))
+
+def read_query_spec():
+    # 將各 widget 的 session state 轉為 search_engine 的查詢規格 (鍵見 QUERY_DEFAULTS)
+    state = st.session_state
+    spec = {key: state.get(key, default) for key, default in QUERY_DEFAULTS.items() if key not in ("name", "teacher", "include_missing", "fulltext", "near")}
+    spec["name"] = state.get("school_name_search", "")
+    thresholds = {col: state.get(key, 0) for key, col in TEACHER_BUTTON_FILTERS.items()}
+    thresholds.update({col: state.get(f"min_{col}", 0) for col in TEACHER_SLIDER_COLS})
+    spec["teacher"] = thresholds
+    spec["include_missing"] = state.get("pct_include_missing", False)
+    spec["fulltext"] = state.get("fulltext_query", "")
+    near_point = state.get("near_point")
+    if near_point:
+        spec["near"] = {"lat": near_point[0], "lon": near_point[1], "radius_km": state.get("near_radius_km", 0), "k": state.get("near_k", 0)}
+    return spec
+
+@st.cache_resource
+def get_result_cache():
+    # 所有 session 共用：熱門查詢只計算一次
+    return ResultCache()
+
+def run_query(engine):
+    """
+    每次 rerun 都會呼叫：結果 (int32 列位置) 及側邊欄計數存放在跨 session 的 ResultCache，
+    以標準化的查詢鍵 (query_key) 查找；未命中時只重新計算 selection 有改變的 facet。
+    返回 (結果列位置, selections, 側邊欄選項計數)。
+    """
+    selections = normalize_query(read_query_spec())
+    rows, option_counts = engine.query(selections, get_result_cache())
+    return rows, selections, option_counts
+
+# --- [修改後] 側邊欄篩選函數定義 ---
+SIDEBAR_FACET_LABELS = {
+    "region": "區域",
+    "net": "小一學校網",
+    "cat1": "資助類型",
+    "gender": "學生性別",
+    "religion": "宗教背景",
+    "lang": "教學語言",
+    "related": "關聯學校類型 (一條龍/直屬/聯繫)",
+    "transport": "校車服務",
+}
 
-# --- [修改後] 側邊欄篩選函數定義 (保持不變) ---
-def render_sidebar_filters(df):
+def render_sidebar_filters(filter_index, option_counts):
     """
     在 Streamlit 側邊欄中呈現所有篩選器，無分類標題。
+    選項清單來自 filter_index (每個資料版本排序一次)，每個選項後顯示套用其他篩選後的學校數目。
     """
-    
-    # 1. 區域篩選 (key="region")
-    unique_regions = sorted(df['區域'].dropna().unique().tolist())
-    st.sidebar.multiselect(
-        "區域",
-        options=unique_regions,
-        default=st.session_state.get("region", []),
-        key="region" 
-    )
+    for facet_key, label in SIDEBAR_FACET_LABELS.items():
+        counts = option_counts.get(facet_key, {})
+        st.sidebar.multiselect(
+            label,
+            options=filter_index["options"][facet_key],
+            format_func=lambda value, counts=counts: f"{value} ({counts.get(value, 0)})",
+            key=facet_key
+        )
+# --- [END] 側邊欄篩選函數定義 ---
 
-    # 2. 小一學校網篩選 (key="net")
-    # 確保小一學校網為字串類型以進行正確篩選
-    unique_school_nets = sorted(df['小一學校網'].dropna().unique().tolist())
-    st.sidebar.multiselect(
-        "小一學校網",
-        options=unique_school_nets,
-        default=st.session_state.get("net", []),
-        key="net"
-    )
 
-    # 3. 資助類型篩選 (key="cat1")
-    unique_types = sorted(df['資助類型'].dropna().unique().tolist())
-    st.sidebar.multiselect(
-        "資助類型",
-        options=unique_types,
-        default=st.session_state.get("cat1", []),
-        key="cat1"
-    )
+# --- 搜尋結果：摘要列及詳細資料 (RESULT RENDERING) ---
+PAGE_SIZE_OPTIONS = [10, 20, 50]
+SCORE_SORT = "score"
+SORT_OPTIONS = {
+    "預設排序": None,
+    "偏好評分 (高至低)": SCORE_SORT,
+    "相關文章數目 (多至少)": ("相關文章數目", False),
+    "學校名稱": ("學校名稱", True),
+    "距離 (近至遠)": (DISTANCE_COL, True), # 只在有位置條件時提供
+}
+SUMMARY_COLS = ["區域", "小一學校網", "資助類型", "學生性別", "宗教", "教學語言"]
 
-    # 4. 學生性別篩選 (key="gender")
-    unique_genders = sorted(df['學生性別'].dropna().unique().tolist())
-    st.sidebar.multiselect(
-        "學生性別",
-        options=unique_genders,
-        default=st.session_state.get("gender", []),
-        key="gender"
-    )
-        
-    # 5. 宗教篩選 (key="religion")
-    unique_religions = sorted([r for r in df['宗教'].dropna().unique().tolist() if r not in ['不適用', '無']])
-    st.sidebar.multiselect(
-        "宗教背景",
-        options=unique_religions,
-        default=st.session_state.get("religion", []),
-        key="religion"
-    )
+def paginate_results(filtered_schools, engine):
+    """
+    只返回目前頁面的學校，避免一次過渲染所有結果。返回 (目前頁面的學校, 分數)；
+    按偏好評分排序時分數為全部學校的分數陣列，否則為 None。
+    """
+    c_sort, c_size, c_page, c_info = st.columns([2, 1, 1, 2])
+    sort_labels = [label for label, sort in SORT_OPTIONS.items() if not isinstance(sort, tuple) or sort[0] in filtered_schools.columns]
+    if st.session_state.get("sort_by", sort_labels[0]) not in sort_labels:
+        st.session_state.sort_by = sort_labels[0] # 例如清除位置後不能再按距離排序
+    with c_sort:
+        sort_by = SORT_OPTIONS[st.selectbox("排序", sort_labels, key="sort_by")]
+    scores = None
+    if sort_by == SCORE_SORT:
+        weights, preferences = render_score_settings(engine.indexes["filter"])
+        scores = engine.score(weights, preferences)
+    elif sort_by:
+        filtered_schools = filtered_schools.sort_values(sort_by[0], ascending=sort_by[1], kind="stable")
+    with c_size:
+        page_size = st.selectbox("每頁顯示", PAGE_SIZE_OPTIONS, key="page_size")
+    n_pages = max(1, -(-len(filtered_schools) // page_size))
+    if st.session_state.get("page", 1) > n_pages:
+        st.session_state.page = 1
+    with c_page:
+        page = st.number_input("頁數", min_value=1, max_value=n_pages, step=1, key="page")
+    with c_info:
+        st.caption(f"第 {page} / {n_pages} 頁")
+    for name, value in [("page", page), ("sort", st.session_state.sort_by), ("size", page_size)]:
+        sync_url_param(name, value, URL_PARAM_DEFAULTS[name])
+    start = (page - 1) * page_size
+    if scores is not None:
+        # 只需找出首 page × page_size 名，毋須排序全部結果
+        top = top_k_rows(filtered_schools.index.to_numpy(), scores, start + page_size)
+        return filtered_schools.loc[top[start:]], scores
+    return filtered_schools.iloc[start:start + page_size], None
+
+# --- 偏好評分 ---
+SCORE_LABELS = {
+    "fewer_assessments": "較少測驗及考試",
+    "master_degree": "較高碩士/博士學歷比例",
+    "experienced": "較多10年或以上年資教師",
+    "fewer_classes": "較少班數 (規模較小)",
+    "school_bus": "提供校車",
+    "religion": "宗教背景符合偏好",
+    "lang": "教學語言符合偏好",
+}
+SCORE_DEFAULT_WEIGHT = 1
+SCORE_MAX_WEIGHT = 5
+
+def render_score_settings(filter_index):
+    # 權重滑桿及偏好選項；返回 (weights, preferences)。改變權重只重新計算分數，不會重新搜尋
+    weights, preferences = {}, {}
+    with st.expander("偏好評分設定", expanded=True):
+        st.caption("每項準則的權重 (0 表示不考慮)；分數為 0-100，以全部學校的數據作比較。")
+        slider_cols = st.columns(2)
+        for i, key in enumerate(SCORE_KEYS):
+            with slider_cols[i % 2]:
+                if key in SCORE_PREFERENCE_FACETS:
+                    preferences[key] = st.multiselect(SCORE_LABELS[key], filter_index["options"][key], key=f"score_pref_{key}")
+                weights[key] = st.slider(
+                    "權重" if key in SCORE_PREFERENCE_FACETS else SCORE_LABELS[key], 0, SCORE_MAX_WEIGHT,
+                    value=0 if key in SCORE_PREFERENCE_FACETS else SCORE_DEFAULT_WEIGHT, key=f"score_weight_{key}",
+                )
+    return weights, preferences
+
+def render_school_summary(school_id, row, fulltext_query="", score=None):
+    # 每間學校只顯示一行摘要；詳細資料的開關狀態記錄在 session state 的 "open_<id>"
+    c_name, c_compare, c_toggle = st.columns([5, 1, 1])
+    with c_name:
+        st.markdown(f"**{row['學校名稱']}**")
+        summary = [format_value(row.get(col)) for col in SUMMARY_COLS if is_valid_data(row.get(col))]
+        if row.get("相關文章數目", 0):
+            summary.append(f"{row['相關文章數目']} 篇相關文章")
+        if score is not None:
+            summary.append(f"評分 {score:.0f}")
+        if DISTANCE_COL in row and is_valid_data(row[DISTANCE_COL]):
+            summary.append(f"距離 {row[DISTANCE_COL]:.1f} 公里")
+        st.caption(" · ".join(summary))
+        if fulltext_query and (match := fulltext_snippet(row, fulltext_query)):
+            col, snippet = match
+            st.caption(f"{html.escape(LABEL_MAP.get(col, col))}：{snippet}", unsafe_allow_html=True)
+    with c_compare:
+        compare_ids = st.session_state.get("compare_ids", [])
+        st.checkbox(
+            "比較", value=school_id in compare_ids, key=f"compare_{school_id}",
+            on_change=toggle_compare, args=(school_id,),
+            disabled=school_id not in compare_ids and len(compare_ids) >= COMPARE_MAX_SCHOOLS,
+        )
+    with c_toggle:
+        st.toggle("詳細資料", key=f"open_{school_id}")
+
+# --- 學校比較 ---
+# 已選學校保存在 session state 的 "compare_ids" (按選取次序)，改變篩選條件後仍然保留
+def toggle_compare(school_id):
+    compare_ids = st.session_state.setdefault("compare_ids", [])
+    if school_id in compare_ids:
+        compare_ids.remove(school_id)
+    else:
+        compare_ids.append(school_id)
+    # 取代預設的學校卡片 rerun，只重新執行比較面板；已選數目跨越上限時，其他學校勾選框的 disabled 狀態改變，連同卡片一併重新執行
+    if len(compare_ids) in (COMPARE_MAX_SCHOOLS - 1, COMPARE_MAX_SCHOOLS):
+        st.rerun(["compare_panel", "school_card"])
+    st.rerun("compare_panel")
+
+def clear_compare():
+    for school_id in st.session_state.get("compare_ids", []):
+        st.session_state.pop(f"compare_{school_id}", None)
+    st.session_state.compare_ids = []
+    st.rerun(["compare_panel", "school_card"]) # 目前頁面各學校的勾選框都要取消
+
+@st.fragment(key="compare_panel")
+def render_compare_panel(school_df, engine, recorder):
+    compare_ids = st.session_state.get("compare_ids", [])
+    if not compare_ids:
+        return
+    with fragment_recorder(recorder, "compare_panel", engine):
+        render_compare_table(school_df, compare_ids)
+
+def render_compare_table(school_df, compare_ids):
+    with st.expander(f"比較已選學校 ({len(compare_ids)})", expanded=len(compare_ids) >= 2):
+        table, differs = compare_schools(school_df, compare_ids) # 已移除的學校不會列出
+        if len(table.columns) < 2:
+            st.caption("請再選取最少一間學校作比較。")
+            return
+        c_only, c_clear = st.columns([3, 1])
+        with c_only:
+            only_differences = st.checkbox("只顯示不同的項目", key="compare_only_differences")
+        with c_clear:
+            st.button("清除比較", on_click=clear_compare, width="stretch")
+        if only_differences:
+            table, differs = table[differs], differs[differs]
+            if table.empty:
+                st.info("所選學校在以上項目完全相同。")
+                return
+        table = table.map(format_value) # 最多 20 校 × 數十項，只格式化顯示文字
+        table.columns = [school_df.at[school_id, "學校名稱"] for school_id in compare_ids]
+        table.index = table.index.map(lambda key: (key[0], LABEL_MAP.get(key[1], key[1])))
+        styler = table.style.set_properties(
+            subset=pd.IndexSlice[table.index[differs.to_numpy()], :], **{"background-color": "#fff3cd"}
+        )
+        st.caption("黃色標示各校不同的項目")
+        st.dataframe(styler, width="stretch", height=min(38 * (len(table) + 1), 720))
+
+# 匯出格式 -> 按鈕標籤
+EXPORT_LABELS = {"csv": "下載 CSV", "xlsx": "下載 Excel", "html": "下載列印版 (HTML)"}
+
+def render_export_buttons(engine, result_rows):
+    # data 傳入函數：按下按鈕時才在背景執行緒分批產生檔案，平時不佔記憶體 (產生後 Streamlit 保存整個檔案，見 export_bytes)
+    columns = st.columns(len(EXPORT_LABELS))
+    for column, (fmt, label) in zip(columns, EXPORT_LABELS.items()):
+        options = {"article_index": engine.article_index, "aggregates": engine.indexes["aggregates"]} if fmt == "html" else {}
+        with column:
+            st.download_button(
+                label,
+                data=lambda fmt=fmt, options=options: export_bytes(fmt, engine.school_df, result_rows, cold=engine.cold, **options),
+                file_name=f"小學搜尋結果.{EXPORT_FORMATS[fmt][2]}",
+                mime=EXPORT_FORMATS[fmt][1],
+                on_click="ignore",
+                key=f"export_{fmt}",
+                width="stretch",
+            )
+
+@st.cache_resource
+def get_fragment_cache():
+    return FragmentCache()
+
+def render_school_detail(school_id, row, engine, col_map, recorder):
+    tab_list = available_tabs(row)
+
+    # --- 上次資料更新的變更 ---
+    changes = engine.school_changes(school_id)
+    if changes and changes["status"] == "added":
+        st.caption("🆕 此學校在上次資料更新時新增。")
+    elif changes:
+        with st.expander(f"上次資料更新的變更 ({len(changes['fields'])})", expanded=False):
+            for col, (old, new) in changes["fields"].items():
+                old, new = ("-" if value is None else format_value(value) for value in (old, new))
+                st.markdown(f"**{LABEL_MAP.get(col, col)}**：{old} → {new}")
+
+    # --- 相關文章 ---
+    related_articles = engine.article_index.get(normalize_school_name(row["學校名稱"]), ())
+    if related_articles:
+        with st.expander(f"相關文章 ({len(related_articles)})", expanded=False): 
+            for title, link in related_articles:
+                with st.container(border=True):
+                    st.markdown(f"[{title}]({link})")
+
+    # 只渲染目前選取的分頁 (st.tabs 會一次過渲染所有分頁內容)
+    selected_tab = st.segmented_control(
+        "分頁", tab_list, default=tab_list[0], key=f"tab_{school_id}", label_visibility="collapsed"
+    ) or tab_list[0]
+
+    with recorder.span("detail_tab", tab=selected_tab) as span:
+        rendered = []
+        def render():
+            rendered.append(selected_tab)
+            # 區內及校網內的百分位在建立 SearchEngine 時已計算，這裡只是查表
+            return TAB_RENDERERS[selected_tab](row, col_map, engine.percentile_ranks(school_id))
+        fragment = get_fragment_cache().get_or_render(school_id, selected_tab, engine.version, render)
+        st.markdown(fragment, unsafe_allow_html=True)
+        span.set(bytes=len(fragment), cache="miss" if rendered else "hit")
+
+# --- 局部重新執行 (FRAGMENTS) ---
+# 結果區、比較面板及每間學校的卡片各自是 st.fragment：換頁、排序及評分權重只重新執行結果區，
+# 勾選及清除比較只重新執行比較面板 (有需要時連同目前頁面的學校卡片，見 toggle_compare)，
+# 展開詳細資料、切換分頁只重新執行該學校的卡片。篩選條件 (側邊欄、名稱、師資按鈕等) 會改變結果及側邊欄計數，
+# 仍然重新執行整頁。
+@contextlib.contextmanager
+def fragment_recorder(recorder, scope, engine):
+    # 整頁 rerun 時沿用該次的 recorder；只重新執行 fragment 時 (recorder 已完成) 另建一個，結束時以 scope 記錄
+    if not recorder.finished:
+        yield recorder
+        return
+    own = SpanRecorder(enabled=recorder.enabled)
+    yield own
+    finish_instrumentation(own, engine, scope)
+
+@st.fragment
+def render_results(engine, filtered_schools, result_rows, selections, recorder):
+    with fragment_recorder(recorder, "results", engine) as recorder:
+        st.divider()
+        st.subheader(f"篩選結果：共找到 {len(filtered_schools)} 間學校")
+
+        render_compare_panel(engine.school_df, engine, recorder) # 已選學校不受目前的篩選條件影響
+        if filtered_schools.empty:
+            st.warning("找不到符合所有篩選條件的學校。")
+            return
+        render_export_buttons(engine, result_rows)
+        with recorder.span("results") as span:
+            page_schools, scores = paginate_results(filtered_schools, engine)
+            for school_id, row in page_schools.iterrows():
+                score = None if scores is None else scores[school_id]
+                render_school_card(school_id, row, engine, selections["fulltext"], score, recorder)
+            span.set(count=len(page_schools))
+
+@st.fragment(key="school_card")
+def render_school_card(school_id, row, engine, fulltext_query, score, recorder):
+    with fragment_recorder(recorder, "school_card", engine) as recorder:
+        is_open = st.session_state.get(f"open_{school_id}", False)
+        if fulltext_query or is_open:
+            row = engine.school_record(school_id, row) # 摘錄及詳細資料需要冷資料的敘述欄位
+        with st.container(border=True):
+            render_school_summary(school_id, row, fulltext_query, score)
+            if is_open:
+                render_school_detail(school_id, row, engine, COL_MAP, recorder)
+
+# 資料更新後 school id (列位置) 可能改變：按 engine.id_remap 更新已選比較及已展開詳細資料的學校，無法對應時清除。
+# "compare_<id>" 勾選框的值由 compare_ids 決定，"tab_<id>" 有預設分頁 (不可經 session state 設定)，兩者只需刪去舊鍵
+SCHOOL_STATE_PREFIXES = ("open_", "tab_", "compare_")
+
+def migrate_session_ids(engine):
+    state = st.session_state
+    previous = state.get("engine_version")
+    state.engine_version = engine.version
+    if previous is None or previous == engine.version:
+        return
+    remap = engine.id_remap[1] if engine.id_remap and engine.id_remap[0] == previous else None
+    def new_id(school_id):
+        if remap is None or not 0 <= school_id < len(remap) or remap[school_id] < 0:
+            return None
+        return int(remap[school_id])
+    state.compare_ids = [school_id for school_id in map(new_id, state.get("compare_ids", [])) if school_id is not None]
+    moved = {}
+    for key in [key for key in state if key.startswith(SCHOOL_STATE_PREFIXES)]:
+        prefix, _, school_id = key.partition("_")
+        if school_id.isdigit():
+            value = state.pop(key)
+            if prefix == "open" and new_id(int(school_id)) is not None:
+                moved[f"{prefix}_{new_id(int(school_id))}"] = value
+    state.update(moved)
+    st.toast("學校資料已更新至最新版本。")
+# --- [END] 搜尋結果函數定義 ---
+
+# --- 可分享的網址 (?q=<query_key>&page=&sort=&size=) ---
+URL_PARAM_DEFAULTS = {"page": 1, "sort": next(iter(SORT_OPTIONS)), "size": PAGE_SIZE_OPTIONS[0]}
+
+def restore_query_from_url(indexes):
+    """
+    session 首次執行時，把網址中的查詢條件寫入各 widget 的 session state。
+    q 為 query_key() 的 JSON，經 normalize_query 驗證；不存在的選項會被略去。返回是否有還原任何條件。
+    """
+    params = st.query_params
+    state = st.session_state
+    filter_index = indexes["filter"]
+    restored = False
+    if "q" in params:
+        try:
+            spec = canonical_spec(normalize_query(json.loads(params["q"])))
+        except (ValueError, TypeError):
+            st.warning("網址中的搜尋條件無效，已略去。")
+            spec = {}
+        for key, value in spec.items():
+            if key in filter_index["options"]:
+                state[key] = [option for option in value if option in filter_index["options"][key]]
+            elif key == "name":
+                state.school_name_search = value
+            elif key == "fulltext":
+                state.fulltext_query = value
+            elif key == "include_missing":
+                state.pct_include_missing = value
+            elif key == "near":
+                if indexes["spatial"] is None:
+                    continue # 沒有坐標表時略去位置條件
+                state.near_point = (value["lat"], value["lon"])
+                state.near_location = f"{value['lat']}, {value['lon']}"
+                state.near_radius_km = min(NEAR_MAX_RADIUS_KM, value.get("radius_km", 0.0))
+                state.near_k = min(NEAR_MAX_K, value.get("k", 0))
+            elif key == "teacher":
+                button_keys = {col: state_key for state_key, col in TEACHER_BUTTON_FILTERS.items()}
+                for col, threshold in value.items():
+                    state_key = button_keys.get(col, f"min_{col}")
+                    state[state_key] = snap_teacher_threshold(state_key, threshold)
+            else:
+                state[key] = value # 課業安排的 selectbox/checkbox 與查詢規格同名
+        restored = bool(spec)
+    if params.get("sort") in SORT_OPTIONS:
+        state.sort_by = params["sort"]
+    if params.get("size", "").isdigit() and int(params["size"]) in PAGE_SIZE_OPTIONS:
+        state.page_size = int(params["size"])
+    if params.get("page", "").isdigit() and int(params["page"]) >= 1:
+        state.page = int(params["page"]) # 超出頁數時由 paginate_results 重設為 1
+    return restored
+
+def sync_url_param(name, value, default=None):
+    # 只在值改變時更新網址 (每次寫入 st.query_params 都會傳送到瀏覽器)；預設值不寫入網址
+    value = None if value == default else str(value)
+    if st.query_params.get(name) != value:
+        if value is None:
+            del st.query_params[name]
+        else:
+            st.query_params[name] = value
+# --- [END] 可分享的網址 ---
 
-    # 6. 教學語言篩選 (key="lang")
-    unique_languages = sorted(df['教學語言'].dropna().unique().tolist())
-    st.sidebar.multiselect(
-        "教學語言",
-        options=unique_languages,
-        default=st.session_state.get("lang", []),
-        key="lang"
-    )
 
-    # 7. 關聯學校類型 (key="related")
-    st.sidebar.multiselect(
-        "關聯學校類型 (一條龍/直屬/聯繫)", 
-        ["一條龍中學", "直屬中學", "聯繫中學"], 
-        default=st.session_state.get("related", []),
-        key="related"
-    )
+# --- 效能記錄 (INSTRUMENTATION) ---
+# 設定此環境變數即為所有 session 啟用記錄並寫入檔案："1" 寫入 .cache/metrics，"0" 或空白為停用，其他值視為輸出目錄。
+# 個別 session 可在網址加上 ?debug=1 在側邊欄顯示偵錯面板；該 session 的記錄只保存在記憶體，不寫入檔案。
+METRICS_ENV = "SCHOOL_SEARCH_METRICS"
 
-    # 8. 校車服務 (key="transport")
-    st.sidebar.multiselect(
-        "校車服務", 
-        ["校車", "保姆車"], 
-        default=st.session_state.get("transport", []),
-        key="transport" 
-    )
-    
-    pass
-# --- [END] 側邊欄篩選函數定義 ---
+@st.cache_resource
+def get_metrics_registry():
+    return MetricsRegistry()
+
+def metrics_enabled():
+    return os.environ.get(METRICS_ENV, "").strip() not in ("", "0")
 
+def metrics_dir():
+    value = os.environ.get(METRICS_ENV, "").strip()
+    return os.path.join(CACHE_DIR, "metrics") if value in ("", "1") else value
 
-school_df, article_df = load_data()
+def debug_panel_enabled():
+    return st.query_params.get("debug") == "1"
+
+def finish_instrumentation(recorder, engine, scope="app"):
+    """
+    每次 rerun 結束時：累積到進程內的指標，啟用 METRICS_ENV 時附加 JSON Lines 及更新 Prometheus textfile，並按需要顯示面板。
+    scope 為 "app" (整頁) 或只重新執行的 fragment 名稱；各範圍的次數記在 session state 的 "rerun_counts"。
+    """
+    recorder.finished = True
+    if not recorder.enabled:
+        return
+    st.session_state.rerun_count = st.session_state.get("rerun_count", 0) + 1
+    rerun_counts = st.session_state.setdefault("rerun_counts", {})
+    rerun_counts[scope] = rerun_counts.get(scope, 0) + 1
+    session = st.session_state.setdefault("session_tag", uuid.uuid4().hex[:8])
+    registry = get_metrics_registry()
+    registry.observe_rerun(recorder, scope)
+    registry.set_gauges("fragment_cache", get_fragment_cache().stats())
+    registry.set_gauges("result_cache", get_result_cache().stats())
+    if engine.cold is not None:
+        registry.set_gauges("cold_store", engine.cold.stats())
+    record = recorder.record(session=session, rerun=st.session_state.rerun_count, scope=scope)
+    if metrics_enabled(): # 只由部署者啟用；?debug=1 的訪客不會令伺服器寫入檔案
+        try:
+            append_jsonl(os.path.join(metrics_dir(), "spans.jsonl"), record)
+            write_textfile(os.path.join(metrics_dir(), "metrics.prom"), registry.render_prometheus())
+        except OSError:
+            pass # 記錄失敗不應影響頁面
+    if scope == "app" and debug_panel_enabled(): # fragment 不可寫入側邊欄
+        render_debug_panel(record, registry, engine)
+
+def render_debug_panel(record, registry, engine):
+    with st.sidebar.expander("⏱️ 效能偵錯", expanded=True):
+        st.caption(f"Session {record['session']} 第 {record['rerun']} 次 rerun：{record['total_ms']:.1f} ms")
+        st.caption("各範圍的 rerun 次數 (app 為整頁)：" + "，".join(f"{scope} {count}" for scope, count in st.session_state.rerun_counts.items()))
+        st.dataframe(
+            [
+                {
+                    "階段": "　" * span["depth"] + span["name"] + (f" ({span['tab']})" if "tab" in span else ""),
+                    "ms": round(span["duration_ms"], 2),
+                    "數目": span.get("count"),
+                    "bytes": span.get("bytes"),
+                    "快取": span.get("cache"),
+                }
+                for span in record["spans"]
+            ],
+            hide_index=True,
+        )
+        st.caption("HTML 片段快取")
+        st.json(get_fragment_cache().stats(), expanded=False)
+        st.caption("查詢結果快取")
+        st.json(get_result_cache().stats(), expanded=False)
+        if engine.cold is not None:
+            st.caption("敘述欄位冷資料 (LRU)")
+            st.json(engine.cold.stats(), expanded=False)
+        st.download_button("下載本次記錄 (JSON Lines)", json.dumps(record, ensure_ascii=False, default=str) + "\n", file_name="spans.jsonl")
+        st.download_button("下載 Prometheus 指標", registry.render_prometheus(), file_name="metrics.prom")
+
+
+recorder = SpanRecorder(enabled=metrics_enabled() or debug_panel_enabled())
+with recorder.span("load_data"):
+    engine = load_engine()
+    version = None if engine is None else engine.version
+
+# --- 初始化 session state (非 widget 的鍵需在首次執行時設定預設值) ---
+for state_key, default_value in {
+    "master_filter": 0,
+    "exp_filter": 0,
+    "sen_filter": 0,
+}.items():
+    if state_key not in st.session_state:
+        st.session_state[state_key] = default_value
 
 # --- 主應用程式 ---
-if school_df is not None and article_df is not None:
-
-    col_map = {
-        "g1_tests": "全年全科測驗次數_一年級", "g1_exams": "全年全科考試次數_一年級",
-        "g1_diverse_assessment": "小一上學期以多元化的進展性評估代替測驗及考試",
-        "g2_6_tests": "全年全科測驗次數_二至六年級", "g2_6_exams": "全年全科考試次數_二至六年級",
-        "tutorial_session": "按校情靈活編排時間表_盡量在下午安排導修時段_讓學生能在教師指導下完成部分家課",
-        "no_test_after_holiday": "避免緊接在長假期後安排測考_讓學生在假期有充分的休息",
-        "diverse_learning_assessment": "多元學習評估",
-        "班級教學模式": "班級教學模式", 
-        "分班安排": "分班安排"          
-    }
+if engine is not None:
+
+    school_df = engine.school_df
+    indexes = engine.indexes
+
+    migrate_session_ids(engine)
+
+    # 0. 由分享的網址開啟時，先還原搜尋條件及頁數 (每個 session 只做一次)
+    if "url_restored" not in st.session_state:
+        st.session_state.url_restored = True
+        if restore_query_from_url(indexes) or "page" in st.query_params:
+            # 預先記下查詢鍵，避免下面把網址指定的頁數重設為第一頁
+            st.session_state.results_key = (version, query_key(normalize_query(read_query_spec())))
+
+    # 1. 即時計算結果：widget 的值在 rerun 開始時已在 session state，可先計算再呈現側邊欄計數
+    #    結果來自跨 session 的快取；未命中時只重新計算選擇有改變的篩選條件
+    with recorder.span("run_search") as span:
+        result_rows, selections, option_counts = run_query(engine)
+        span.set(count=len(result_rows))
+    results_key = (version, query_key(selections))
+    if st.session_state.get("results_key") != results_key:
+        st.session_state.results_key = results_key
+        st.session_state.page = 1 # 篩選條件改變後由第一頁開始顯示
+    sync_url_param("q", results_key[1], "{}")
+    filtered_schools = school_df.iloc[result_rows]
+    distances = engine.distances(selections["near"], result_rows)
+    if distances is not None:
+        filtered_schools = filtered_schools.assign(**{DISTANCE_COL: distances})
+
+    # 2. 呼叫側邊欄篩選器 (保持在側邊欄)
+    with recorder.span("render_sidebar_filters") as span:
+        render_sidebar_filters(indexes["filter"], option_counts)
+        span.set(count=sum(len(counts) for counts in option_counts.values()))
 
-    # 1. 呼叫側邊欄篩選器 (保持在側邊欄)
-    render_sidebar_filters(school_df) 
-    
     # 創建一個容器來顯示結果
     results_container = st.container()
 
     # **********************************************
-    # *********** 2. 篩選組件區 ***********
+    # *********** 3. 篩選組件區 ***********
     # **********************************************
     
     school_name_query = st.text_input(
@@ -524,458 +767,82 @@ if school_df is not None and article_df is not None:
         placeholder="請輸入學校名稱關鍵字...", 
         key="school_name_search"
     )
+
+    # 名稱自動完成建議 (由 n-gram 索引提供)
+    name_suggestions = suggest_school_names(indexes["name"], school_name_query)
+    if name_suggestions and name_suggestions != [school_name_query.strip()]:
+        st.pills("建議學校", name_suggestions, key="name_suggestion", on_change=apply_name_suggestion, label_visibility="collapsed")
+
+    st.text_input(
+        "搜尋學校特色及教學內容",
+        placeholder="例如：STEM、電子學習、閱讀...",
+        key="fulltext_query"
+    )
+
+    if indexes["spatial"] is not None: # 只在有坐標表時提供
+        with st.expander("根據位置搜尋 (附近學校)", expanded=bool(selections["near"])):
+            st.text_input(
+                "位置",
+                placeholder="輸入學校名稱，或「緯度, 經度」例如 22.38, 114.19",
+                key="near_location", on_change=resolve_near_location, args=(engine,),
+            )
+            if st.session_state.get("near_location", "").strip() and not st.session_state.get("near_point"):
+                st.caption("找不到此位置：請輸入有坐標的學校名稱，或「緯度, 經度」。")
+            c_radius, c_k = st.columns(2)
+            with c_radius:
+                st.number_input("半徑 (公里，0 為不限)", min_value=0.0, max_value=NEAR_MAX_RADIUS_KM, step=0.5, key="near_radius_km")
+            with c_k:
+                st.number_input("最近學校數目 (0 為不限)", min_value=0, max_value=NEAR_MAX_K, step=5, key="near_k")
     
     with st.expander("根據課業安排篩選"):
         assessment_options = ["不限", "0次", "不多於1次", "不多於2次", "3次"]
         
         c1, c2, c3, c4 = st.columns(4)
         with c1:
-            st.selectbox("一年級測驗次數", assessment_options, key="g1_tests", index=assessment_options.index(st.session_state.g1_tests) if st.session_state.g1_tests in assessment_options else 0)
+            st.selectbox("一年級測驗次數", assessment_options, key="g1_tests")
         with c2:
-            st.selectbox("一年級考試次數", assessment_options, key="g1_exams", index=assessment_options.index(st.session_state.g1_exams) if st.session_state.g1_exams in assessment_options else 0)
+            st.selectbox("一年級考試次數", assessment_options, key="g1_exams")
         with c3:
-            st.selectbox("二至六年級測驗次數", assessment_options, key="g2_6_tests", index=assessment_options.index(st.session_state.g2_6_tests) if st.session_state.g2_6_tests in assessment_options else 0)
+            st.selectbox("二至六年級測驗次數", assessment_options, key="g2_6_tests")
         with c4:
-            st.selectbox("二至六年級考試次數", assessment_options, key="g2_6_exams", index=assessment_options.index(st.session_state.g2_6_exams) if st.session_state.g2_6_exams in assessment_options else 0)
+            st.selectbox("二至六年級考試次數", assessment_options, key="g2_6_exams")
 
         c5, c6 = st.columns(2)
         with c5:
-            st.checkbox("小一上學期以多元化評估代替測考", key="diverse", value=st.session_state.diverse)
+            st.checkbox("小一上學期以多元化評估代替測考", key="diverse")
         with c6:
-            st.checkbox("下午設導修課 (教師指導家課)", key="tutorial", value=st.session_state.tutorial)
+            st.checkbox("下午設導修課 (教師指導家課)", key="tutorial")
     
     # --- [START] 師資按鈕篩選 UI (保持按鈕佈局) ---
     with st.expander("根據師資等級搜尋"):
-        
-        st.markdown("**碩士/博士或以上學歷 (%)**")
-        col_master1, col_master2, col_master3 = st.columns(3)
-        with col_master1: style_filter_button("最少 5%", 5, 'master_filter')
-        with col_master2: style_filter_button("最少 15%", 15, 'master_filter')
-        with col_master3: style_filter_button("最少 25%", 25, 'master_filter')
-
-        st.markdown("**10年或以上年資 (%)**")
-        col_exp1, col_exp2, col_exp3 = st.columns(3)
-        with col_exp1: style_filter_button("最少 20%", 20, 'exp_filter')
-        with col_exp2: style_filter_button("最少 40%", 40, 'exp_filter')
-        with col_exp3: style_filter_button("最少 60%", 60, 'exp_filter')
-        
-        st.markdown("**特殊教育培訓 (%)**")
-        col_sen1, col_sen2, col_sen3 = st.columns(3)
-        with col_sen1: style_filter_button("最少 10%", 10, 'sen_filter')
-        with col_sen2: style_filter_button("最少 20%", 20, 'sen_filter')
-        with col_sen3: style_filter_button("最少 30%", 30, 'sen_filter')
+        st.markdown(FILTER_BUTTON_CSS, unsafe_allow_html=True)
+        for filter_key, title in [("master_filter", "碩士/博士或以上學歷 (%)"), ("exp_filter", "10年或以上年資 (%)"), ("sen_filter", "特殊教育培訓 (%)")]:
+            st.markdown(f"**{title}**")
+            for column, step in zip(st.columns(len(TEACHER_BUTTON_STEPS[filter_key])), TEACHER_BUTTON_STEPS[filter_key]):
+                with column: style_filter_button(f"最少 {step}%", step, filter_key)
+
+        st.markdown("**其他師資指標 (最少 %)**")
+        slider_cols = st.columns(2)
+        for i, col in enumerate(TEACHER_SLIDER_COLS):
+            with slider_cols[i % 2]:
+                st.slider(LABEL_MAP.get(col, col), 0, 100, step=TEACHER_SLIDER_STEP, key=f"min_{col}")
+
+        st.checkbox("包括沒有相關師資數據的學校", key="pct_include_missing")
     # --- [END] 師資按鈕篩選 UI ---
 
     st.write("") 
     
-    # 3. 「搜尋學校」按鈕 (放在篩選組件下方)
-    if st.button("🚀 搜尋學校", type="primary", use_container_width=True):
-        # 呼叫獨立的搜尋函數，更新 filtered_schools
-        run_search(school_df, col_map)
-        
-    st.write("") # 增加按鈕和結果之間的間距
-
     # **********************************************
     # *********** 下半部：結果和回到最頂 ***********
     # **********************************************
 
-    # 4. 搜尋結果區 (只在有結果時顯示)
-    if not st.session_state.filtered_schools.empty:
-        
-        # --- 內容組織變數定義 ---
-        fee_cols = ["學費", "堂費", "家長教師會費", "非標準項目的核准收費", "其他收費_費用", "學費減免"]
-        teacher_stat_cols = [
-            "已接受師資培訓人數百分率", "學士人數百分率", "碩士／博士或以上人數百分率", 
-            "特殊教育培訓人數百分率", "0至4年年資人數百分率", "5至9年年資人數百分率", 
-            "10年年資或以上人數百分率", "核准編制教師職位數目", "教師總人數", 
-            "教師專業培訓及發展"
-        ]
-        
-        facility_cols_counts = ["課室數目", "禮堂數目", "操場數目", "圖書館數目"]
-        facility_cols_text = ["特別室", "其他學校設施", "支援有特殊教育需要學生的設施", "環保政策"]
-        
-        
-        # 主分類 6: 辦學理念 (更新欄位列表, 移除被移動的)
-        philosophy_display_cols = ["辦學宗旨", "學校管理架構", "環保政策", "學校特色_其他", "校風", "學校發展計劃"]
-        
-        # 主分類 2: 學業評估與校園生活 (新增欄位列表)
-        curriculum_cols = ["學校關注事項", "學習和教學策略", "小學教育課程更新重點的發展", "共通能力的培養", "正確價值觀_態度和行為的培養", "課程剪裁及調適措施"]
-        collaboration_and_life_cols = ["家校合作", "健康校園生活", "全方位學習", "學校生活備註"]
-        student_support_cols = ["全校參與照顧學生的多樣性", "全校參與模式融合教育", "非華語學生的教育支援"]
-        
-        # 確保 all_philosophy_cols 被正確定義
-        all_philosophy_cols = ["校訓"] + philosophy_display_cols
-        
-        # --- 開始顯示結果 ---
-        with results_container:
-            st.divider()
-            filtered_schools = st.session_state.filtered_schools
-            st.subheader(f"篩選結果：共找到 {len(filtered_schools)} 間學校")
-            
-            if filtered_schools.empty:
-                st.warning("找不到符合所有篩選條件的學校。")
-            else:
-                
-                for index, row in filtered_schools.iterrows():
-                    # 判斷是否有辦學理念資料
-                    has_mission_data = any(is_valid_data(row.get(col)) for col in all_philosophy_cols)
-                    
-                    # 建立 tabs 列表
-                    tab_list = ["基本資料", "學業評估與校園生活", "師資概況", "學校設施", "班級結構"]
-                    if has_mission_data:
-                        tab_list.append("辦學理念") 
-                    tab_list.append("聯絡資料")
-                    
-                    with st.expander(f"**{row['學校名稱']}**"):
-                        
-                        # --- 相關文章 (不變) ---
-                        related_articles = article_df[article_df["學校名稱"] == row["學校名稱"]] 
-                        if not related_articles.empty:
-                            with st.expander("相關文章", expanded=False): 
-                                for _, article_row in related_articles.iterrows():
-                                    title, link = article_row.get('文章標題'), article_row.get('文章連結')
-                                    if pd.notna(title) and pd.notna(link):
-                                        with st.container(border=True):
-                                            st.markdown(f"[{title}]({link})")
-
-                        tabs = st.tabs(tab_list)
-
-                        # --- TAB 1: 基本資料 ---
-                        with tabs[0]:
-                            
-                            # --- 學校概覽 (新增宗教、教學語言) ---
-                            st.subheader("學校概覽")
-                            c1, c2 = st.columns(2)
-                            with c1: 
-                                display_info("區域", row.get("區域"))
-                                display_info("學校類別1", row.get("資助類型"))
-                                display_info("創校年份", row.get("創校年份"))
-                                display_info("宗教", row.get("宗教")) 
-                                display_info("教學語言", row.get("教學語言")) 
-                            with c2: 
-                                display_info("小一學校網", row.get("小一學校網"))
-                                display_info("學校類別2", row.get("上課時間"))
-                                display_info("學生性別", row.get("學生性別"))
-                                display_info("學校佔地面積", row.get("學校佔地面積"))
-                            
-                            # --- 校長與組織 (新增法團校董會/校管會/校董會) ---
-                            st.divider()
-                            st.subheader("校長與組織")
-                            c11, c12 = st.columns(2)
-                            with c11:
-                                principal_name = str(row.get("校長姓名", "")).strip()
-                                principal_title = str(row.get("校長稱謂", "")).strip()
-                                principal_display = f"{principal_name}{principal_title}" if is_valid_data(principal_name) else None
-                                display_info("校長", principal_display)
-                                display_info("辦學團體", row.get("辦學團體"))
-                                display_info("家長教師會", row.get("家長教師會"))
-                                # NEW: 法團校董會/校管會/校董會
-                                display_info("法團校董會_校管會_校董會", row.get("法團校董會_校管會_校董會")) 
-                                display_info("校監和校董_校管會主席和成員的培訓達標率", row.get("校監和校董_校管會主席和成員的培訓達標率"))
-                            with c12:
-                                supervisor_name = str(row.get("校監_校管會主席姓名", "")).strip()
-                                supervisor_title = str(row.get("校監_校管會主席稱謂", "")).strip()
-                                supervisor_display = f"{supervisor_name}{supervisor_title}" if is_valid_data(supervisor_name) else None
-                                display_info("校監_校管會主席姓名", supervisor_display)
-                                display_info("舊生會_校友會", row.get("舊生會_校友會"))
-                            
-                            # --- 關聯學校 (原「關聯與交通」) ---
-                            st.divider()
-                            st.subheader("關聯學校")
-                            related_dragon_val = row.get("一條龍中學")
-                            related_feeder_val = row.get("直屬中學")
-                            related_linked_val = row.get("聯繫中學")
-                            
-                            has_dragon = is_valid_data(related_dragon_val)
-                            has_feeder = is_valid_data(related_feeder_val)
-                            has_linked = is_valid_data(related_linked_val)
-                            
-                            if has_dragon or has_feeder or has_linked:
-                                c_rel1, c_rel2, c_rel3 = st.columns(3)
-                                with c_rel1: display_info("一條龍中學", related_dragon_val)
-                                with c_rel2: display_info("直屬中學", related_feeder_val)
-                                with c_rel3: display_info("聯繫中學", related_linked_val)
-                            else:
-                                st.info("沒有關聯學校資料。")
-
-
-                            # --- 上學、午膳、放學、交通安排 (新增校車、保姆車) ---
-                            st.divider()
-                            st.subheader("上學、午膳、放學、交通安排")
-                            
-                            c_time1, c_time2 = st.columns(2)
-                            with c_time1: display_info("上課時間_", row.get("上課時間_")) 
-                            with c_time2: display_info("放學時間", row.get("放學時間")) 
-                            
-                            c_lunch1, c_lunch2 = st.columns(2)
-                            with c_lunch1: display_info("午膳時間", row.get("午膳時間")) 
-                            with c_lunch2: display_info("午膳結束時間", row.get("午膳結束時間"))
-                            
-                            c_lunch3, c_transport1, c_transport2 = st.columns(3)
-                            with c_lunch3: display_info("午膳安排", row.get("午膳安排"))
-                            
-                            # NEW: 交通安排 (校車, 保姆車)
-                            with c_transport1: display_info("校車", row.get("校車")) 
-                            with c_transport2: display_info("保姆車", row.get("保姆車")) 
-
-
-                            # --- 費用與資助 (新增學費減免) ---
-                            st.divider()
-                            st.subheader("費用與資助")
-                            
-                            c_fee1, c_fee2, c_fee3 = st.columns(3)
-                            with c_fee1:
-                                display_info("學費", row.get("學費"), is_fee=True)
-                                display_info("非標準項目的核准收費", row.get("非標準項目的核准收費"), is_fee=True)
-                            with c_fee2:
-                                display_info("堂費", row.get("堂費"), is_fee=True)
-                                display_info("其他收費_費用", row.get("其他收費_費用"), is_fee=True)
-                            with c_fee3:
-                                display_info("家長教師會費", row.get("家長教師會費"), is_fee=True)
-                                display_info("學費減免", row.get("學費減免")) # NEW: 學費減免
-                            
-                            
-                        # --- TAB 2: 學業評估與校園生活 (原: 學業評估與安排) ---
-                        with tabs[1]:
-                            st.subheader("學業評估與安排")
-                            
-                            st.markdown("##### 測驗與考試次數")
-                            
-                            # 測驗與考試次數 - HTML Table (顯示純文字)
-                            assessment_table_html = f"""
-                            <table class="clean-table assessment-table">
-                                <thead>
-                                    <tr>
-                                        <th style="width: 35%;"></th>
-                                        <th>測驗次數</th>
-                                        <th>考試次數</th>
-                                    </tr>
-                                </thead>
-                                <tbody>
-                                    <tr>
-                                        <td>一年級</td>
-                                        <td>{display_assessment_count(row.get(col_map["g1_tests"]))}</td>
-                                        <td>{display_assessment_count(row.get(col_map["g1_exams"]))}</td>
-                                    </tr>
-                                    <tr>
-                                        <td>二至六年級</td>
-                                        <td>{display_assessment_count(row.get(col_map["g2_6_tests"]))}</td>
-                                        <td>{display_assessment_count(row.get(col_map["g2_6_exams"]))}</td>
-                                    </tr>
-                                </tbody>
-                            </table>
-                            """
-                            st.markdown(assessment_table_html, unsafe_allow_html=True)
-                            
-                            st.divider()
-
-                            st.markdown("##### 課業及教學模式")
-                            
-                            # 政策與教學模式 - HTML List
-                            all_policy_data = [
-                                ("g1_diverse_assessment", "小一上學期多元化評估"),
-                                ("tutorial_session", "下午設導修課"),
-                                ("no_test_after_holiday", "避免長假期後測考"),
-                                ("分班安排", "分班安排"),
-                                ("班級教學模式", "班級教學模式"),
-                                ("diverse_learning_assessment", "多元學習評估"),
-                            ]
-                            
-                            policy_list_html = ""
-                            
-                            for field_key, label in all_policy_data:
-                                # 獲取值，並將內部的 \n 轉換為 <br>
-                                value = str(row.get(field_key, "沒有")).replace('\n', '<br>')
-                                
-                                # 使用 CSS class 模擬 Key-Value 列表
-                                policy_list_html += f"""
-                                    <div class="policy-list-item">
-                                        <strong>{label}：</strong>{value}
-                                    </div>
-                                """
-                            
-                            st.markdown(policy_list_html, unsafe_allow_html=True)
-                            
-                            # --- 課程發展與策略 ---
-                            st.divider()
-                            st.subheader("課程發展與策略")
-                            for col in curriculum_cols:
-                                display_info(col, row.get(col))
-
-                            # --- 協作與校園生活 (Moved) ---
-                            st.divider()
-                            st.subheader("協作與校園生活")
-                            for col in collaboration_and_life_cols:
-                                display_info(col, row.get(col))
-
-                            # --- 學生支援與關顧 (Moved) ---
-                            st.divider()
-                            st.subheader("學生支援與關顧")
-                            for col in student_support_cols:
-                                display_info(col, row.get(col))
-
-                                
-                        # --- TAB 3: 師資概況 ---
-                        with tabs[2]:
-                            st.subheader("師資團隊數字")
-                            
-                            # 1. 師資團隊數字 (顯示純文字)
-                            c1, c2 = st.columns(2)
-                            with c1:
-                                display_info("核准編制教師職位數目", row.get("核准編制教師職位數目")) 
-                            with c2:
-                                display_info("教師總人數", row.get("教師總人數"))
-
-                            st.divider()
-                            st.subheader("教師團隊學歷及年資") 
-                            
-                            col_left, col_right = st.columns(2)
-
-                            # --- 1. ACADEMICS/TRAINING DATA GENERATION (顯示純文字) ---
-                            qual_cols_map = {
-                                "已接受師資培訓人數百分率": "已接受師資培訓 (%)", 
-                                "學士人數百分率": "學士學位 (%)", 
-                                "碩士／博士或以上人數百分率": "碩士/博士學位 (%)", 
-                                "特殊教育培訓人數百分率": "特殊教育培訓 (%)"
-                            }
-                            qual_rows_html = ""
-                            for col_name, display_label in qual_cols_map.items():
-                                value = row.get(col_name, "-")
-                                display_value = value
-                                qual_rows_html += f"""<tr><td>{display_label}</td><td>{display_value}</td></tr>"""
-                            
-                            # --- 2. SENIORITY DATA GENERATION (顯示純文字) ---
-                            seniority_cols_map = {
-                                "0至4年年資人數百分率": "0-4年年資 (%)", 
-                                "5至9年年資人數百分率": "5-9年年資 (%)", 
-                                "10年年資或以上人數百分率": "10+年年資 (%)"
-                            }
-                            seniority_rows_html = ""
-                            for col_name, display_label in seniority_cols_map.items():
-                                value = row.get(col_name, "-")
-                                display_value = value
-                                seniority_rows_html += f"""<tr><td>{display_label}</td><td>{display_value}</td></tr>"""
-
-                            # Combine and display
-                            with col_left:
-                                st.markdown(f"""
-                                    <div style="font-weight: bold; margin-bottom: 8px;">學歷及培訓</div>
-                                    <table class="info-table">
-                                        {qual_rows_html}
-                                    </table>
-                                """, unsafe_allow_html=True)
-                                
-                            with col_right:
-                                 st.markdown(f"""
-                                    <div style="font-weight: bold; margin-bottom: 8px;">年資分佈</div>
-                                    <table class="info-table">
-                                        {seniority_rows_html}
-                                    </table>
-                                """, unsafe_allow_html=True)
-
-                            st.divider()
-                            display_info("教師專業培訓及發展", row.get("教師專業培訓及發展"))
-
-
-                        # --- TAB 4: 學校設施 ---
-                        with tabs[3]:
-                            st.subheader("設施數量")
-                            # 1. 顯示數量統計 (顯示純文字)
-                            col_count1, col_count2 = st.columns(2)
-                            with col_count1:
-                                display_info("課室數目", row.get("課室數目"))
-                                display_info("操場數目", row.get("操場數目"))
-                            with col_count2:
-                                display_info("禮堂數目", row.get("禮堂數目"))
-                                display_info("圖書館數目", row.get("圖書館數目"))
-                            
-                            st.divider()
-                            st.subheader("設施詳情與環境政策")
-                            # 2. 顯示詳情 (顯示純文字)
-                            facility_cols_text_new = ["特別室", "其他學校設施", "支援有特殊教育需要學生的設施", "環保政策"]
-                            
-                            for col in facility_cols_text_new:
-                                display_info(col, row.get(col))
-
-                        # --- TAB 5: 班級結構 ---
-                        with tabs[4]:
-                            st.subheader("班級結構")
-                            grades_internal = ["小一", "小二", "小三", "小四", "小五", "小六", "總"]
-                            # 班級數值將以純文字形式讀取
-                            last_year_data = [row.get(f"上學年{g}班數", "-") for g in grades_internal]
-                            this_year_data = [row.get(f"本學年{g}班數", "-") for g in grades_internal]
-                            
-                            # 班級結構 - HTML Table (顯示純文字)
-                            class_table_html = f"""
-                            <table class="clean-table class-table">
-                                <thead>
-                                    <tr>
-                                        <th></th>
-                                        <th>小一</th>
-                                        <th>小二</th>
-                                        <th>小三</th>
-                                        <th>小四</th>
-                                        <th>小五</th>
-                                        <th>小六</th>
-                                        <th>總數</th>
-                                    </tr>
-                                </thead>
-                                <tbody>
-                                    <tr>
-                                        <td>**上學年班數**</td>
-                                        <td style="text-align: center;">{last_year_data[0]}</td>
-                                        <td style="text-align: center;">{last_year_data[1]}</td>
-                                        <td style="text-align: center;">{last_year_data[2]}</td>
-                                        <td style="text-align: center;">{last_year_data[3]}</td>
-                                        <td style="text-align: center;">{last_year_data[4]}</td>
-                                        <td style="text-align: center;">{last_year_data[5]}</td>
-                                        <td style="text-align: center;">**{last_year_data[6]}**</td>
-                                    </tr>
-                                    <tr>
-                                        <td>**本學年班數**</td>
-                                        <td style="text-align: center;">{this_year_data[0]}</td>
-                                        <td style="text-align: center;">{this_year_data[1]}</td>
-                                        <td style="text-align: center;">{this_year_data[2]}</td>
-                                        <td style="text-align: center;">{this_year_data[3]}</td>
-                                        <td style="text-align: center;">{this_year_data[4]}</td>
-                                        <td style="text-align: center;">{this_year_data[5]}</td>
-                                        <td style="text-align: center;">**{this_year_data[6]}**</td>
-                                    </tr>
-                                </tbody>
-                            </table>
-                            """
-                            st.markdown(class_table_html, unsafe_allow_html=True)
-
-                        # --- 動態 TABS: 辦學理念 (Tab index 5 或 6) ---
-                        tab_index = 5
-                        if has_mission_data:
-                            with tabs[tab_index]:
-                                st.subheader("辦學理念")
-                                # 顯示校訓
-                                display_info("校訓", row.get("校訓"))
-                                
-                                # 顯示辦學宗旨、學校關注事項、學校特色等核心理念 (更新為 philosophy_display_cols)
-                                for col in philosophy_display_cols:
-                                    if col != "校訓": # 避免重複顯示
-                                        display_info(col, row.get(col))
-                                
-                            tab_index += 1
-                        
-                        with tabs[tab_index]:
-                            st.subheader("聯絡資料")
-                            c1, c2 = st.columns(2)
-                            with c1:
-                                display_info("地址", row.get("學校地址"))
-                                display_info("傳真", row.get("學校傳真"))
-                            with c2:
-                                display_info("電話", row.get("學校電話"))
-                                display_info("電郵", row.get("學校電郵"))
-                            display_info("網頁", row.get("學校網址"))
-                        
-                        # --- [END] TABS 結構 ---
-
-            # 5. 「回到最頂」按鈕 (在結果區塊的最下方)
-            st.divider()
-            if st.button("⬆️ 回到最頂", use_container_width=True):
-                # 使用 st.rerun 模擬回到頂部的效果
-                st.rerun()
+    # 4. 搜尋結果區 (fragment：換頁、排序及展開學校只重新執行結果區或該學校)
+    with results_container:
+        render_results(engine, filtered_schools, result_rows, selections, recorder)
+
+        # 5. 「回到最頂」按鈕 (在結果區塊的最下方)
+        st.divider()
+        finish_instrumentation(recorder, engine) # 在可能觸發 st.rerun 的按鈕之前完成記錄
+        if st.button("⬆️ 回到最頂", use_container_width=True):
+            # 使用 st.rerun 模擬回到頂部的效果
+            st.rerun()
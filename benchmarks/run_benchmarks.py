@@ -0,0 +1,297 @@
+"""
+效能測試：資料載入 (冷/暖)、索引建立、搜尋 (不同篩選組合)、詳細資料 HTML 渲染及匯出。
+結果寫成 JSON，可用 --compare 與另一次 (例如上一個 commit) 的結果比較。
+
+    python benchmarks/run_benchmarks.py                          # 原始資料 (1×) 及 10×
+    python benchmarks/run_benchmarks.py --scales 1 10 100 --output before.json
+    python benchmarks/run_benchmarks.py --compare before.json
+
+放大的資料由 scale_data.py 產生並保存在 benchmarks/data/ (不存在時自動產生)。
+每次測試使用獨立的暫存快取目錄，不會影響 app 的 .cache。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import search_engine # noqa: E402
+from benchmarks.scale_data import scale, scaled_dir # noqa: E402
+from exports import EXPORT_FORMATS, export_file # noqa: E402
+from refresh import refresh_engine # noqa: E402
+from school_html import TAB_RENDERERS, FragmentCache # noqa: E402
+from search_engine import ( # noqa: E402
+    ARTICLE_CSV, COL_MAP, SCHOOL_CSV, SCORE_KEYS, ResultCache, SearchEngine, build_group_aggregates, build_spatial_index,
+    data_version, load_tables, normalize_query, top_k_rows,
+)
+from segments import attach_segment, write_segment # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+DEFAULT_SCALES = [1, 10]
+REGRESSION_RATIO = 1.2 # --compare 時 median 慢於基準 20% 以上標示為退步
+
+
+def measure(func, repeat, budget):
+    # 至少執行一次；總時間超過 budget 秒後提早停止 (大倍數資料時較慢的測試只跑數次)
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < repeat:
+        t0 = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - t0) * 1000)
+        if time.perf_counter() - start > budget:
+            break
+    timings.sort()
+    return {
+        "runs": len(timings),
+        "min_ms": timings[0],
+        "median_ms": statistics.median(timings),
+        "mean_ms": statistics.fmean(timings),
+        "p95_ms": timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))],
+    }
+
+
+def data_paths(factor):
+    if factor == 1:
+        return os.path.join(ROOT, SCHOOL_CSV), os.path.join(ROOT, ARTICLE_CSV)
+    paths = [os.path.join(scaled_dir(factor), os.path.basename(name)) for name in (SCHOOL_CSV, ARTICLE_CSV)]
+    if not all(os.path.exists(path) for path in paths):
+        print(f"generating {factor}x data ...", file=sys.stderr)
+        paths = scale(factor)
+    return paths
+
+
+def search_specs(school_df):
+    """
+    搜尋組合：單一 facet、多值 facet、所有 facet、關聯學校、課業安排、師資門檻、名稱、全文及全部條件。
+    篩選值取自資料本身 (最常見的區域，及一間各 facet 都有資料的學校)，放大資料後仍然有效。
+    """
+    regions = school_df["區域"].value_counts().index.tolist()
+    religious = ~school_df["宗教"].isin(["不適用", "無"])
+    related = school_df[["一條龍中學", "直屬中學", "聯繫中學"]].notna().any(axis=1)
+    candidates = school_df[religious & related & (school_df["校車"] == "有")]
+    sample = (candidates if len(candidates) else school_df).iloc[0]
+    all_facets = {
+        "region": [sample["區域"]], "net": [sample["小一學校網"]], "cat1": [sample["資助類型"]],
+        "gender": [sample["學生性別"]], "religion": [sample["宗教"]], "lang": [sample["教學語言"]],
+        "related": ["一條龍中學", "直屬中學", "聯繫中學"], "transport": ["校車"],
+    }
+    assessment = {"g1_tests": "不多於1次", "g1_exams": "0次", "g2_6_tests": "不多於2次", "g2_6_exams": "不多於2次", "diverse": True}
+    teacher = {"teacher": {"碩士／博士或以上人數百分率": 15, "10年年資或以上人數百分率": 40, "特殊教育培訓人數百分率": 20}}
+    return {
+        "no_filter": {},
+        "single_facet": {"region": regions[:1]},
+        "multi_value_facet": {"region": regions[:3]},
+        "all_facets": all_facets,
+        "related_schools": {"related": ["一條龍中學", "直屬中學", "聯繫中學"]},
+        "assessment": assessment,
+        "teacher_thresholds": teacher,
+        "name": {"name": "天主教"},
+        "fulltext": {"fulltext": "STEM"},
+        "fulltext_multi_term": {"fulltext": "電子學習 閱讀"},
+        "everything": {**all_facets, **assessment, **teacher, "region": regions[:3], "fulltext": "學習"},
+    }
+
+
+def bench_scale(factor, repeat, budget):
+    school_csv, article_csv = data_paths(factor)
+    cache_dir = tempfile.mkdtemp(prefix="bench-cache-")
+    saved_cache_dir = search_engine.CACHE_DIR
+    search_engine.CACHE_DIR = cache_dir
+    results = []
+
+    def record(name, stats, **extra):
+        results.append({"name": name, "scale": factor, **extra, **stats})
+        print(f"  {name:<40} {stats['median_ms']:>10.3f} ms  (min {stats['min_ms']:.3f}, runs {stats['runs']})", file=sys.stderr)
+
+    try:
+        # --- 資料載入 ---
+        def load_cold():
+            # 清空快取：計算 SHA-256、解析 CSV 並寫入 Arrow 快取
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            load_tables(school_csv, article_csv)
+        record("load/cold", measure(load_cold, min(repeat, 5), budget))
+        school_df, article_df, cold = load_tables(school_csv, article_csv)
+        # 常駐記憶體：school_df 只有常駐欄位，敘述欄位在冷資料檔 (mmap，不計入進程記憶體)
+        record(
+            "load/warm", measure(lambda: load_tables(school_csv, article_csv), repeat, budget),
+            resident_bytes=int(school_df.memory_usage(deep=True).sum()), cold_file_bytes=cold.stats()["file_bytes"],
+        )
+        version = data_version(school_csv, article_csv)
+
+        # --- 索引建立 (全文索引冷：建立並寫入 .npz；暖：從 .npz 載入) ---
+        def build_cold():
+            for name in os.listdir(cache_dir):
+                if name.startswith("fulltext-"):
+                    os.remove(os.path.join(cache_dir, name))
+            SearchEngine(school_df, article_df, version, cold=cold)
+        record("index/cold", measure(build_cold, min(repeat, 5), budget))
+        record("index/warm", measure(lambda: SearchEngine(school_df, article_df, version, cold=cold), repeat, budget))
+        engine = SearchEngine(school_df, article_df, version, cold=cold)
+        record("index/group_aggregates", measure(lambda: build_group_aggregates(school_df), repeat, budget))
+
+        # --- 共用資料段：另一個進程附加已建立的資料段 (對比 load/warm + index/warm) ---
+        write_segment(search_engine.segment_path(version), engine)
+        record(
+            "load/shared_attach", measure(lambda: attach_segment(search_engine.segment_path(version)), repeat, budget),
+            segment_bytes=os.path.getsize(search_engine.segment_path(version)),
+        )
+
+        # --- 增量更新：一間學校的敘述欄位改變後以 refresh_engine 建立新版本 (對比 index/cold 的完整重建) ---
+        refresh_dir = tempfile.mkdtemp(prefix="bench-refresh-")
+        try:
+            changed_csv = os.path.join(refresh_dir, os.path.basename(school_csv))
+            raw = pd.read_csv(school_csv, dtype=str)
+            raw.loc[0, "學校關注事項"] = "更新後的關注事項：推動 STEM 及閱讀"
+            raw.to_csv(changed_csv, index=False)
+            record("refresh/one_school_changed", measure(lambda: refresh_engine(engine, changed_csv, article_csv), min(repeat, 5), budget))
+        finally:
+            shutil.rmtree(refresh_dir, ignore_errors=True)
+
+        # --- 搜尋 ---
+        for name, spec in search_specs(school_df).items():
+            selections = normalize_query(spec)
+            rows, _ = engine.run(selections)
+            record(f"search/{name}", measure(lambda: engine.run(selections), repeat, budget), results=len(rows))
+
+        # 增量：facet 快取已就緒，只改變一個 facet (模擬使用者在側邊欄多選一個區域)
+        base = normalize_query({"region": school_df["區域"].value_counts().index[:1].tolist(), "fulltext": "STEM"})
+        changed = normalize_query({"region": school_df["區域"].value_counts().index[:2].tolist(), "fulltext": "STEM"})
+        facet_cache = {}
+        toggle = [base, changed]
+        engine.run(base, facet_cache)
+        def incremental():
+            toggle.reverse()
+            engine.run(toggle[0], facet_cache)
+        record("search/incremental_one_facet", measure(incremental, repeat, budget))
+
+        # 跨 session 結果快取：未命中 (新的 ResultCache) 及命中 (另一個 session 重複熱門查詢)
+        everything = normalize_query(search_specs(school_df)["everything"])
+        record("search/result_cache_miss", measure(lambda: engine.query(everything, ResultCache()), repeat, budget))
+        result_cache = ResultCache()
+        engine.query(everything, result_cache)
+        record("search/result_cache_hit", measure(lambda: engine.query(everything, result_cache), repeat, budget))
+
+        # --- 附近學校：資料本身沒有坐標，以香港範圍內的合成坐標量度網格索引及位置查詢 (結合篩選) ---
+        rng = np.random.default_rng(0)
+        located_df = school_df.assign(緯度=22.2 + 0.3 * rng.random(len(school_df)), 經度=113.9 + 0.4 * rng.random(len(school_df)))
+        record("index/spatial", measure(lambda: build_spatial_index(located_df), repeat, budget))
+        located = SearchEngine(located_df, article_df, version, cold=cold)
+        near = {"lat": 22.35, "lon": 114.15}
+        for name, spec in {
+            "near_radius_2km": {"near": {**near, "radius_km": 2}},
+            "near_k20": {"near": {**near, "k": 20}},
+            "near_k20_all_facets": {**search_specs(school_df)["all_facets"], "near": {**near, "k": 20}},
+            "near_radius_5km_fulltext": {"fulltext": "STEM", "near": {**near, "radius_km": 5}},
+        }.items():
+            selections = normalize_query(spec)
+            rows, _ = located.run(selections)
+            record(f"search/{name}", measure(lambda: located.run(selections), repeat, budget), results=len(rows))
+
+        # --- 偏好評分：全部學校計分 + 前 20 名 (改變權重時的成本) ---
+        all_rows, _ = engine.run(normalize_query({}))
+        weights = {key: 1 for key in SCORE_KEYS}
+        preferences = {"religion": school_df["宗教"].value_counts().index[:1].tolist()}
+        record("score/all_schools_top20", measure(lambda: top_k_rows(all_rows, engine.score(weights, preferences), 20), repeat, budget))
+
+        # --- 詳細資料 HTML 渲染 ---
+        for label, count in [("10", 10), ("100", 100), ("all", len(all_rows))]:
+            page = engine.records(all_rows[:count])
+            row_dicts = [row for _, row in page.iterrows()]
+
+            def render_cold():
+                for row in row_dicts:
+                    for render in TAB_RENDERERS.values():
+                        render(row, COL_MAP)
+            record(f"render/{label}_schools_all_tabs", measure(render_cold, repeat, budget), schools=len(row_dicts))
+
+            fragment_cache = FragmentCache(max_bytes=1 << 40)
+            def render_cached():
+                for school_id, row in zip(page.index, row_dicts):
+                    for tab, render in TAB_RENDERERS.items():
+                        fragment_cache.get_or_render(school_id, tab, version, lambda: render(row, COL_MAP))
+            render_cached()
+            record(f"render/{label}_schools_cached", measure(render_cached, repeat, budget), schools=len(row_dicts))
+
+        # --- 匯出全部結果 (寫入暫存檔) ---
+        for fmt in EXPORT_FORMATS:
+            options = {"article_index": engine.article_index, "aggregates": engine.indexes["aggregates"]} if fmt == "html" else {}
+            record(f"export/{fmt}_all", measure(lambda: export_file(fmt, school_df, all_rows, cold=cold, **options).close(), min(repeat, 5), budget), schools=len(all_rows))
+    finally:
+        search_engine.CACHE_DIR = saved_cache_dir
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(item["name"], item["scale"]): item for item in json.load(f)["results"]}
+    print(f"\n{'benchmark':<44} {'scale':>6} {'base ms':>10} {'now ms':>10} {'ratio':>7}")
+    for item in results:
+        base = baseline.get((item["name"], item["scale"]))
+        if base is None:
+            continue
+        ratio = item["median_ms"] / base["median_ms"] if base["median_ms"] else float("inf")
+        flag = "  <-- slower" if ratio > REGRESSION_RATIO else ""
+        print(f"{item['name']:<44} {item['scale']:>6} {base['median_ms']:>10.3f} {item['median_ms']:>10.3f} {ratio:>6.2f}x{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="小學概覽搜尋器效能測試")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="資料倍數，例如 1 10 100 1000")
+    parser.add_argument("--repeat", type=int, default=20, help="每項測試最多執行次數")
+    parser.add_argument("--budget", type=float, default=5.0, help="每項測試的時間上限 (秒)")
+    parser.add_argument("--output", default=None, help="結果 JSON 路徑 (預設 benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", default=None, help="與另一個結果 JSON 比較")
+    args = parser.parse_args(argv)
+
+    commit = git_commit()
+    results = []
+    for factor in args.scales:
+        print(f"scale {factor}x", file=sys.stderr)
+        results.extend(bench_scale(factor, args.repeat, args.budget))
+
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "budget_s": args.budget,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit or 'bench'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"wrote {output}", file=sys.stderr)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+把 database_school_info.csv 及 database_related_article.csv 放大 N 倍，供效能測試使用。
+
+每份副本逐行複製原有學校 (保留區域、校網、資助類型等欄位之間的真實組合)，
+學校名稱加上「（副本編號）」以保持唯一，百分率欄位加入少量隨機擾動；
+相關文章按同樣的名稱對應複製。輸出與原檔格式相同 (UTF-8 BOM)，以分批寫入，1000× 亦毋須一次載入記憶體。
+
+    python benchmarks/scale_data.py --factor 10            # -> benchmarks/data/x10/
+    python benchmarks/scale_data.py --factor 1000 --out /tmp/x1000
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from search_engine import ARTICLE_CSV, PERCENT_COLS, SCHOOL_CSV # noqa: E402
+
+DATA_DIR = os.path.join(ROOT, "benchmarks", "data")
+PERCENT_JITTER = 3.0 # 百分率擾動的標準差 (百分點)
+
+
+def scaled_dir(factor):
+    return os.path.join(DATA_DIR, f"x{factor}")
+
+
+def _jitter_percent(values, rng):
+    # 只擾動可解析為數字的值，"-"、空白等保持原樣
+    numbers = pd.to_numeric(values, errors="coerce")
+    present = numbers.notna().to_numpy()
+    jittered = np.clip(numbers.to_numpy(dtype="float64") + rng.normal(0, PERCENT_JITTER, len(values)), 0, 100).round(1)
+    result = values.to_numpy(dtype=object)
+    result[present] = [f"{value:g}" for value in jittered[present]]
+    return pd.Series(result, index=values.index)
+
+
+def scale(factor, out_dir=None, school_csv=None, article_csv=None, seed=0):
+    """
+    寫出放大 factor 倍的兩個 CSV，返回 (學校 CSV 路徑, 文章 CSV 路徑)。
+    第 0 份副本即原始資料，其後每份副本的學校名稱加上編號。
+    """
+    out_dir = out_dir or scaled_dir(factor)
+    school_csv = school_csv or os.path.join(ROOT, SCHOOL_CSV)
+    article_csv = article_csv or os.path.join(ROOT, ARTICLE_CSV)
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    # keep_default_na=False 保留原文 (例如 "-" 及空白)，避免寫回時改變格式
+    schools = pd.read_csv(school_csv, dtype=str, keep_default_na=False)
+    articles = pd.read_csv(article_csv, dtype=str, keep_default_na=False)
+    percent_cols = [col for col in PERCENT_COLS if col in schools.columns]
+
+    school_out = os.path.join(out_dir, os.path.basename(SCHOOL_CSV))
+    article_out = os.path.join(out_dir, os.path.basename(ARTICLE_CSV))
+    for path, base in [(school_out, schools), (article_out, articles)]:
+        base.iloc[:0].to_csv(path, index=False, encoding="utf-8-sig")
+
+    for copy in range(factor):
+        school_copy, article_copy = schools.copy(), articles.copy()
+        if copy:
+            school_copy["學校名稱"] = school_copy["學校名稱"].str.strip() + f"（{copy}）"
+            article_copy["學校名稱"] = article_copy["學校名稱"].str.strip() + f"（{copy}）"
+            for col in percent_cols:
+                school_copy[col] = _jitter_percent(school_copy[col], rng)
+        school_copy.to_csv(school_out, mode="a", header=False, index=False, encoding="utf-8")
+        article_copy.to_csv(article_out, mode="a", header=False, index=False, encoding="utf-8")
+    return school_out, article_out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="產生放大 N 倍的測試資料")
+    parser.add_argument("--factor", type=int, required=True, help="放大倍數，例如 10、100、1000")
+    parser.add_argument("--out", default=None, help="輸出目錄 (預設 benchmarks/data/x<factor>)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    for path in scale(args.factor, args.out, seed=args.seed):
+        print(f"{path}  {os.path.getsize(path) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+敘述欄位 (學校發展計劃、學習和教學策略等長文字) 的冷資料儲存。
+
+這些欄位佔資料的大部分，但只在打開一間學校的詳細資料、顯示全文摘錄或匯出時才需要，
+因此不放在常駐記憶體的 school_df，而是每間學校一段 zlib 壓縮的 JSON，寫成單一檔案並以 mmap 讀取：
+未讀取的部分只在作業系統的頁面快取，不佔進程記憶體，多個進程亦共用同一份頁面。
+最近讀取的學校保存在細小的 LRU。
+
+檔案格式：MAGIC、meta 長度 (uint64)、meta JSON ({"columns", "table_columns", "size"})、
+補齊至 8 位元組、size + 1 個 uint64 位移、各學校的壓縮資料。
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"COLDTXT1"
+COMPRESS_LEVEL = 1 # 壓縮是寫入冷資料的主要耗時；最低級數快約一半，檔案只大約 5%
+COLD_CACHE_ENTRIES = 256 # 約為同時打開詳細資料的學校數目；每項只有數 KB
+
+
+def _json_value(value):
+    return None if value is None or (isinstance(value, float) and value != value) else value
+
+
+class ColdStore:
+    """
+    以 school id (列位置) 讀取冷資料欄位。get() 返回唯讀的 {欄位: 值} (缺失值為 None)，
+    frame() 返回多間學校的 DataFrame (匯出用)，column_values() 返回指定欄位的全部值 (建立全文索引用)。
+    """
+
+    def __init__(self, path, cache_entries=COLD_CACHE_ENTRIES):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"not a cold store: {path}")
+        (meta_len,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        meta_start = len(MAGIC) + 8
+        meta = json.loads(self._mmap[meta_start:meta_start + meta_len])
+        self.columns = meta["columns"]
+        self.table_columns = meta["table_columns"] # 原 CSV 的欄位次序 (常駐及冷資料欄位)
+        self.size = meta["size"]
+        offsets_start = -(-(meta_start + meta_len) // 8) * 8
+        self.offsets = np.frombuffer(self._mmap, dtype="<u8", count=self.size + 1, offset=offsets_start)
+        self.cache_entries = cache_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def write(cls, path, frame):
+        # 先寫暫存檔再 os.replace；frame 只含冷資料欄位，table_columns 由 frame.attrs 提供 (見 split_cold_columns)
+        blobs = [
+            zlib.compress(json.dumps([_json_value(value) for value in values], ensure_ascii=False).encode("utf-8"), COMPRESS_LEVEL)
+            for values in zip(*(frame[col].tolist() for col in frame.columns))
+        ] if len(frame.columns) else [zlib.compress(b"[]", COMPRESS_LEVEL)] * len(frame)
+        meta = json.dumps({
+            "columns": list(frame.columns),
+            "table_columns": frame.attrs.get("table_columns", list(frame.columns)),
+            "size": len(frame),
+        }, ensure_ascii=False).encode("utf-8")
+        header = MAGIC + struct.pack("<Q", len(meta)) + meta
+        header += b"\0" * (-len(header) % 8)
+        offsets = np.zeros(len(blobs) + 1, dtype="<u8")
+        offsets[1:] = np.cumsum([len(blob) for blob in blobs])
+        offsets += len(header) + offsets.nbytes
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(offsets.tobytes())
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def __reduce__(self):
+        # 寫入共用資料段 (segments.py) 時只保存路徑，附加的進程以 mmap 重新打開同一個檔案
+        return type(self), (self.path, self.cache_entries)
+
+    def blob(self, school_id):
+        # 壓縮後的原始位元組；內容相同的學校位元組亦相同，可直接用於比對新舊版本
+        return self._mmap[int(self.offsets[school_id]):int(self.offsets[school_id + 1])]
+
+    def _decode(self, school_id):
+        return MappingProxyType(dict(zip(self.columns, json.loads(zlib.decompress(self.blob(school_id))))))
+
+    def get(self, school_id):
+        school_id = int(school_id)
+        with self._lock:
+            record = self._cache.get(school_id)
+            if record is not None:
+                self._cache.move_to_end(school_id)
+                self.hits += 1
+                return record
+            self.misses += 1
+        record = self._decode(school_id) # 在鎖外解壓
+        with self._lock:
+            self._cache[school_id] = record
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return record
+
+    def frame(self, rows):
+        # 多間學校 (例如一批匯出) 逐一解壓，不經 LRU，避免擠走正在瀏覽的學校
+        index = pd.Index(rows)
+        records = [json.loads(zlib.decompress(self.blob(row))) for row in index]
+        values = {col: [record[i] for record in records] for i, col in enumerate(self.columns)}
+        return pd.DataFrame(values, index=index, columns=self.columns, dtype=object).astype("str")
+
+    def column_values(self, columns):
+        # {欄位: 全部學校的值}；每間學校只解壓一次
+        positions = [self.columns.index(col) for col in columns]
+        values = {col: [] for col in columns}
+        for row in range(self.size):
+            record = json.loads(zlib.decompress(self.blob(row)))
+            for col, i in zip(columns, positions):
+                values[col].append(record[i])
+        return values
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "file_bytes": len(self._mmap),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def split_cold_columns(df, cold_cols):
+    # 返回 (常駐資料表, 冷資料欄位資料表)；後者的 attrs 記下原欄位次序
+    cold = [col for col in cold_cols if col in df.columns]
+    cold_df = df[cold]
+    cold_df.attrs["table_columns"] = list(df.columns)
+    return df.drop(columns=cold), cold_df
+
+
+def join_cold(frame, cold):
+    # 為 frame (常駐欄位，index 為 school id) 加上冷資料欄位，按原 CSV 的欄位次序排列；其他欄位 (例如相關文章數目) 放在最後
+    if cold is None:
+        return frame
+    joined = pd.concat([frame, cold.frame(frame.index)], axis=1)
+    order = [col for col in cold.table_columns if col in joined.columns]
+    return joined[order + [col for col in joined.columns if col not in cold.table_columns]]
@@ -0,0 +1,265 @@
+"""
+把搜尋結果匯出為 CSV、Excel (XLSX) 及可列印的 HTML 報告。
+
+三種格式都以固定行數分批寫入檔案物件，每次只有一批資料在記憶體中，
+全部資料 (包括 1000× 測試資料) 亦可匯出；寫入檔案 (命令列) 或經 export_file 的暫存檔讀取時記憶體用量有上限。
+app 的下載按鈕例外：st.download_button 把檔案整個讀入記憶體 (見 export_bytes)。敘述欄位在冷資料 (cold，見 coldstore.py)，逐批解壓後接回原欄位次序。XLSX 以 zipfile 直接寫出 (毋須 openpyxl)，
+儲存格使用 inline string，不需要先收集整個工作表的 shared strings。
+
+    python exports.py '{"region": ["沙田區"]}' --format xlsx -o 沙田區.xlsx
+"""
+import argparse
+import datetime
+import html
+import json
+import re
+import sys
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+from coldstore import join_cold
+from school_html import FRAGMENT_CSS, TAB_RENDERERS, available_tabs
+from search_engine import (
+    ARTICLE_CSV, COL_MAP, SCHOOL_CSV, SearchEngine, normalize_query, normalize_school_name, school_percentile_ranks,
+)
+
+EXPORT_CHUNK_ROWS = 2000
+SPOOL_MAX_BYTES = 16 * 1024 * 1024 # 超過此大小的匯出檔暫存到磁碟
+REPORT_MAX_SCHOOLS = 500 # 列印報告最多列出的學校數目；完整資料請用 CSV / Excel
+XLSX_MAX_CELL_CHARS = 32767 # Excel 每個儲存格的字數上限
+XLSX_COMPRESS_LEVEL = 1 # 壓縮是匯出 XLSX 的主要耗時；最低級數快數倍，檔案只大少許
+
+_ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def _chunks(rows, chunk_rows):
+    for start in range(0, len(rows), chunk_rows):
+        yield rows[start:start + chunk_rows]
+
+
+def _number_text(value):
+    # 整數 (解析時存為 float，例如創校年份、班數) 不顯示小數點，與 HTML / XLSX 一致
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+# --- CSV ---
+def _csv_chunk(frame):
+    for col in frame.columns:
+        if pd.api.types.is_float_dtype(frame[col].dtype):
+            frame[col] = frame[col].map(_number_text, na_action="ignore")
+    return frame
+
+def write_csv(out, school_df, rows, cold=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    # 標題列加上 UTF-8 BOM，令 Excel 正確辨認中文
+    out.write(join_cold(school_df.iloc[:0], cold).to_csv(index=False).encode("utf-8-sig"))
+    for chunk in _chunks(rows, chunk_rows):
+        out.write(_csv_chunk(join_cold(school_df.iloc[chunk], cold)).to_csv(index=False, header=False).encode("utf-8"))
+
+
+# --- Excel (XLSX) ---
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="學校" sheetId="1" r:id="rId1"/></sheets></workbook>'
+)
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+# 樣式 0 為預設，樣式 1 為粗體 (標題列)
+_XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+# 凍結標題列
+_XLSX_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>'
+    '<sheetData>'
+)
+_XLSX_SHEET_TAIL = '</sheetData></worksheet>'
+
+
+def _string_cell(value, style=""):
+    text = _ILLEGAL_XML_CHARS.sub("", str(value))[:XLSX_MAX_CELL_CHARS]
+    return f'<c t="inlineStr"{style}><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def _number_cell(value):
+    return f"<c><v>{_number_text(value)}</v></c>"
+
+
+def _column_cells(series):
+    """
+    一批資料中一個欄位的儲存格 XML (object ndarray)。
+    先以 factorize 找出不同的值，每個值只轉換一次，再按編碼展開 (類別欄位及放大的資料大量重複)。
+    缺失值輸出空儲存格 <c/>，令其後的儲存格保持在正確的欄。
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    numeric = pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+    render = _number_cell if numeric else _string_cell
+    cells = np.array([render(value) for value in uniques] + ["<c/>"], dtype=object)
+    return cells[codes]
+
+
+def write_xlsx(out, school_df, rows, cold=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED, compresslevel=XLSX_COMPRESS_LEVEL) as archive:
+        archive.writestr("[Content_Types].xml", _XLSX_CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _XLSX_ROOT_RELS)
+        archive.writestr("xl/workbook.xml", _XLSX_WORKBOOK)
+        archive.writestr("xl/_rels/workbook.xml.rels", _XLSX_WORKBOOK_RELS)
+        archive.writestr("xl/styles.xml", _XLSX_STYLES)
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(_XLSX_SHEET_HEAD.encode("utf-8"))
+            header = "".join(_string_cell(col, ' s="1"') for col in join_cold(school_df.iloc[:0], cold).columns)
+            sheet.write(f"<row>{header}</row>".encode("utf-8"))
+            for chunk in _chunks(rows, chunk_rows):
+                frame = join_cold(school_df.iloc[chunk], cold)
+                columns = [_column_cells(frame[col]) for col in frame.columns]
+                sheet.write("".join(f"<row>{''.join(cells)}</row>" for cells in zip(*columns)).encode("utf-8"))
+            sheet.write(_XLSX_SHEET_TAIL.encode("utf-8"))
+
+
+# --- 可列印的 HTML 報告 ---
+REPORT_CSS = """
+body { font-family: "Noto Sans TC", "PingFang TC", "Microsoft JhengHei", sans-serif; color: #222; margin: 2em; }
+.school { break-before: page; }
+.school:first-of-type { break-before: auto; }
+.school h2 { border-bottom: 2px solid #1abc9c; padding-bottom: 4px; }
+.tab-section { break-inside: avoid; margin-bottom: 1.5em; }
+.tab-section h3 { color: #1abc9c; margin-bottom: 0.5em; }
+@media print { body { margin: 0; } a { color: inherit; } }
+"""
+
+
+def school_report_html(row, articles=(), col_map=COL_MAP, ranks=None):
+    # 一間學校的報告：與詳細資料相同的分頁片段，依次排列
+    parts = [f'<section class="school"><h2>{html.escape(str(row["學校名稱"]))}</h2>']
+    for tab in available_tabs(row):
+        parts.append(f'<div class="tab-section"><h3>{html.escape(tab)}</h3>{TAB_RENDERERS[tab](row, col_map, ranks)}</div>')
+    if articles:
+        links = "".join(f'<li><a href="{html.escape(link)}">{html.escape(title)}</a></li>' for title, link in articles)
+        parts.append(f'<div class="tab-section"><h3>相關文章</h3><ul>{links}</ul></div>')
+    parts.append("</section>")
+    return "".join(parts)
+
+
+def write_html(out, school_df, rows, cold=None, article_index=None, aggregates=None, title="小學概覽選校搜尋器：搜尋結果",
+               max_schools=REPORT_MAX_SCHOOLS, chunk_rows=50):
+    # aggregates 為 SearchEngine.indexes["aggregates"]；提供時師資及設施數字附上區內及校網內的百分位
+    article_index = article_index or {}
+    shown = rows[:max_schools]
+    generated = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    summary = f"共 {len(rows)} 間學校，產生於 {generated}"
+    if len(shown) < len(rows):
+        summary += f"；報告只列出首 {len(shown)} 間，完整資料請匯出 CSV 或 Excel"
+    out.write((
+        f'<!DOCTYPE html><html lang="zh-Hant"><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+        f"<style>{FRAGMENT_CSS}{REPORT_CSS}</style></head><body>"
+        f"<h1>{html.escape(title)}</h1><p>{html.escape(summary)}</p>"
+    ).encode("utf-8"))
+    for chunk in _chunks(shown, chunk_rows):
+        frame = join_cold(school_df.iloc[chunk], cold)
+        out.write("".join(
+            school_report_html(
+                row,
+                article_index.get(normalize_school_name(row["學校名稱"]), ()),
+                ranks=school_percentile_ranks(aggregates, school_df, school_id) if aggregates else None,
+            )
+            for school_id, row in frame.iterrows()
+        ).encode("utf-8"))
+    out.write(b"</body></html>")
+
+
+# 格式 -> (寫入函數, MIME 類型, 副檔名)
+EXPORT_FORMATS = {
+    "csv": (write_csv, "text/csv", "csv"),
+    "xlsx": (write_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "html": (write_html, "text/html", "html"),
+}
+
+
+def export_file(fmt, school_df, rows, **options):
+    """
+    把結果寫入暫存檔並返回 (已移到開頭的) 檔案物件；細小的檔案留在記憶體，較大的自動轉存到磁碟。
+    呼叫者以 with 或 close() 關閉檔案，並可分段讀取 (例如串流回應)，毋須把整個檔案讀入記憶體。
+    options 傳給對應的寫入函數 (例如冷資料 cold、html 的 article_index)。
+    """
+    write = EXPORT_FORMATS[fmt][0]
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        write(out, school_df, rows, **options)
+    except BaseException:
+        out.close()
+        raise
+    out.seek(0)
+    return out
+
+
+def export_bytes(fmt, school_df, rows, **options):
+    """
+    整個匯出檔的 bytes，並關閉暫存檔。供 st.download_button 使用：Streamlit 無論收到檔案物件或 bytes
+    都會整個讀入其記憶體中的媒體儲存，因此 app 的下載記憶體用量是整個檔案 (寫入時仍然分批)。
+    """
+    with export_file(fmt, school_df, rows, **options) as out:
+        return out.read()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="匯出搜尋結果")
+    parser.add_argument("spec", nargs="?", default="{}", help="JSON 查詢規格 (預設為全部學校)")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+    parser.add_argument("-o", "--output", required=True, help="輸出檔案路徑")
+    parser.add_argument("--school-csv", default=SCHOOL_CSV)
+    parser.add_argument("--article-csv", default=ARTICLE_CSV)
+    args = parser.parse_args(argv)
+
+    try:
+        selections = normalize_query(json.loads(args.spec))
+    except (ValueError, TypeError) as e:
+        parser.error(f"invalid spec: {e}")
+    engine = SearchEngine.load(args.school_csv, args.article_csv)
+    rows, _ = engine.run(selections)
+    write, _, _ = EXPORT_FORMATS[args.format]
+    options = {"article_index": engine.article_index, "aggregates": engine.indexes["aggregates"]} if args.format == "html" else {}
+    with open(args.output, "wb") as out:
+        write(out, engine.school_df, rows, cold=engine.cold, **options)
+    print(f"{len(rows)} schools -> {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+小學概覽敘述欄位 (學校關注事項、學習和教學策略、全方位學習等) 的全文檢索。
+
+中文以 bigram、英文/數字以整個詞作 token，各欄位分別計算 BM25 後按欄位權重相加。
+索引以 CSR 形式的 NumPy 陣列保存 (連 term 表亦是已排序的字串陣列，以二分搜尋查找)，
+可寫入 .npz 檔，下次啟動直接載入，亦可由多個進程以 memory-map 共用 (見 segments.py)。
+"""
+import html
+import json
+import os
+import re
+import unicodedata
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# 學校名稱及教育用語中常見的簡體字 -> 繁體字 (只收一對一、不會誤改繁體原文的字)，
+# 以及繁體異體字 (衞/衛 等) 統一寫法；查詢及被索引文字都經同一轉換
+_SIMPLIFIED_CHARS = "学会圣华纪东湾联龙爱黄义马陈总诺书宝乐荣医灵济园属觉围云妇锦树岭莲顺启乡长罗办郑国禄玛卫旧区协圆汉将啬礼贤洁涛刘亚张叶阳泽历届凤献发邓业钟岛门冈兰闽贡吴亲达贞伟赐灿坚仑冯寿银庄辉创诗粮优强梦显岗杨观员许邹赵韫导领鲍来诚侨传节红约篱宪绍轩铭誉风师丽艺体团讯语万广宁静严颂汇邻儿护劳简怀训资农际进实验谊应众专军头贝浅沟陆坛麦沪尔韩萧韦骆钱孙苏谭卢电习读课数动态价养阅术计组织务辅设环运种类级测试练质问题认识网络软项兴时间过这个们为与对从还没样经关说话听写视频录图馆场户队赛奖励积极参缘现绿变点线声车饮营厅楼层钢单独双责负规则标评结构调讨论议决执据统报宽职俭让谦热帮扩阔综伦脑编机惯词画剧戏篮访换页签纸杂库档册赞扬证颁仪庆岁龄卖筹赠贫残碍难损伤疗锻炼减压绪咨询转"
+_TRADITIONAL_CHARS = "學會聖華紀東灣聯龍愛黃義馬陳總諾書寶樂榮醫靈濟園屬覺圍雲婦錦樹嶺蓮順啟鄉長羅辦鄭國祿瑪衛舊區協圓漢將嗇禮賢潔濤劉亞張葉陽澤歷屆鳳獻發鄧業鐘島門岡蘭閩貢吳親達貞偉賜燦堅崙馮壽銀莊輝創詩糧優強夢顯崗楊觀員許鄒趙韞導領鮑來誠僑傳節紅約籬憲紹軒銘譽風師麗藝體團訊語萬廣寧靜嚴頌匯鄰兒護勞簡懷訓資農際進實驗誼應眾專軍頭貝淺溝陸壇麥滬爾韓蕭韋駱錢孫蘇譚盧電習讀課數動態價養閱術計組織務輔設環運種類級測試練質問題認識網絡軟項興時間過這個們為與對從還沒樣經關說話聽寫視頻錄圖館場戶隊賽獎勵積極參緣現綠變點線聲車飲營廳樓層鋼單獨雙責負規則標評結構調討論議決執據統報寬職儉讓謙熱幫擴闊綜倫腦編機慣詞畫劇戲籃訪換頁簽紙雜庫檔冊贊揚證頒儀慶歲齡賣籌贈貧殘礙難損傷療鍛煉減壓緒諮詢轉"
+CHAR_VARIANTS = str.maketrans(_SIMPLIFIED_CHARS + "衞裡峯綫", _TRADITIONAL_CHARS + "衛裏峰線")
+
+FORMAT_VERSION = 1 # 修改 tokenizer 或索引格式時請遞增，以令舊的 .npz 失效
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 英文/數字詞，或連續的中日韓統一表意文字 (含擴展 A 及相容字)
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+
+def fold_text(text):
+    # NFKC (全形轉半形)、不分大小寫、簡繁及異體字統一
+    return unicodedata.normalize("NFKC", str(text)).casefold().translate(CHAR_VARIANTS)
+
+
+def normalize_search_text(text):
+    # 名稱比對用：在 fold_text 之上再移除所有空白
+    return "".join(fold_text(text).split())
+
+
+def tokenize(text):
+    tokens = []
+    for run in _TOKEN_RE.findall(fold_text(text)):
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _index_column(texts):
+    # 單一欄位的倒排索引：terms 已排序，第 i 個 term 的文件及詞頻為 doc_ids/tfs[indptr[i]:indptr[i + 1]]
+    postings = {}
+    doc_len = np.zeros(len(texts), dtype=np.float32)
+    for doc, text in enumerate(texts):
+        if not text:
+            continue
+        counts = Counter(tokenize(text))
+        doc_len[doc] = sum(counts.values())
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((doc, tf))
+
+    terms = sorted(postings)
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(postings[term]) for term in terms])
+    pairs = np.array([pair for term in terms for pair in postings[term]], dtype=np.int64).reshape(-1, 2)
+    return {
+        "terms": terms,
+        "indptr": indptr,
+        "doc_ids": pairs[:, 0].astype(np.int32),
+        "tfs": pairs[:, 1].astype(np.float32),
+        "doc_len": doc_len,
+    }
+
+
+def _term_position(terms, token):
+    # terms 已排序：二分搜尋，找不到時返回 -1
+    pos = int(np.searchsorted(terms, token))
+    return pos if pos < len(terms) and terms[pos] == token else -1
+
+
+class FullTextIndex:
+    """
+    多欄位 BM25 索引。search() 只返回包含查詢中所有 token 的文件 (可分佈在不同欄位)，
+    分數為各欄位 BM25 乘以欄位權重之和。
+    """
+
+    def __init__(self, columns, n_docs, column_data):
+        self.columns = list(columns)
+        self.n_docs = n_docs
+        self._columns = {}
+        for col, data in zip(self.columns, column_data):
+            # term 表保存為陣列而非 dict：沒有逐個 term 的 Python 物件，可直接放在共用記憶體
+            data["terms"] = np.asarray(data["terms"], dtype=str)
+            for name in ["terms", "indptr", "doc_ids", "tfs", "doc_len"]:
+                data[name].flags.writeable = False # 索引建立後唯讀，可在多個執行緒/session 之間共用
+            present = data["doc_len"] > 0
+            data["avgdl"] = float(data["doc_len"][present].mean()) if present.any() else 1.0
+            self._columns[col] = data
+
+    @classmethod
+    def build(cls, texts_by_column, parallel=True):
+        # texts_by_column: {欄位: [文字或 None, ...]}，各欄位可在不同進程中並行建立
+        columns = list(texts_by_column)
+        n_docs = len(next(iter(texts_by_column.values()), []))
+        texts = [[text if isinstance(text, str) else None for text in texts_by_column[col]] for col in columns]
+        column_data = None
+        workers = min(len(columns), os.cpu_count() or 1)
+        if parallel and workers > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    column_data = list(executor.map(_index_column, texts))
+            except (OSError, RuntimeError):
+                column_data = None # 不能建立子進程的環境改為逐欄建立
+        if column_data is None:
+            column_data = [_index_column(column_texts) for column_texts in texts]
+        return cls(columns, n_docs, column_data)
+
+    def patch(self, old_rows, texts_by_column):
+        """
+        資料更新後的增量索引：old_rows[i] 為新第 i 行在舊索引中的文件位置，-1 表示新增或內容有改變 (需重新 tokenize)。
+        沿用其餘文件的 posting (重新編號)，只為需更新的文件建立 posting 再合併；結果與 build() 完全相同。
+        欄位不同時返回 None，由呼叫者改為重新建立。
+        """
+        if list(texts_by_column) != self.columns:
+            return None
+        old_rows = np.asarray(old_rows, dtype=np.int64)
+        n_docs = len(old_rows)
+        kept = np.flatnonzero(old_rows >= 0)
+        updated = np.flatnonzero(old_rows < 0)
+        new_of_old = np.full(self.n_docs, -1, dtype=np.int64)
+        new_of_old[old_rows[kept]] = kept
+
+        column_data = []
+        for col in self.columns:
+            data = self._columns[col]
+            texts = texts_by_column[col]
+            fresh = _index_column([texts[row] if isinstance(texts[row], str) else None for row in updated])
+
+            # 舊 posting：展開為 (term, doc, tf)，刪去已更新或移除的文件並改用新文件位置
+            old_terms = np.repeat(np.arange(len(data["terms"])), np.diff(data["indptr"]))
+            docs = new_of_old[data["doc_ids"]]
+            keep = docs >= 0
+            terms = np.union1d(data["terms"], np.array(fresh["terms"], dtype=str))
+            term_ids = np.searchsorted(terms, data["terms"])[old_terms[keep]]
+            fresh_term_ids = np.searchsorted(terms, np.array(fresh["terms"], dtype=str))[np.repeat(np.arange(len(fresh["terms"])), np.diff(fresh["indptr"]))]
+            fresh_docs = updated[fresh["doc_ids"]]
+
+            # 按 (term, 文件) 排列：學校次序未改變時沿用的 posting 仍然有序，只需把新 posting 插入適當位置
+            keys = term_ids * n_docs + docs[keep]
+            fresh_keys = fresh_term_ids * n_docs + fresh_docs
+            if np.all(keys[1:] > keys[:-1]):
+                at = np.searchsorted(keys, fresh_keys)
+                term_ids, doc_ids = np.insert(term_ids, at, fresh_term_ids), np.insert(docs[keep], at, fresh_docs)
+                tfs = np.insert(data["tfs"][keep], at, fresh["tfs"])
+            else:
+                order = np.argsort(np.concatenate([keys, fresh_keys]), kind="stable")
+                term_ids = np.concatenate([term_ids, fresh_term_ids])[order]
+                doc_ids = np.concatenate([docs[keep], fresh_docs])[order]
+                tfs = np.concatenate([data["tfs"][keep], fresh["tfs"]])[order]
+            counts = np.bincount(term_ids, minlength=len(terms))
+            present = counts > 0 # 只出現在已更新文件的舊 term 不再保留
+
+            doc_len = np.zeros(n_docs, dtype=np.float32)
+            doc_len[kept] = data["doc_len"][old_rows[kept]]
+            doc_len[updated] = fresh["doc_len"]
+            indptr = np.zeros(int(present.sum()) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum(counts[present])
+            column_data.append({
+                "terms": terms[present],
+                "indptr": indptr,
+                "doc_ids": doc_ids.astype(np.int32),
+                "tfs": tfs.astype(np.float32),
+                "doc_len": doc_len,
+            })
+        return type(self)(self.columns, n_docs, column_data)
+
+    def save(self, path):
+        arrays = {"meta": np.array(json.dumps({"columns": self.columns, "n_docs": self.n_docs, "format": FORMAT_VERSION}))}
+        for i, col in enumerate(self.columns):
+            data = self._columns[col]
+            arrays[f"{i}_terms"] = data["terms"]
+            for name in ["indptr", "doc_ids", "tfs", "doc_len"]:
+                arrays[f"{i}_{name}"] = data[name]
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            if meta.get("format") != FORMAT_VERSION:
+                raise ValueError("full-text index format mismatch")
+            column_data = []
+            for i in range(len(meta["columns"])):
+                data = {name: arrays[f"{i}_{name}"] for name in ["indptr", "doc_ids", "tfs", "doc_len"]}
+                data["terms"] = arrays[f"{i}_terms"]
+                column_data.append(data)
+        return cls(meta["columns"], meta["n_docs"], column_data)
+
+    @classmethod
+    def load_or_build(cls, texts_by_column, path):
+        # 以 path 作為持久化位置：存在且格式相符就載入，否則重新建立並寫入
+        if os.path.exists(path):
+            try:
+                index = cls.load(path)
+                if index.columns == list(texts_by_column):
+                    return index
+            except (OSError, ValueError, KeyError):
+                pass
+        index = cls.build(texts_by_column)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            index.save(path)
+        except OSError:
+            pass
+        return index
+
+    def search(self, query, boosts=None):
+        """
+        返回 (文件位置, 分數)，按分數由高至低排列；查詢沒有任何 token 時返回 None。
+        boosts 為 {欄位: 權重}，未列出的欄位權重為 1，權重為 0 的欄位不參與搜尋。
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return None
+        boosts = boosts or {}
+        scores = np.zeros(self.n_docs, dtype=np.float64)
+        matched = np.zeros((len(tokens), self.n_docs), dtype=bool)
+
+        for col, data in self._columns.items():
+            boost = boosts.get(col, 1.0)
+            if not boost:
+                continue
+            for i, token in enumerate(tokens):
+                pos = _term_position(data["terms"], token)
+                if pos < 0:
+                    continue
+                start, end = data["indptr"][pos], data["indptr"][pos + 1]
+                docs, tf = data["doc_ids"][start:end], data["tfs"][start:end]
+                idf = np.log1p((self.n_docs - (end - start) + 0.5) / ((end - start) + 0.5))
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * data["doc_len"][docs] / data["avgdl"])
+                # 同一欄位內每個 term 的 doc_ids 不重複，可直接以索引累加
+                scores[docs] += boost * idf * tf * (BM25_K1 + 1) / norm
+                matched[i, docs] = True
+
+        rows = np.flatnonzero(matched.all(axis=0))
+        order = np.argsort(-scores[rows], kind="stable")
+        return rows[order], scores[rows][order]
+
+
+def _escape(text):
+    return html.escape(text, quote=False).replace("\n", " ")
+
+
+def make_snippet(text, query, width=40):
+    """
+    在 text 中找出查詢詞 (或其 bigram) 首次出現的位置，返回前後 width 字的 HTML 摘錄，配對部分以 <mark> 標示。
+    找不到時返回 None。
+    """
+    if not isinstance(text, str) or not text:
+        return None
+    # lower() 及字元對照不改變長度，位置可直接對應回原文
+    folded = text.lower().translate(CHAR_VARIANTS)
+    words = [word for word in fold_text(query).split() if word]
+    candidates = words + [token for word in words for token in tokenize(word) if token not in words]
+    for term in candidates:
+        pos = folded.find(term)
+        if pos < 0:
+            continue
+        start, end = max(0, pos - width), min(len(text), pos + len(term) + width)
+        return (
+            ("…" if start > 0 else "")
+            + _escape(text[start:pos]) + "<mark>" + _escape(text[pos:pos + len(term)]) + "</mark>"
+            + _escape(text[pos + len(term):end])
+            + ("…" if end < len(text) else "")
+        )
+    return None
@@ -0,0 +1,191 @@
+"""
+每次 rerun 的效能記錄：以 span 量度各階段 (載入資料、搜尋、側邊欄、結果列表、詳細資料分頁) 的耗時、
+元素數目及輸出大小。rerun 按範圍 (scope) 分開計數：整頁 ("app") 或只重新執行某個 st.fragment。
+
+- SpanRecorder 收集單次 rerun 的 span；停用時 span() 返回共用的空物件，幾乎沒有額外成本。
+- MetricsRegistry 在進程內累積所有 session 的數據，輸出 Prometheus 文字格式
+  (可寫成 node_exporter textfile collector 讀取的 .prom 檔)。
+- append_jsonl() 把每次 rerun 的記錄附加到 JSON Lines 檔。
+"""
+import json
+import os
+import threading
+import time
+
+# Prometheus histogram 的上限 (秒)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = "school_search"
+
+
+class _NullSpan:
+    # 停用時使用：所有操作都不做任何事
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("recorder", "name", "attrs", "start", "depth")
+
+    def __init__(self, recorder, name, attrs):
+        self.recorder = recorder
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.depth = len(self.recorder._stack)
+        self.recorder._stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.recorder._stack.pop()
+        self.recorder.spans.append({
+            "name": self.name,
+            "depth": self.depth,
+            "start_ms": (self.start - self.recorder.started) * 1000,
+            "duration_ms": (end - self.start) * 1000,
+            **self.attrs,
+        })
+        return False
+
+    def set(self, **attrs):
+        # 在 span 內補充屬性，例如 count (元素數目)、bytes (輸出大小)、cache (hit/miss)
+        self.attrs.update(attrs)
+
+
+class SpanRecorder:
+    """
+    單次 rerun 的 span 記錄。用法：
+
+        with recorder.span("run_search") as span:
+            rows = ...
+            span.set(count=len(rows))
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.spans = []
+        self.finished = False # 該次 rerun 已完成記錄；之後只重新執行 fragment 時應另建 SpanRecorder
+        self._stack = []
+
+    def span(self, name, **attrs):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attrs)
+
+    def record(self, **extra):
+        # 整次 rerun 的記錄 (寫入 JSON Lines 用)
+        return {
+            "ts": time.time(),
+            "total_ms": (time.perf_counter() - self.started) * 1000,
+            **extra,
+            # span 在結束時才加入，按開始時間排列令巢狀 span 緊隨其父 span
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+        }
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """
+    進程內共用的累積數據 (執行緒安全)：
+    每個 span 名稱一個耗時 histogram，另累計元素數目及輸出位元組；gauge 用於快取大小等即時數值。
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {} # (stage, tab) -> [bucket counts..., count, sum]
+        self._counters = {} # (name, labels tuple) -> value
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe_rerun(self, recorder, scope="app"):
+        # scope：整頁 rerun 為 "app"，只重新執行 fragment 時為該 fragment 的名稱
+        with self._lock:
+            self._inc("reruns_total", (("scope", scope),), 1)
+            for span in recorder.spans:
+                labels = (("stage", span["name"]),) + ((("tab", span["tab"]),) if "tab" in span else ())
+                seconds = span["duration_ms"] / 1000
+                histogram = self._histograms.setdefault(labels, [0] * len(self.buckets) + [0, 0.0])
+                for i, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        histogram[i] += 1
+                histogram[-2] += 1
+                histogram[-1] += seconds
+                if "count" in span:
+                    self._inc("stage_elements_total", labels, span["count"])
+                if "bytes" in span:
+                    self._inc("stage_payload_bytes_total", labels, span["bytes"])
+                if "cache" in span:
+                    self._inc(f"stage_cache_{span['cache']}_total", labels, 1)
+
+    def _inc(self, name, labels, value):
+        self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    def set_gauges(self, prefix, values):
+        # 例如 set_gauges("fragment_cache", FragmentCache.stats())
+        with self._lock:
+            for key, value in values.items():
+                self._gauges[f"{prefix}_{key}"] = value
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            name = f"{METRIC_PREFIX}_stage_duration_seconds"
+            lines += [f"# HELP {name} Wall time of each instrumented stage per rerun.", f"# TYPE {name} histogram"]
+            for labels, histogram in sorted(self._histograms.items()):
+                base = dict(labels)
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f"{name}_bucket{_format_labels({**base, 'le': f'{bound:g}'})} {count}")
+                lines.append(f"{name}_bucket{_format_labels({**base, 'le': '+Inf'})} {histogram[-2]}")
+                lines.append(f"{name}_sum{_format_labels(base)} {histogram[-1]:.6f}")
+                lines.append(f"{name}_count{_format_labels(base)} {histogram[-2]}")
+            typed = set()
+            for (counter, labels), value in sorted(self._counters.items()):
+                full_name = f"{METRIC_PREFIX}_{counter}"
+                if full_name not in typed:
+                    lines.append(f"# TYPE {full_name} counter")
+                    typed.add(full_name)
+                lines.append(f"{full_name}{_format_labels(dict(labels))} {value}")
+            for gauge, value in sorted(self._gauges.items()):
+                full_name = f"{METRIC_PREFIX}_{gauge}"
+                lines += [f"# TYPE {full_name} gauge", f"{full_name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+_file_lock = threading.Lock()
+
+
+def append_jsonl(path, record):
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _file_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def write_textfile(path, text):
+    # 先寫暫存檔再 os.replace，避免 Prometheus 讀到寫了一半的檔案
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
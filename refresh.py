@@ -0,0 +1,242 @@
+"""
+資料增量更新：教育局發佈新的小學概覽 CSV 後，直接替換 database_school_info.csv 即可，毋須重新啟動 app。
+
+- diff_snapshots() 以學校名稱配對新舊資料表，以行雜湊逐行比對，找出新增、移除及內容有改變的學校，
+  並列出每間改變了的學校的新舊欄位值 (即「與上一年相比有何改變」)。敘述欄位 (冷資料) 先比對壓縮位元組，只解壓不同的學校。
+- refresh_engine() 以上一個 SearchEngine 作快照增量建立新版本：全文索引只為新增或敘述欄位有改變的學校
+  重新 tokenize，其餘 posting 沿用；HTML 片段快取中內容未改變的學校改用新 id 沿用；變更記錄寫入 .cache。
+  bitmap、百分率門檻、名稱、分區統計及評分索引都是向量化建立 (10× 資料亦少於 0.3 秒)，直接以新資料表重建。
+- LiveEngine 保存目前的 SearchEngine：偵測到 CSV 改變時由第一個發現的 session 建立新版本，
+  完成後一次過替換引用；其他 session 在此期間繼續使用舊版本，不會看到新舊混合的資料。
+  shared=True (多個進程部署) 時新版本寫成共用資料段，只由一個進程建立，其他進程附加，見 segments.py。
+
+比對兩個 CSV 並輸出變更記錄 (JSON)：
+
+    python refresh.py 舊版/database_school_info.csv
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from coldstore import join_cold
+from search_engine import (
+    ARTICLE_CSV, COORDS_CSV, SCHOOL_CSV, SearchEngine, change_log_path, data_version, freeze_index, fulltext_columns,
+    fulltext_index_path, load_tables, normalize_school_name, parse_school_csv, segment_path,
+)
+from segments import load_or_build_segment
+
+
+def school_keys(school_df):
+    # 新舊資料表之間的配對鍵：正規化的學校名稱；同名的學校 (例如上午/下午校) 按出現次序加上編號
+    names = school_df["學校名稱"].map(normalize_school_name)
+    return (names + "#" + names.groupby(names).cumcount().astype(str)).to_numpy()
+
+
+def _json_value(value):
+    # NaN / 缺失值轉為 null，NumPy 純量轉為 Python 型別
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return value
+
+
+def diff_snapshots(old_df, new_df, old_cold=None, new_cold=None):
+    """
+    逐行比對新舊資料表，返回 dict：
+    old_rows：新資料表每行在舊資料表的位置 (-1 為新增)；added：新增學校的新 id；removed：已移除學校的舊 id；
+    changed：{新 id: {欄位: (舊值, 新值)}}，只列出有改變的欄位。只比對兩者共有的欄位。
+    提供新舊冷資料 (ColdStore) 時亦比對敘述欄位：壓縮位元組相同的學校毋須解壓。
+    """
+    old_pos = pd.Series(np.arange(len(old_df)), index=school_keys(old_df))
+    old_rows = old_pos.reindex(school_keys(new_df)).fillna(-1).to_numpy(dtype=np.int64)
+    matched = np.flatnonzero(old_rows >= 0)
+    columns = [col for col in new_df.columns if col in old_df.columns]
+
+    # 先以行雜湊找出有改變的行，只為這些行逐欄比對
+    old_hash = pd.util.hash_pandas_object(old_df[columns], index=False).to_numpy()
+    new_hash = pd.util.hash_pandas_object(new_df[columns], index=False).to_numpy()
+    modified = matched[old_hash[old_rows[matched]] != new_hash[matched]]
+    changed = {int(row): {} for row in modified}
+    old_part, new_part = old_df.iloc[old_rows[modified]], new_df.iloc[modified]
+    for col in columns:
+        old_values, new_values = old_part[col].to_numpy(dtype=object), new_part[col].to_numpy(dtype=object)
+        old_missing, new_missing = pd.isna(old_values), pd.isna(new_values)
+        differs = (old_missing != new_missing) | (~old_missing & ~new_missing & (old_values != new_values))
+        for row, old, new in zip(modified[differs], old_values[differs], new_values[differs]):
+            changed[int(row)][col] = (_json_value(old), _json_value(new))
+
+    if old_cold is not None and new_cold is not None:
+        cold_columns = [col for col in new_cold.columns if col in old_cold.columns]
+        for row in matched:
+            old_blob, new_blob = old_cold.blob(old_rows[row]), new_cold.blob(row)
+            if old_blob == new_blob:
+                continue
+            old_record, new_record = old_cold.frame([old_rows[row]]).iloc[0], new_cold.frame([row]).iloc[0]
+            for col in cold_columns:
+                old, new = _json_value(old_record[col]), _json_value(new_record[col])
+                if old != new:
+                    changed.setdefault(int(row), {})[col] = (old, new)
+
+    return {
+        "old_rows": old_rows,
+        "added": np.flatnonzero(old_rows < 0),
+        "removed": np.setdiff1d(np.arange(len(old_df)), old_rows[matched]),
+        "changed": {row: fields for row, fields in changed.items() if fields},
+    }
+
+
+def change_log(diff, old_df, previous_version, version):
+    # 變更記錄的格式見 search_engine.load_change_log
+    return {
+        "version": version,
+        "previous_version": previous_version,
+        "created": time.time(),
+        "added": diff["added"].tolist(),
+        "removed": old_df["學校名稱"].iloc[diff["removed"]].tolist(),
+        "changed": {str(row): {col: list(values) for col, values in fields.items()} for row, fields in diff["changed"].items()},
+    }
+
+
+def write_change_log(log):
+    path = change_log_path(log["version"])
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(log, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass # 快取目錄不可寫入時記錄只保存在記憶體 (SearchEngine.change_log)
+
+
+def patch_fulltext_index(engine, school_df, diff, version, cold=None):
+    """
+    只為新增或敘述欄位有改變的學校重新 tokenize (亦只解壓這些學校的冷資料)；
+    結果寫入新版本的 .npz，重新啟動後直接載入。欄位改變時返回 None
+    """
+    columns = fulltext_columns(school_df, cold)
+    old_rows = diff["old_rows"].copy()
+    for row, fields in diff["changed"].items():
+        if any(col in fields for col in columns):
+            old_rows[row] = -1
+    rows = np.flatnonzero(old_rows < 0)
+    frame = join_cold(school_df.iloc[rows], cold)
+    index = engine.indexes["fulltext"].patch(old_rows, {col: dict(zip(rows.tolist(), frame[col].tolist())) for col in columns})
+    if index is not None:
+        path = fulltext_index_path(version)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            index.save(path)
+        except OSError:
+            pass
+    return index
+
+
+def refresh_engine(engine, school_csv=SCHOOL_CSV, article_csv=ARTICLE_CSV, coords_csv=COORDS_CSV, fragment_cache=None):
+    """
+    以 engine 作上一個快照，增量建立最新 CSV 的 SearchEngine；資料版本未改變時直接返回 engine。
+    返回 (SearchEngine, 變更記錄 或 None)。fragment_cache (FragmentCache) 中未改變的學校會沿用到新版本。
+    """
+    version = data_version(school_csv, article_csv, coords_csv)
+    if version is None:
+        raise FileNotFoundError(f"{school_csv} / {article_csv}")
+    if version == engine.version:
+        return engine, None
+
+    school_df, article_df, cold = load_tables(school_csv, article_csv, coords_csv)
+    diff = diff_snapshots(engine.school_df, school_df, engine.cold, cold)
+    fulltext = patch_fulltext_index(engine, school_df, diff, version, cold)
+    new_engine = SearchEngine(school_df, article_df, version, cold=cold, prebuilt={"fulltext": fulltext})
+
+    log = change_log(diff, engine.school_df, engine.version, version)
+    write_change_log(log)
+    new_engine.change_log = freeze_index(log)
+    kept = np.flatnonzero(diff["old_rows"] >= 0)
+    new_ids = np.full(len(engine.school_df), -1, dtype=np.int64)
+    new_ids[diff["old_rows"][kept]] = kept
+    new_engine.id_remap = (engine.version, freeze_index(new_ids))
+
+    if fragment_cache is not None:
+        def remap(school_id):
+            # 片段亦包含區內/校網百分位，其他學校改變後百分位可能不同，因此兩者都要相同才沿用
+            new_id = int(new_ids[school_id]) if 0 <= school_id < len(new_ids) else -1
+            if new_id < 0 or new_id in diff["changed"]:
+                return None
+            return new_id if engine.percentile_ranks(school_id) == new_engine.percentile_ranks(new_id) else None
+        fragment_cache.migrate(engine.version, version, remap)
+    return new_engine, log
+
+
+class LiveEngine:
+    """
+    跨 session 共用的「目前的 SearchEngine」。current() 在 CSV 改變時以 refresh_engine 增量建立新版本，
+    建立期間其他 session 不會等待，繼續取得舊版本；新版本完成後一次過替換引用。
+    每次 rerun 只應呼叫一次 current()，整個 rerun 使用同一個 SearchEngine。
+    shared=True 時每個版本經共用資料段載入：由最先發現新版本的進程增量建立，其他進程附加同一個檔案
+    (這些進程的 HTML 片段快取不會沿用到新版本)。
+    """
+
+    def __init__(self, school_csv=SCHOOL_CSV, article_csv=ARTICLE_CSV, coords_csv=COORDS_CSV, fragment_cache=None, shared=False):
+        self.school_csv = school_csv
+        self.article_csv = article_csv
+        self.coords_csv = coords_csv
+        self.fragment_cache = fragment_cache
+        self.shared = shared
+        self.engine = None
+        self.error = None # 最近一次更新失敗的 (版本, 例外)；該版本不會重試，直至 CSV 再次改變
+        self._lock = threading.Lock()
+
+    def current(self):
+        engine = self.engine
+        if engine is None:
+            with self._lock:
+                if self.engine is None:
+                    self.engine = SearchEngine.load(self.school_csv, self.article_csv, self.coords_csv, shared=self.shared)
+                return self.engine
+
+        version = data_version(self.school_csv, self.article_csv, self.coords_csv)
+        # 檔案暫時不存在 (例如正在替換) 或上次更新此版本失敗時，繼續使用目前版本
+        if version is None or version == engine.version or (self.error and self.error[0] == version):
+            return engine
+        if not self._lock.acquire(blocking=False):
+            return engine # 另一個 session 正在建立新版本
+        try:
+            if self.engine is engine:
+                try:
+                    def refresh():
+                        return refresh_engine(engine, self.school_csv, self.article_csv, self.coords_csv, self.fragment_cache)[0]
+                    self.engine = load_or_build_segment(segment_path(version), refresh) if self.shared else refresh()
+                    self.error = None
+                except (OSError, ValueError, KeyError, pd.errors.ParserError) as e:
+                    self.error = (version, e)
+        finally:
+            self._lock.release()
+        return self.engine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比對兩個版本的學校資料 CSV，輸出每間學校的變更記錄 (JSON)。")
+    parser.add_argument("previous", help="上一個版本的 database_school_info.csv")
+    parser.add_argument("--school-csv", default=SCHOOL_CSV, help="新版本 (預設為目前的 %(default)s)")
+    parser.add_argument("--summary", action="store_true", help="只輸出新增、移除及改變的學校數目")
+    args = parser.parse_args(argv)
+
+    old_df, new_df = parse_school_csv(args.previous), parse_school_csv(args.school_csv)
+    diff = diff_snapshots(old_df, new_df)
+    log = change_log(diff, old_df, None, None)
+    if args.summary:
+        log = {"added": len(log["added"]), "removed": len(log["removed"]), "changed": len(log["changed"])}
+    json.dump(log, sys.stdout, ensure_ascii=False, indent=1)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
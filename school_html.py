@@ -0,0 +1,478 @@
+"""
+學校詳細資料的 HTML 片段：每個分頁渲染成一段 HTML 字串，不依賴 Streamlit，
+因此可在 app.py 以外 (例如 benchmarks) 直接呼叫及量度。
+樣式 (.info-grid、.clean-table 等) 見 FRAGMENT_CSS，由 app.py 注入頁面，列印報告 (exports.py) 亦共用。
+"""
+import html
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from search_engine import RELATED_COLS, is_valid_data
+
+# 欄位名稱 -> 顯示標籤
+LABEL_MAP = { 
+    "校監_校管會主席姓名": "校監", 
+    "校長姓名": "校長",
+    "舊生會_校友會": "舊生會／校友會", 
+    "上課時間_": "一般上學時間",
+    "放學時間": "一般放學時間",
+    "午膳時間": "午膳開始時間",
+    "午膳結束時間": "午膳結束時間",
+    # 這些欄位將作為純文字顯示
+    "核准編制教師職位數目": "核准編制教師職位數目", 
+    "教師總人數": "教師總人數", 
+    "已接受師資培訓人數百分率": "已接受師資培訓 (%)", # 在顯示名稱中保留百分比提示
+    "學士人數百分率": "學士學位 (%)",
+    "碩士／博士或以上人數百分率": "碩士/博士學位 (%)",
+    "特殊教育培訓人數百分率": "特殊教育培訓 (%)",
+    "0至4年年資人數百分率": "0-4年年資 (%)", 
+    "5至9年年資人數百分率": "5-9年年資 (%)", 
+    "10年年資或以上人數百分率": "10+年年資 (%)", 
+    "課室數目": "課室",
+    "禮堂數目": "禮堂",
+    "操場數目": "操場",
+    "圖書館數目": "圖書館",
+    "學費": "學費",
+    "堂費": "堂費",
+    "家長教師會費": "家長教師會費",
+    "非標準項目的核准收費": "非標準項目的核准收費",
+    "其他收費_費用": "其他",
+    "一條龍中學": "一條龍中學",
+    "直屬中學": "直屬中學",
+    "聯繫中學": "聯繫中學",
+    "校訓": "校訓",
+    # 新增/移動的欄位名稱
+    "健康校園生活": "健康校園生活",
+    "學校生活備註": "學校生活備註",
+    "全方位學習": "全方位學習",
+    "家校合作": "家校合作",
+    "全校參與照顧學生的多樣性": "全校參與照顧學生的多樣性",
+    "全校參與模式融合教育": "全校參與模式融合教育",
+    "非華語學生的教育支援": "非華語學生的教育支援",
+    "學費減免": "學費減免",
+    "環保政策": "環保政策",
+    "校風": "校風",
+    "學校發展計劃": "學校發展計劃",
+    "學校管理架構": "學校管理架構",
+    "法團校董會_校管會_校董會": "法團校董會/校管會/校董會",
+    "學校特色_其他": "其他學校特色",
+    "課程剪裁及調適措施": "課程剪裁及調適措施",
+    "正確價值觀_態度和行為的培養": "正確價值觀、態度和行為的培養",
+    "共通能力的培養": "共通能力的培養",
+    "小學教育課程更新重點的發展": "小學教育課程更新重點的發展",
+    "學習和教學策略": "學習和教學策略",
+    "學校關注事項": "學校關注事項",
+}
+
+# 詳細資料分頁 HTML 片段的樣式
+FRAGMENT_CSS = """
+/* 3. HTML 表格基本樣式 (通用於所有clean-table，解決響應式對齊問題) */
+.clean-table {
+    width: 100%;
+    border-collapse: collapse;
+    margin-bottom: 1em;
+    table-layout: auto; 
+    min-width: 400px; /* 確保在手機上仍有最小寬度以保持對齊 */
+}
+.clean-table th, .clean-table td {
+    padding: 8px 12px;
+    text-align: left;
+    border: none; 
+    border-bottom: 1px solid #eee; /* 增加行分隔線 */
+    vertical-align: top;
+}
+.clean-table th {
+    font-weight: 600;
+    background-color: #f7f7f7;
+    border-bottom: 2px solid #ccc; /* 標題下雙分隔線 */
+}
+
+/* 4. 測驗次數/班級結構 表格樣式優化 */
+.clean-table.class-table td:nth-child(n+2), .clean-table.class-table th:nth-child(n+2) {
+    text-align: center;
+}
+.clean-table.class-table td:nth-child(1), .clean-table.assessment-table td:nth-child(1) {
+    font-weight: bold; /* 讓第一欄文字粗體顯示 */
+    width: 30%; 
+}
+
+/* 5. 政策列表樣式 - 單欄堆疊，確保內容清晰 */
+.policy-list-item {
+    padding: 8px 0px;
+    border-bottom: 1px solid #eee;
+}
+.policy-list-item:last-child {
+    border-bottom: none;
+}
+.policy-list-item strong {
+    display: block; 
+    margin-bottom: 2px;
+    color: #333;
+}
+
+/* 新增：統一 info-table 樣式 */
+.info-table {
+    width: 100%;
+    border-collapse: collapse;
+    margin-bottom: 15px;
+}
+.info-table th {
+    background-color: #f7f7f7;
+    font-weight: 600;
+    border-bottom: 2px solid #ccc;
+    padding: 8px 12px;
+    text-align: left;
+    width: 50%; /* 確保兩欄平均分配 */
+}
+.info-table td {
+    padding: 6px 12px;
+    border-bottom: 1px solid #eee;
+    text-align: left;
+    width: 50%;
+}
+.info-table td:nth-child(2) {
+    text-align: right; /* 數字靠右顯示 */
+    font-weight: bold;
+}
+.info-table-title {
+    font-weight: bold;
+    margin-bottom: 8px;
+}
+
+/* 7. 詳細資料分頁：以 CSS grid 取代 st.columns，令每個分頁可作為單一 HTML 片段快取 */
+.info-grid {
+    display: grid;
+    gap: 0 24px;
+}
+.info-grid.cols-2 { grid-template-columns: repeat(2, minmax(0, 1fr)); }
+.info-grid.cols-3 { grid-template-columns: repeat(3, minmax(0, 1fr)); }
+@media (max-width: 640px) {
+    .info-grid.cols-2, .info-grid.cols-3 { grid-template-columns: 1fr; }
+}
+.info-line {
+    margin-bottom: 0.5em;
+}
+.rank-note {
+    display: block;
+    font-size: 0.8em;
+    font-weight: normal;
+    color: #888;
+}
+.info-note {
+    padding: 12px 16px;
+    border-radius: 8px;
+    background-color: rgba(28, 131, 225, 0.1);
+}
+"""
+
+# 將數值欄位 (float) 格式化為顯示文字：整數不顯示小數點，NaN 顯示為 "-"
+def format_value(value):
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value):
+            return "-"
+        return str(int(value)) if float(value).is_integer() else f"{value:g}"
+    return str(value)
+
+# 僅顯示評估數字
+def display_assessment_count(value):
+    if is_valid_data(value):
+        return format_value(value)
+    return "-"
+
+# 詳細資料分頁使用的欄位分組
+# 主分類 6: 辦學理念 (更新欄位列表, 移除被移動的)
+philosophy_display_cols = ["辦學宗旨", "學校管理架構", "環保政策", "學校特色_其他", "校風", "學校發展計劃"]
+# 主分類 2: 學業評估與校園生活 (新增欄位列表)
+curriculum_cols = ["學校關注事項", "學習和教學策略", "小學教育課程更新重點的發展", "共通能力的培養", "正確價值觀_態度和行為的培養", "課程剪裁及調適措施"]
+collaboration_and_life_cols = ["家校合作", "健康校園生活", "全方位學習", "學校生活備註"]
+student_support_cols = ["全校參與照顧學生的多樣性", "全校參與模式融合教育", "非華語學生的教育支援"]
+# 確保 all_philosophy_cols 被正確定義
+all_philosophy_cols = ["校訓"] + philosophy_display_cols
+
+# --- 詳細資料 HTML 片段 ---
+FRAGMENT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+def text_html(value):
+    # 轉義 HTML 並將換行符轉為 <br>
+    return html.escape(format_value(value)).replace("\n", "<br>")
+
+# 每個資料項顯示為一行「標籤：內容」
+def info_html(label, value, is_fee=False, note=""):
+    display_label = html.escape(LABEL_MAP.get(label, label))
+    display_value = "沒有" # 預設值
+
+    if is_valid_data(value):
+        val_str = format_value(value)
+        # 處理網址
+        if "網頁" in label and "http" in val_str:
+            url = html.escape(val_str, quote=True)
+            return f'<p class="info-line"><strong>{display_label}：</strong> <a href="{url}" target="_blank">{url}</a>{note}</p>'
+        display_value = text_html(val_str)
+
+    elif is_fee and label in ["學費", "堂費", "家長教師會費"]:
+        # 只在明確為學費/堂費/家教會費時顯示 $0
+        display_value = "$0"
+
+    return f'<p class="info-line"><strong>{display_label}：</strong> {display_value}{note}</p>'
+
+# 百分位註解的組名格式 (校網只是數字)
+RANK_GROUP_FORMATS = {"區域": "{}", "小一學校網": "{}校網"}
+
+def rank_note_html(ranks, col):
+    # 學校在區內及校網內的百分位，例如「沙田區第 80 百分位 · 91校網第 65 百分位」；沒有排名時返回空字串
+    notes = [
+        f"{html.escape(RANK_GROUP_FORMATS.get(group_col, '{}').format(info['group']))}第 {info['ranks'][col]:.0f} 百分位"
+        for group_col, info in (ranks or {}).items()
+        if col in info["ranks"]
+    ]
+    return f'<span class="rank-note">{" · ".join(notes)}</span>' if notes else ""
+
+def columns_html(*columns):
+    # 以 CSS grid 取代 st.columns，令整個分頁可以是單一 HTML 片段
+    cells = "".join(f"<div>{column}</div>" for column in columns)
+    return f'<div class="info-grid cols-{len(columns)}">{cells}</div>'
+
+def section_html(title, body, divider=True):
+    return f'{"<hr>" if divider else ""}<h3>{title}</h3>{body}'
+
+def person_display(row, name_col, title_col):
+    name = str(row.get(name_col, "")).strip()
+    title = row.get(title_col)
+    if not is_valid_data(name):
+        return None
+    return f"{name}{str(title).strip() if is_valid_data(title) else ''}"
+
+def basic_tab_html(row, col_map, ranks=None):
+    overview = columns_html(
+        info_html("區域", row.get("區域")) + info_html("學校類別1", row.get("資助類型"))
+        + info_html("創校年份", row.get("創校年份")) + info_html("宗教", row.get("宗教"))
+        + info_html("教學語言", row.get("教學語言")),
+        info_html("小一學校網", row.get("小一學校網")) + info_html("學校類別2", row.get("上課時間"))
+        + info_html("學生性別", row.get("學生性別")) + info_html("學校佔地面積", row.get("學校佔地面積")),
+    )
+    management = columns_html(
+        info_html("校長", person_display(row, "校長姓名", "校長稱謂"))
+        + info_html("辦學團體", row.get("辦學團體")) + info_html("家長教師會", row.get("家長教師會"))
+        + info_html("法團校董會_校管會_校董會", row.get("法團校董會_校管會_校董會"))
+        + info_html("校監和校董_校管會主席和成員的培訓達標率", row.get("校監和校董_校管會主席和成員的培訓達標率")),
+        info_html("校監_校管會主席姓名", person_display(row, "校監_校管會主席姓名", "校監_校管會主席稱謂"))
+        + info_html("舊生會_校友會", row.get("舊生會_校友會")),
+    )
+    if any(is_valid_data(row.get(col)) for col in RELATED_COLS):
+        related = columns_html(*(info_html(col, row.get(col)) for col in RELATED_COLS))
+    else:
+        related = '<p class="info-note">沒有關聯學校資料。</p>'
+    schedule = (
+        columns_html(info_html("上課時間_", row.get("上課時間_")), info_html("放學時間", row.get("放學時間")))
+        + columns_html(info_html("午膳時間", row.get("午膳時間")), info_html("午膳結束時間", row.get("午膳結束時間")))
+        + columns_html(info_html("午膳安排", row.get("午膳安排")), info_html("校車", row.get("校車")), info_html("保姆車", row.get("保姆車")))
+    )
+    fees = columns_html(
+        info_html("學費", row.get("學費"), is_fee=True) + info_html("非標準項目的核准收費", row.get("非標準項目的核准收費"), is_fee=True),
+        info_html("堂費", row.get("堂費"), is_fee=True) + info_html("其他收費_費用", row.get("其他收費_費用"), is_fee=True),
+        info_html("家長教師會費", row.get("家長教師會費"), is_fee=True) + info_html("學費減免", row.get("學費減免")),
+    )
+    return (
+        section_html("學校概覽", overview, divider=False)
+        + section_html("校長與組織", management)
+        + section_html("關聯學校", related)
+        + section_html("上學、午膳、放學、交通安排", schedule)
+        + section_html("費用與資助", fees)
+    )
+
+def assessment_tab_html(row, col_map, ranks=None):
+    # 測驗與考試次數 - HTML Table
+    assessment_table = (
+        '<table class="clean-table assessment-table">'
+        '<thead><tr><th style="width: 35%;"></th><th>測驗次數</th><th>考試次數</th></tr></thead><tbody>'
+        f'<tr><td>一年級</td><td>{display_assessment_count(row.get(col_map["g1_tests"]))}</td>'
+        f'<td>{display_assessment_count(row.get(col_map["g1_exams"]))}</td></tr>'
+        f'<tr><td>二至六年級</td><td>{display_assessment_count(row.get(col_map["g2_6_tests"]))}</td>'
+        f'<td>{display_assessment_count(row.get(col_map["g2_6_exams"]))}</td></tr>'
+        '</tbody></table>'
+    )
+
+    # 政策與教學模式 - HTML List (field_key 經 col_map 對應到實際欄位)
+    all_policy_data = [
+        ("g1_diverse_assessment", "小一上學期多元化評估"),
+        ("tutorial_session", "下午設導修課"),
+        ("no_test_after_holiday", "避免長假期後測考"),
+        ("分班安排", "分班安排"),
+        ("班級教學模式", "班級教學模式"),
+        ("diverse_learning_assessment", "多元學習評估"),
+    ]
+    policy_list = ""
+    for field_key, label in all_policy_data:
+        value = row.get(col_map.get(field_key, field_key))
+        display_value = text_html(value) if is_valid_data(value) else "沒有"
+        policy_list += f'<div class="policy-list-item"><strong>{label}：</strong>{display_value}</div>'
+
+    return (
+        section_html("學業評估與安排", "<h5>測驗與考試次數</h5>" + assessment_table + "<hr><h5>課業及教學模式</h5>" + policy_list, divider=False)
+        + section_html("課程發展與策略", "".join(info_html(col, row.get(col)) for col in curriculum_cols))
+        + section_html("協作與校園生活", "".join(info_html(col, row.get(col)) for col in collaboration_and_life_cols))
+        + section_html("學生支援與關顧", "".join(info_html(col, row.get(col)) for col in student_support_cols))
+    )
+
+def teacher_tab_html(row, col_map, ranks=None):
+    qual_cols_map = {
+        "已接受師資培訓人數百分率": "已接受師資培訓 (%)", 
+        "學士人數百分率": "學士學位 (%)", 
+        "碩士／博士或以上人數百分率": "碩士/博士學位 (%)", 
+        "特殊教育培訓人數百分率": "特殊教育培訓 (%)"
+    }
+    seniority_cols_map = {
+        "0至4年年資人數百分率": "0-4年年資 (%)", 
+        "5至9年年資人數百分率": "5-9年年資 (%)", 
+        "10年年資或以上人數百分率": "10+年年資 (%)"
+    }
+    qual_rows_html = "".join(f"<tr><td>{label}</td><td>{format_value(row.get(col, '-'))}{rank_note_html(ranks, col)}</td></tr>" for col, label in qual_cols_map.items())
+    seniority_rows_html = "".join(f"<tr><td>{label}</td><td>{format_value(row.get(col, '-'))}{rank_note_html(ranks, col)}</td></tr>" for col, label in seniority_cols_map.items())
+
+    numbers = columns_html(*(info_html(col, row.get(col), note=rank_note_html(ranks, col)) for col in ["核准編制教師職位數目", "教師總人數"]))
+    tables = columns_html(
+        f'<div class="info-table-title">學歷及培訓</div><table class="info-table">{qual_rows_html}</table>',
+        f'<div class="info-table-title">年資分佈</div><table class="info-table">{seniority_rows_html}</table>',
+    )
+    return (
+        section_html("師資團隊數字", numbers, divider=False)
+        + section_html("教師團隊學歷及年資", tables)
+        + "<hr>" + info_html("教師專業培訓及發展", row.get("教師專業培訓及發展"))
+    )
+
+def facility_tab_html(row, col_map, ranks=None):
+    def count_html(col):
+        return info_html(col, row.get(col), note=rank_note_html(ranks, col))
+    counts = columns_html(
+        count_html("課室數目") + count_html("操場數目"),
+        count_html("禮堂數目") + count_html("圖書館數目"),
+    )
+    details = "".join(info_html(col, row.get(col)) for col in ["特別室", "其他學校設施", "支援有特殊教育需要學生的設施", "環保政策"])
+    return section_html("設施數量", counts, divider=False) + section_html("設施詳情與環境政策", details)
+
+def class_tab_html(row, col_map, ranks=None):
+    grades_internal = ["小一", "小二", "小三", "小四", "小五", "小六", "總"]
+
+    def year_row(label, prefix):
+        cells = [format_value(row.get(f"{prefix}{g}班數", "-")) for g in grades_internal]
+        cells[-1] = f"<strong>{cells[-1]}</strong>"
+        return f"<tr><td><strong>{label}</strong></td>" + "".join(f'<td style="text-align: center;">{c}</td>' for c in cells) + "</tr>"
+
+    class_table = (
+        '<table class="clean-table class-table"><thead><tr><th></th>'
+        + "".join(f"<th>{g}</th>" for g in ["小一", "小二", "小三", "小四", "小五", "小六", "總數"])
+        + "</tr></thead><tbody>"
+        + year_row("上學年班數", "上學年") + year_row("本學年班數", "本學年")
+        + "</tbody></table>"
+    )
+    return section_html("班級結構", class_table, divider=False)
+
+def philosophy_tab_html(row, col_map, ranks=None):
+    # 校訓之後顯示辦學宗旨、學校關注事項、學校特色等核心理念
+    body = info_html("校訓", row.get("校訓")) + "".join(info_html(col, row.get(col)) for col in philosophy_display_cols)
+    return section_html("辦學理念", body, divider=False)
+
+def contact_tab_html(row, col_map, ranks=None):
+    contact = columns_html(
+        info_html("地址", row.get("學校地址")) + info_html("傳真", row.get("學校傳真")),
+        info_html("電話", row.get("學校電話")) + info_html("電郵", row.get("學校電郵")),
+    )
+    return section_html("聯絡資料", contact + info_html("網頁", row.get("學校網址")), divider=False)
+
+# 分頁名稱 -> HTML 渲染函數 (順序即分頁顯示順序)
+# 每個分頁函數接受 (row, col_map, ranks=None)；ranks 為 SearchEngine.percentile_ranks() 的結果，
+# 只有師資概況及學校設施分頁使用
+TAB_RENDERERS = {
+    "基本資料": basic_tab_html,
+    "學業評估與校園生活": assessment_tab_html,
+    "師資概況": teacher_tab_html,
+    "學校設施": facility_tab_html,
+    "班級結構": class_tab_html,
+    "辦學理念": philosophy_tab_html,
+    "聯絡資料": contact_tab_html,
+}
+
+def available_tabs(row):
+    # 沒有辦學理念資料的學校不顯示「辦學理念」分頁
+    has_mission_data = any(is_valid_data(row.get(col)) for col in all_philosophy_cols)
+    return [tab for tab in TAB_RENDERERS if tab != "辦學理念" or has_mission_data]
+
+
+class FragmentCache:
+    """
+    跨 session 共用的 HTML 片段 LRU 快取，鍵為 (學校, 分頁, 資料版本)。
+    以 HTML 總長度作容量上限；資料版本改變時整個快取會被清空，增量更新時則由 migrate() 沿用未改變的學校。
+    """
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._retired = set() # 已由 migrate() 取代的版本
+        self._lock = threading.Lock()
+
+    def get_or_render(self, school_id, tab, version, render):
+        key = (school_id, tab)
+        with self._lock:
+            if version in self._retired:
+                # 切換版本時仍在使用舊版本的 session：只渲染，不清空已沿用到新版本的快取
+                self.misses += 1
+                return render()
+            if version != self.version:
+                self._entries.clear()
+                self._size = 0
+                self.version = version
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+
+        # 在鎖外渲染，避免阻塞其他 session
+        fragment = render()
+        with self._lock:
+            if version == self.version and key not in self._entries:
+                self._entries[key] = fragment
+                self._size += len(fragment)
+                while self._size > self.max_bytes and self._entries:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._size -= len(evicted)
+        return fragment
+
+    def migrate(self, old_version, new_version, remap):
+        """
+        資料增量更新後沿用片段：remap(school_id) 返回該學校在新版本的 id，或 None 表示片段已失效 (內容有改變)。
+        只在快取仍屬 old_version 時進行，返回沿用的片段數目。
+        """
+        with self._lock:
+            if self.version != old_version:
+                return 0
+            new_ids = {}
+            entries = OrderedDict()
+            for (school_id, tab), fragment in self._entries.items():
+                if school_id not in new_ids:
+                    new_ids[school_id] = remap(school_id)
+                if new_ids[school_id] is not None:
+                    entries[(new_ids[school_id], tab)] = fragment
+            self._entries = entries
+            self._size = sum(len(fragment) for fragment in entries.values())
+            self._retired.add(old_version)
+            self.version = new_version
+            return len(entries)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,1278 @@
+"""
+小學概覽選校搜尋器的搜尋核心：資料載入、索引及查詢，不依賴 Streamlit。
+
+app.py 只負責介面；批次工作、其他服務及效能測試可直接 import 本模組，
+或以命令列執行：
+
+    python search_engine.py '{"region": ["沙田區"], "fulltext": "STEM"}'
+    python search_engine.py specs.jsonl    # 每行一個查詢 (JSON)，每行輸出一個結果
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+from coldstore import ColdStore, join_cold, split_cold_columns
+from fulltext import FullTextIndex, normalize_search_text
+from segments import load_or_build_segment
+from spatial import GridIndex
+
+# --- 資料欄位型別設定 ---
+# 數值欄位會解析為 float (缺漏值 / "-" 轉為 NaN)，低基數欄位存為 category，其餘長文字保持字串
+SCHOOL_CSV = "database_school_info.csv"
+ARTICLE_CSV = "database_related_article.csv"
+# 可選的學校坐標表 (學校名稱或學校地址, 緯度, 經度)，與兩個 CSV 放在一起；沒有此檔時「附近學校」搜尋不啟用
+COORDS_CSV = "database_school_coordinates.csv"
+COORD_COLS = ["緯度", "經度"]
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+SCHEMA_VERSION = 2 # 修改解析邏輯或快取格式時請遞增，以令舊的快取失效
+
+COLUMN_RENAMES = {"學校類別1": "資助類型", "學校類別2": "上課時間"}
+
+CATEGORICAL_COLS = ["區域", "小一學校網", "資助類型", "宗教", "教學語言", "學生性別"]
+
+PERCENT_COLS = [
+    "已接受師資培訓人數百分率", "學士人數百分率", "碩士／博士或以上人數百分率", "特殊教育培訓人數百分率",
+    "0至4年年資人數百分率", "5至9年年資人數百分率", "10年年資或以上人數百分率",
+]
+
+CLASS_COUNT_COLS = [f"{year}{grade}班數" for year in ["上學年", "本學年"] for grade in ["小一", "小二", "小三", "小四", "小五", "小六", "總"]]
+
+ASSESSMENT_COUNT_COLS = [
+    "全年全科測驗次數_一年級", "全年全科考試次數_一年級",
+    "全年全科測驗次數_二至六年級", "全年全科考試次數_二至六年級",
+]
+
+NUMERIC_COLS = PERCENT_COLS + CLASS_COUNT_COLS + ASSESSMENT_COUNT_COLS + [
+    "創校年份", "學校佔地面積", "課室數目", "禮堂數目", "操場數目", "圖書館數目",
+    "核准編制教師職位數目", "教師總人數",
+]
+
+# 長篇敘述欄位：只在詳細資料、全文摘錄及匯出時讀取，存放在冷資料 (coldstore.py) 而不在常駐的 school_df。
+# 篩選、排序、摘要及比較用到的欄位都不在此；全文檢索的欄位 (FULLTEXT_BOOSTS) 全部在此
+COLD_TEXT_COLS = [
+    "學校關注事項", "學習和教學策略", "全方位學習", "學校特色_其他", "辦學宗旨", "校風", "學校發展計劃",
+    "小學教育課程更新重點的發展", "共通能力的培養", "正確價值觀_態度和行為的培養", "課程剪裁及調適措施",
+    "健康校園生活", "學校生活備註", "家校合作", "全校參與照顧學生的多樣性", "全校參與模式融合教育",
+    "非華語學生的教育支援", "環保政策", "教師專業培訓及發展", "學校管理架構", "特別室", "其他學校設施",
+    "法團校董會_校管會_校董會", "多元學習評估", "班級教學模式", "分班安排", "班級結構備註", "學費減免",
+]
+
+
+def _file_digest(path):
+    # 以 mtime 及檔案大小作快速檢查，只有檔案被修改過才重新計算 SHA-256
+    stat = os.stat(path)
+    meta_path = os.path.join(CACHE_DIR, os.path.basename(path) + ".json")
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["mtime_ns"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+            return meta["sha256"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    meta = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest.hexdigest()}
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+    except OSError:
+        pass # 快取目錄不可寫入時仍可正常運作，只是每次都要重新計算
+    return meta["sha256"]
+
+
+def _read_cached_table(path, parse_func, cold_cols=()):
+    """
+    Arrow (Feather) 快取以 CSV 內容的雜湊命名；命中時以 memory-map 讀取，毋須重新解析 CSV。
+    返回 (資料表, ColdStore 或 None)：指定 cold_cols 時這些欄位不在資料表，另存於快取旁的 .cold 檔。
+    """
+    digest = _file_digest(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(CACHE_DIR, f"{name}-v{SCHEMA_VERSION}-{digest[:16]}.arrow")
+    cold_path = os.path.splitext(cache_path)[0] + ".cold"
+
+    if os.path.exists(cache_path) and (not cold_cols or os.path.exists(cold_path)):
+        try:
+            cold = ColdStore(cold_path) if cold_cols else None
+            return feather.read_table(cache_path, memory_map=True).to_pandas(), cold
+        except (OSError, ValueError, pa.ArrowException):
+            pass # 快取損壞時重新解析
+
+    df = parse_func(path)
+    cold_df = None
+    if cold_cols:
+        df, cold_df = split_cold_columns(df, cold_cols)
+    cold = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        if cold_df is not None:
+            cold = ColdStore.write(cold_path, cold_df)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        feather.write_feather(df, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, cache_path)
+    except (OSError, pa.ArrowException):
+        pass
+    if cold_df is not None and cold is None:
+        # 快取目錄不可寫入：冷資料寫到暫存檔，mmap 打開後即刪除檔案名稱 (頁面在 ColdStore 釋放後由作業系統收回)
+        fd, tmp_path = tempfile.mkstemp(suffix=".cold")
+        os.close(fd)
+        try:
+            cold = ColdStore.write(tmp_path, cold_df)
+        finally:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass # Windows 不能刪除已打開的檔案
+    return df, cold
+
+
+def parse_school_csv(path):
+    # 先以字串讀入，避免 pandas 自行推斷型別，再逐欄按 schema 轉換
+    school_df = pd.read_csv(path, dtype=str)
+    school_df.columns = school_df.columns.str.strip()
+    school_df.rename(columns=COLUMN_RENAMES, inplace=True)
+
+    for col in school_df.columns:
+        values = school_df[col].str.strip()
+        if col in NUMERIC_COLS:
+            school_df[col] = pd.to_numeric(values, errors="coerce").astype("float64")
+        elif col in CATEGORICAL_COLS:
+            school_df[col] = values.astype("category")
+        else:
+            # 處理 HTML 換行符
+            school_df[col] = values.str.replace('<br>', '\n', regex=False).str.strip()
+
+    if '學校名稱' in school_df.columns:
+        school_df['學校名稱'] = school_df['學校名稱'].str.replace(r'\s+', ' ', regex=True).str.strip()
+
+    return school_df
+
+
+def normalize_school_name(name):
+    # 學校名稱的比對鍵：全形/半形統一 (NFKC) 並移除所有空白，兩個 CSV 之間的空白差異不影響配對
+    return "".join(unicodedata.normalize("NFKC", str(name)).split())
+
+
+def parse_article_csv(path):
+    article_df = pd.read_csv(path)
+    article_df.columns = article_df.columns.str.strip()
+    return article_df
+
+
+def parse_coordinates_csv(path):
+    coords_df = pd.read_csv(path, dtype=str)
+    coords_df.columns = coords_df.columns.str.strip()
+    missing = [col for col in COORD_COLS if col not in coords_df.columns]
+    if missing or not {"學校名稱", "學校地址"} & set(coords_df.columns):
+        raise ValueError(f"{path} needs 學校名稱 or 學校地址 plus {COORD_COLS} columns")
+    for col in COORD_COLS:
+        coords_df[col] = pd.to_numeric(coords_df[col].str.strip(), errors="coerce")
+    return coords_df
+
+
+def attach_coordinates(school_df, coords_df):
+    """
+    在 school_df 加上 緯度/經度 欄：先以學校名稱配對，找不到的再以學校地址配對 (兩者皆忽略空白及全形/半形差異)。
+    坐標表中同一名稱或地址有多行時取第一行；配對不到的學校坐標為 NaN。
+    """
+    coords = pd.DataFrame(np.nan, index=school_df.index, columns=COORD_COLS)
+    for key_col, normalize in [("學校名稱", normalize_school_name), ("學校地址", normalize_search_text)]:
+        if key_col not in coords_df.columns or key_col not in school_df.columns:
+            continue
+        table = coords_df.dropna(subset=[key_col, *COORD_COLS])
+        table = table.set_index(table[key_col].map(normalize))[COORD_COLS]
+        table = table[~table.index.duplicated()]
+        keys = school_df[key_col].map(normalize, na_action="ignore")
+        for col in COORD_COLS:
+            coords[col] = coords[col].fillna(keys.map(table[col]))
+    for col in COORD_COLS:
+        school_df[col] = coords[col].astype("float64")
+    return school_df
+
+
+def data_version(school_csv=SCHOOL_CSV, article_csv=ARTICLE_CSV, coords_csv=COORDS_CSV):
+    # 以各 CSV 的內容雜湊組成資料版本，作為各快取的鍵；CSV 更新 (或加入坐標表) 後所有快取自動失效
+    try:
+        version = f"{_file_digest(school_csv)[:16]}-{_file_digest(article_csv)[:16]}"
+    except FileNotFoundError:
+        return None # 交由呼叫者顯示錯誤訊息
+    if coords_csv and os.path.exists(coords_csv):
+        version += f"-{_file_digest(coords_csv)[:8]}"
+    return version
+
+
+def load_tables(school_csv=SCHOOL_CSV, article_csv=ARTICLE_CSV, coords_csv=COORDS_CSV):
+    """
+    返回 (school_df, article_df, cold)；school_df 不含長篇敘述欄位 (COLD_TEXT_COLS)，這些欄位由 cold (ColdStore) 按 school id 讀取。
+    找不到檔案時拋出 FileNotFoundError。坐標表是可選的，存在時加上 緯度/經度 欄
+    """
+    school_df, cold = _read_cached_table(school_csv, parse_school_csv, COLD_TEXT_COLS)
+    article_df, _ = _read_cached_table(article_csv, parse_article_csv)
+    if coords_csv and os.path.exists(coords_csv):
+        attach_coordinates(school_df, parse_coordinates_csv(coords_csv))
+
+    # 每間學校的相關文章數目 (供排序及摘要顯示)
+    article_counts = article_df.dropna(subset=["文章標題", "文章連結"])["學校名稱"].map(normalize_school_name).value_counts()
+    school_df["相關文章數目"] = school_df["學校名稱"].map(normalize_school_name).map(article_counts).fillna(0).astype("int64")
+    return school_df, article_df, cold
+
+
+def is_valid_data(value):
+    # 🚨 修正：在進行任何字串操作前，強制將值轉換為字串。
+    # 這可以避免 'float' object has no attribute 'strip' 錯誤，因為 numpy.nan 是 float 類型。
+    value_str = str(value).strip() 
+    
+    # 檢查是否為非空字串，且不是字串 'nan' 或 '-'
+    return bool(value_str) and value_str.lower() not in ['nan', '-']
+
+
+# --- 篩選索引 (BITMAP INDEX) ---
+# 查詢規格 (亦即側邊欄 multiselect 的 session state) 的鍵 -> 對應欄位
+FACET_COLS = {
+    "region": "區域",
+    "net": "小一學校網",
+    "cat1": "資助類型",
+    "gender": "學生性別",
+    "religion": "宗教",
+    "lang": "教學語言",
+}
+RELATED_COLS = ["一條龍中學", "直屬中學", "聯繫中學"]
+TRANSPORT_COLS = ["校車", "保姆車"]
+# 不在側邊欄列出的選項值
+FACET_EXCLUDED_OPTIONS = {"religion": ("不適用", "無")}
+
+def valid_data_mask(series):
+    # is_valid_data 的向量化版本
+    text = series.astype(str).str.strip()
+    return (series.notna() & (text != "") & ~text.str.lower().isin(["nan", "-"])).to_numpy(dtype=bool)
+
+def build_filter_index(school_df):
+    """
+    為每個側邊欄選項預先計算一個布林 bitmap，查詢時只需做 bitmap 運算。
+    結構：{facet_key: {選項值: np.ndarray[bool]}}，關聯學校及校車服務以欄位名稱作選項值。
+    另保存各 facet 已排序的選項清單 ("options") 及類別編碼 ("codes")，供側邊欄顯示選項及計數。
+    """
+    index = {"size": len(school_df), "options": {}, "codes": {}}
+
+    for facet_key, col in FACET_COLS.items():
+        column = school_df[col]
+        if not isinstance(column.dtype, pd.CategoricalDtype):
+            column = column.astype("category")
+        codes = column.cat.codes.to_numpy()
+        categories = column.cat.categories.tolist()
+        index[facet_key] = {value: codes == code for code, value in enumerate(categories)}
+        index["codes"][facet_key] = codes
+        excluded = FACET_EXCLUDED_OPTIONS.get(facet_key, ())
+        index["options"][facet_key] = sorted(value for value in categories if value not in excluded)
+
+    index["related"] = {col: valid_data_mask(school_df[col]) for col in RELATED_COLS if col in school_df.columns}
+    index["transport"] = {col: (school_df[col] == "有").to_numpy(dtype=bool) for col in TRANSPORT_COLS if col in school_df.columns}
+    index["options"]["related"] = [col for col in RELATED_COLS if col in index["related"]]
+    index["options"]["transport"] = [col for col in TRANSPORT_COLS if col in index["transport"]]
+
+    for codes in index["codes"].values():
+        codes.flags.writeable = False
+    for key in list(FACET_COLS) + ["related", "transport"]:
+        for bitmap in index[key].values():
+            bitmap.flags.writeable = False
+    return index
+
+def query_filter_index(index, selections):
+    # 同一 facet 內的選項取 OR，不同 facet 之間取 AND
+    mask = np.ones(index["size"], dtype=bool)
+    for facet_key, selected_values in selections.items():
+        if not selected_values:
+            continue
+        bitmaps = index[facet_key]
+        facet_mask = np.zeros(index["size"], dtype=bool)
+        for value in selected_values:
+            if value in bitmaps:
+                facet_mask |= bitmaps[value]
+        mask &= facet_mask
+    return mask
+
+def facet_option_counts(index, facet_masks):
+    """
+    側邊欄每個選項的即時計數：套用「其他所有」facet 的 mask 後，選取該選項會得到多少間學校。
+    facet_masks 為 SearchEngine.run 返回的 {facet: mask 或 None}；以前綴/後綴 AND 求出「除自己以外」的 mask，
+    類別欄位再以 np.bincount 一次過數出所有選項。返回 {facet_key: {選項值: 學校數目}}。
+    """
+    size = index["size"]
+    keys = list(facet_masks)
+    prefix = [np.ones(size, dtype=bool)]
+    for key in keys:
+        prefix.append(prefix[-1] if facet_masks[key] is None else prefix[-1] & facet_masks[key])
+    suffix = [np.ones(size, dtype=bool)]
+    for key in reversed(keys):
+        suffix.append(suffix[-1] if facet_masks[key] is None else suffix[-1] & facet_masks[key])
+    suffix.reverse()
+
+    counts = {}
+    for i, key in enumerate(keys):
+        if key not in index["options"]:
+            continue
+        others = prefix[i] & suffix[i + 1]
+        if key in index["codes"]:
+            # 編碼 -1 (缺失值) 移到 0，其餘類別順延一位
+            by_code = np.bincount(index["codes"][key][others] + 1, minlength=len(index[key]) + 1)[1:]
+            by_value = dict(zip(index[key], by_code.tolist()))
+        else:
+            by_value = {value: int(np.count_nonzero(bitmap & others)) for value, bitmap in index[key].items()}
+        counts[key] = {value: by_value.get(value, 0) for value in index["options"][key]}
+    return counts
+
+# --- 相關文章索引 (HASH INDEX) ---
+def build_article_index(article_df):
+    # 載入時將文章表按學校分組一次：{正規化學校名稱: ((標題, 連結), ...)}
+    grouped = {}
+    for name, title, link in zip(article_df["學校名稱"], article_df["文章標題"], article_df["文章連結"]):
+        if pd.notna(title) and pd.notna(link):
+            grouped.setdefault(normalize_school_name(name), []).append((title, link))
+    return {key: tuple(articles) for key, articles in grouped.items()}
+
+# --- 學校名稱 n-gram 索引 (NAME SEARCH INDEX) ---
+# 若資料日後加入英文名稱或別名欄位，會一併加入索引
+NAME_ALIAS_COLS = ["英文名稱", "學校英文名稱", "別名"]
+def name_grams(text):
+    # 單字及相鄰兩字 (bigram)；單字查詢直接用單字 posting list
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+def build_name_index(school_df):
+    """
+    學校名稱 (及別名) 的倒排索引：{n-gram: 已排序的列位置 np.ndarray}。
+    texts 保存每間學校已正規化的名稱/別名，用作 posting list 交集後的子字串核對及排序。
+    """
+    texts = [[] for _ in range(len(school_df))]
+    for col in ["學校名稱"] + [col for col in NAME_ALIAS_COLS if col in school_df.columns]:
+        for row, value in enumerate(school_df[col]):
+            if is_valid_data(value):
+                texts[row].append(normalize_search_text(value))
+    for row_texts in texts:
+        # 去掉括號內的分校/校舍名稱作為別名，例如「九龍真光中學（小學部）」->「九龍真光中學」
+        for text in list(row_texts):
+            alias = re.sub(r"\([^)]*\)", "", text)
+            if alias and alias not in row_texts:
+                row_texts.append(alias)
+
+    postings = {}
+    for row, row_texts in enumerate(texts):
+        for gram in set().union(*(name_grams(text) for text in row_texts)):
+            postings.setdefault(gram, []).append(row)
+    postings = {gram: np.array(rows, dtype=np.int64) for gram, rows in postings.items()}
+    return {"texts": texts, "postings": postings, "names": school_df["學校名稱"].tolist(), "size": len(school_df)}
+
+def query_name_index(index, query):
+    """
+    返回名稱包含 query 的學校列位置，按相關度排序：
+    配對位置越前越好 (名稱開首最佳)，其次名稱越短越好。query 為空時返回 None。
+    """
+    query = normalize_search_text(query)
+    if not query:
+        return None
+    grams = {query} if len(query) == 1 else {query[i:i + 2] for i in range(len(query) - 1)}
+    posting_lists = sorted((index["postings"].get(gram, np.empty(0, dtype=np.int64)) for gram in grams), key=len)
+    candidates = posting_lists[0]
+    for posting in posting_lists[1:]:
+        if not len(candidates):
+            break
+        candidates = np.intersect1d(candidates, posting, assume_unique=True)
+
+    # bigram 全部出現不代表是連續子字串，需再核對
+    ranked = []
+    for row in candidates:
+        positions = [text.find(query) for text in index["texts"][row] if query in text]
+        if positions:
+            ranked.append((min(positions), len(index["texts"][row][0]), row))
+    ranked.sort()
+    return np.array([row for _, _, row in ranked], dtype=np.int64)
+
+def suggest_school_names(index, query, k=8):
+    rows = query_name_index(index, query)
+    return [] if rows is None else [index["names"][row] for row in rows[:k]]
+
+# --- 敘述欄位全文檢索 (BM25) ---
+# 欄位 -> 權重；學校關注事項及教學相關欄位的配對較重要
+FULLTEXT_BOOSTS = {
+    "學校關注事項": 2.0,
+    "學習和教學策略": 1.5,
+    "全方位學習": 1.5,
+    "學校特色_其他": 1.5,
+    "辦學宗旨": 1.2,
+    "校風": 1.0,
+    "學校發展計劃": 1.0,
+    "小學教育課程更新重點的發展": 1.0,
+    "共通能力的培養": 1.0,
+    "正確價值觀_態度和行為的培養": 1.0,
+    "課程剪裁及調適措施": 1.0,
+    "健康校園生活": 1.0,
+    "學校生活備註": 1.0,
+    "家校合作": 1.0,
+    "全校參與照顧學生的多樣性": 1.0,
+    "全校參與模式融合教育": 1.0,
+    "非華語學生的教育支援": 1.0,
+    "環保政策": 1.0,
+    "教師專業培訓及發展": 1.0,
+    "學校管理架構": 0.8,
+    "特別室": 0.8,
+    "其他學校設施": 0.8,
+    "法團校董會_校管會_校董會": 0.5,
+}
+
+def fulltext_index_path(version):
+    return os.path.join(CACHE_DIR, f"fulltext-{version}.npz")
+
+def segment_path(version):
+    # 共用資料段 (segments.py)；包含 SCHEMA_VERSION，修改資料表或索引結構後舊的資料段自動失效
+    return os.path.join(CACHE_DIR, f"segment-v{SCHEMA_VERSION}-{version}.seg")
+
+def fulltext_columns(school_df, cold=None):
+    return [col for col in FULLTEXT_BOOSTS if col in school_df.columns or (cold is not None and col in cold.columns)]
+
+def fulltext_texts(school_df, cold=None):
+    # {欄位: 全部學校的文字}；敘述欄位在冷資料，只在建立索引時整欄解壓
+    columns = fulltext_columns(school_df, cold)
+    cold_columns = [col for col in columns if cold is not None and col in cold.columns]
+    texts = cold.column_values(cold_columns) if cold_columns else {}
+    return {col: texts[col] if col in texts else school_df[col].tolist() for col in columns}
+
+def build_fulltext_index(school_df, version, cold=None):
+    # 索引檔以資料版本命名，CSV 未改變時直接從 .cache 載入，毋須讀取冷資料
+    path = fulltext_index_path(version)
+    if os.path.exists(path):
+        try:
+            index = FullTextIndex.load(path)
+            if index.columns == fulltext_columns(school_df, cold):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+    return FullTextIndex.load_or_build(fulltext_texts(school_df, cold), path)
+
+# --- 百分率門檻索引 (SORTED-ARRAY INDEX) ---
+def build_threshold_index(school_df):
+    """
+    為每個百分率欄位預先排序：sorted 為已排序的有效數值，order 為對應的列位置 (argsort 排列)，
+    missing 標記數值為 "-" / 空白 (NaN) 的學校，以便查詢時明確決定是否包括它們。
+    """
+    index = {"size": len(school_df)}
+    for col in PERCENT_COLS:
+        values = school_df[col].to_numpy(dtype="float64")
+        missing = np.isnan(values)
+        present_rows = np.flatnonzero(~missing)
+        order = np.argsort(values[present_rows], kind="stable")
+        entry = {"sorted": values[present_rows][order], "order": present_rows[order], "missing": missing}
+        for array in entry.values():
+            array.flags.writeable = False
+        index[col] = entry
+    return index
+
+def query_threshold_index(index, thresholds, include_missing=False):
+    # 「≥ X%」= 在已排序數值上 searchsorted，再取該位置之後的列位置
+    mask = np.ones(index["size"], dtype=bool)
+    for col, minimum in thresholds.items():
+        if not minimum:
+            continue
+        entry = index[col]
+        start = np.searchsorted(entry["sorted"], minimum, side="left")
+        col_mask = np.zeros(index["size"], dtype=bool)
+        col_mask[entry["order"][start:]] = True
+        if include_missing:
+            col_mask |= entry["missing"]
+        mask &= col_mask
+    return mask
+
+# --- 分區統計及百分位排名 (GROUP AGGREGATES) ---
+AGGREGATE_GROUP_COLS = ["區域", "小一學校網", "資助類型"]
+RANK_GROUP_COLS = ["區域", "小一學校網"] # 詳細資料顯示學校在區內及校網內的百分位
+TEACHER_COUNT_COLS = ["核准編制教師職位數目", "教師總人數"]
+FACILITY_COUNT_COLS = ["課室數目", "禮堂數目", "操場數目", "圖書館數目"]
+AGGREGATE_COLS = PERCENT_COLS + TEACHER_COUNT_COLS + FACILITY_COUNT_COLS + CLASS_COUNT_COLS + ASSESSMENT_COUNT_COLS
+HISTOGRAM_BINS = 10 # 百分率分佈：0-10%、10-20% ... 90-100%
+
+def _group_stats(grouped):
+    # 與 DataFrameGroupBy.describe() 相同的表，但 describe() 逐組計算，在組數多時慢得多
+    quartiles = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    quartiles.columns = quartiles.columns.set_levels([f"{q:.0%}" for q in quartiles.columns.levels[1]], level=1)
+    stats = pd.concat([grouped.agg(["count", "mean", "std", "min", "max"]), quartiles], axis=1)
+    order = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+    return stats.reindex(columns=pd.MultiIndex.from_product([grouped.obj.columns, order]))
+
+def build_group_aggregates(school_df):
+    """
+    每個資料版本計算一次的分組統計 (全部以 groupby / bincount 向量化計算)：
+    - stats[分組欄位]：各組每個欄位的 count、mean、std、min、四分位數及 max (DataFrame，欄為 (欄位, 統計))
+    - histograms[分組欄位]：{"groups": 組名, "counts": (組, 百分率欄位, HISTOGRAM_BINS) 的學校數目}
+    - ranks[分組欄位]：(學校, 欄位) 的百分位排名 (0-100)；沒有數據為 NaN
+    """
+    cols = [col for col in AGGREGATE_COLS if col in school_df.columns]
+    percent_cols = [col for col in PERCENT_COLS if col in cols]
+    values = school_df[cols].apply(pd.to_numeric, errors="coerce").astype("float64")
+    aggregates = {"cols": cols, "percent_cols": percent_cols, "stats": {}, "histograms": {}, "ranks": {}}
+    for group_col in AGGREGATE_GROUP_COLS:
+        if group_col not in school_df.columns:
+            continue
+        keys = school_df[group_col]
+        grouped = values.groupby(keys, observed=True)
+        aggregates["stats"][group_col] = _group_stats(grouped)
+        # 百分位排名 = (組內較低的學校數目 + 同值學校數目的一半) / 組內有數據的學校數目
+        ranks = (grouped.rank(method="average") - 0.5) / grouped.transform("count") * 100
+        aggregates["ranks"][group_col] = ranks.to_numpy(dtype="float32")
+
+        codes, groups = pd.factorize(keys, sort=True)
+        counts = np.zeros((len(groups), len(percent_cols), HISTOGRAM_BINS), dtype=np.int64)
+        for i, col in enumerate(percent_cols):
+            column = values[col].to_numpy()
+            present = (codes >= 0) & ~np.isnan(column)
+            bins = np.clip((column[present] // (100 / HISTOGRAM_BINS)).astype(np.int64), 0, HISTOGRAM_BINS - 1)
+            counts[:, i] = np.bincount(codes[present] * HISTOGRAM_BINS + bins, minlength=len(groups) * HISTOGRAM_BINS).reshape(len(groups), HISTOGRAM_BINS)
+        aggregates["histograms"][group_col] = {"groups": list(groups), "counts": counts}
+    return aggregates
+
+def school_percentile_ranks(aggregates, school_df, school_id):
+    """
+    一間學校在所屬區域及校網內的百分位：{分組欄位: {"group": 組名, "ranks": {欄位: 百分位}}}。
+    沒有數據的欄位不列出。
+    """
+    position = school_df.index.get_loc(school_id)
+    result = {}
+    for group_col in RANK_GROUP_COLS:
+        if group_col not in aggregates["ranks"] or not is_valid_data(school_df[group_col].iloc[position]):
+            continue
+        row = aggregates["ranks"][group_col][position]
+        ranks = {col: float(pct) for col, pct in zip(aggregates["cols"], row) if not np.isnan(pct)}
+        result[group_col] = {"group": str(school_df[group_col].iloc[position]), "ranks": ranks}
+    return result
+
+# --- 查詢規格 (QUERY SPEC) ---
+# 課業篩選及導修課等條件所用的欄位
+COL_MAP = {
+    "g1_tests": "全年全科測驗次數_一年級", "g1_exams": "全年全科考試次數_一年級",
+    "g1_diverse_assessment": "小一上學期以多元化的進展性評估代替測驗及考試",
+    "g2_6_tests": "全年全科測驗次數_二至六年級", "g2_6_exams": "全年全科考試次數_二至六年級",
+    "tutorial_session": "按校情靈活編排時間表_盡量在下午安排導修時段_讓學生能在教師指導下完成部分家課",
+    "no_test_after_holiday": "避免緊接在長假期後安排測考_讓學生在假期有充分的休息",
+    "diverse_learning_assessment": "多元學習評估",
+    "班級教學模式": "班級教學模式",
+    "分班安排": "分班安排"
+}
+ASSESSMENT_FACETS = ["g1_tests", "g1_exams", "g2_6_tests", "g2_6_exams"]
+# 課業篩選選項 -> (最少次數, 最多次數)
+ASSESSMENT_RANGES = {"0次": (0, 0), "不多於1次": (0, 1), "不多於2次": (0, 2), "3次": (3, 3)}
+ASSESSMENT_ANY = "不限"
+
+# 查詢規格可用的鍵及預設值 (即沒有限制)
+QUERY_DEFAULTS = {
+    **{key: [] for key in list(FACET_COLS) + ["related", "transport"]},
+    "name": "",
+    **{key: ASSESSMENT_ANY for key in ASSESSMENT_FACETS},
+    "diverse": False,
+    "tutorial": False,
+    "teacher": {},
+    "include_missing": False,
+    "fulltext": "",
+    "near": {},
+}
+NEAR_KEYS = ["lat", "lon", "radius_km", "k"]
+
+def normalize_near(near):
+    # {"lat", "lon", "radius_km" (可選), "k" (可選)} -> (緯度, 經度, 半徑公里, 最近 k 間)；0 表示不限，沒有位置時為 ()
+    if not near:
+        return ()
+    unknown = set(near) - set(NEAR_KEYS)
+    if unknown:
+        raise ValueError(f"unknown near keys: {sorted(unknown)}")
+    if "lat" not in near or "lon" not in near:
+        raise ValueError("near needs both lat and lon")
+    lat, lon = float(near["lat"]), float(near["lon"])
+    radius_km, k = float(near.get("radius_km") or 0), int(near.get("k") or 0)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("near lat/lon out of range")
+    if not np.isfinite(radius_km):
+        raise ValueError("near radius_km must be a finite number")
+    if radius_km < 0 or k < 0:
+        raise ValueError("near radius_km and k must not be negative")
+    return (lat, lon, radius_km, k)
+
+def normalize_query(query_spec):
+    """
+    將查詢規格 (dict，鍵見 QUERY_DEFAULTS，可只列出需要的鍵) 轉為可比較的 selections：
+    多選 facet 排序成 tuple、文字去掉前後空白、師資門檻轉為 ((欄位, 最低百分率), ...) 及是否包括缺失數據。
+    選項次序不影響結果，因此相同條件的 selections 必定相等，可直接用作快取鍵。
+    不認識的鍵或數值會拋出 ValueError。
+    """
+    unknown = set(query_spec) - set(QUERY_DEFAULTS)
+    if unknown:
+        raise ValueError(f"unknown query keys: {sorted(unknown)}")
+    spec = {**QUERY_DEFAULTS, **query_spec}
+
+    selections = {}
+    for key in list(FACET_COLS) + ["related", "transport"]:
+        values = [spec[key]] if isinstance(spec[key], str) else spec[key]
+        selections[key] = tuple(sorted(map(str, values)))
+    selections["name"] = str(spec["name"]).strip()
+    for key in ASSESSMENT_FACETS:
+        if spec[key] != ASSESSMENT_ANY and spec[key] not in ASSESSMENT_RANGES:
+            raise ValueError(f"{key} must be one of {[ASSESSMENT_ANY, *ASSESSMENT_RANGES]}")
+        selections[key] = spec[key]
+    selections["diverse"] = bool(spec["diverse"])
+    selections["tutorial"] = bool(spec["tutorial"])
+    unknown_cols = set(spec["teacher"]) - set(PERCENT_COLS)
+    if unknown_cols:
+        raise ValueError(f"unknown teacher columns: {sorted(unknown_cols)}")
+    thresholds = tuple(sorted((col, float(value)) for col, value in spec["teacher"].items() if value))
+    if not all(np.isfinite(value) for _, value in thresholds):
+        raise ValueError("teacher thresholds must be finite numbers")
+    selections["teacher"] = (thresholds, bool(spec["include_missing"]))
+    selections["fulltext"] = str(spec["fulltext"]).strip()
+    selections["near"] = normalize_near(spec["near"])
+    return selections
+
+def canonical_spec(selections):
+    """
+    normalize_query 的反向：只保留與預設值不同的條件，normalize_query(canonical_spec(s)) == s。
+    名稱及全文的預設值是空白；即使文字剛好是「不限」(評估 facet 的預設值) 亦要保留：
+
+    >>> s = normalize_query({"name": "不限", "fulltext": "不限"})
+    >>> normalize_query(canonical_spec(s)) == s
+    True
+    >>> query_key(s) == query_key(normalize_query({}))
+    False
+    """
+    spec = {}
+    for key in list(FACET_COLS) + ["related", "transport"]:
+        if selections[key]:
+            spec[key] = list(selections[key])
+    for key in ["name", "fulltext"]:
+        if selections[key] != "":
+            spec[key] = selections[key]
+    for key in ASSESSMENT_FACETS:
+        if selections[key] != ASSESSMENT_ANY:
+            spec[key] = selections[key]
+    for key in ["diverse", "tutorial"]:
+        if selections[key]:
+            spec[key] = True
+    thresholds, include_missing = selections["teacher"]
+    if thresholds:
+        spec["teacher"] = {col: value for col, value in thresholds}
+    if include_missing:
+        spec["include_missing"] = True
+    if selections["near"]:
+        lat, lon, radius_km, k = selections["near"]
+        spec["near"] = {"lat": lat, "lon": lon, **({"radius_km": radius_km} if radius_km else {}), **({"k": k} if k else {})}
+    return spec
+
+def query_key(selections):
+    """
+    查詢的標準文字鍵 (緊湊、鍵已排序的 JSON)：相同條件必定得到相同的鍵，
+    可用作跨 session 快取鍵，亦可放在網址 (?q=...) 分享後再以 normalize_query(json.loads(key)) 還原。
+    """
+    return json.dumps(canonical_spec(selections), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+# --- 偏好評分 (PREFERENCE SCORING) ---
+# 數值準則 -> (欄位, 方向)；多個欄位時取總和，方向 -1 表示數值越低越好
+SCORE_CRITERIA = {
+    "fewer_assessments": (ASSESSMENT_COUNT_COLS, -1),
+    "master_degree": (["碩士／博士或以上人數百分率"], 1),
+    "experienced": (["10年年資或以上人數百分率"], 1),
+    "fewer_classes": (["本學年總班數"], -1),
+}
+SCORE_TRANSPORT = {"school_bus": "校車"} # 有此服務得滿分
+SCORE_PREFERENCE_FACETS = ["religion", "lang"] # 選項符合使用者偏好得滿分
+SCORE_KEYS = list(SCORE_CRITERIA) + list(SCORE_TRANSPORT) + SCORE_PREFERENCE_FACETS
+
+def build_score_index(school_df, filter_index):
+    """
+    每個資料版本計算一次的評分矩陣 (學校 × 準則，float32)：每個準則以全部學校的最小/最大值正規化到 0-1，
+    方向為 -1 的準則反轉；沒有數據的學校取該準則的平均值，不會因缺少資料而被排到最後。
+    偏好準則 (宗教、教學語言) 在評分時由篩選 bitmap 組成。
+    """
+    columns = []
+    for cols, direction in SCORE_CRITERIA.values():
+        values = school_df[[col for col in cols if col in school_df.columns]].sum(axis=1, min_count=1).to_numpy(dtype="float64")
+        low, high = np.nanmin(values), np.nanmax(values)
+        normalized = (values - low) / (high - low) if high > low else np.zeros_like(values)
+        if direction < 0:
+            normalized = 1 - normalized
+        columns.append(np.where(np.isnan(normalized), np.nanmean(normalized), normalized))
+    for col in SCORE_TRANSPORT.values():
+        columns.append(filter_index["transport"].get(col, np.zeros(len(school_df), dtype=bool)))
+    matrix = np.column_stack(columns).astype(np.float32) if columns else np.zeros((len(school_df), 0), dtype=np.float32)
+    return {"keys": list(SCORE_CRITERIA) + list(SCORE_TRANSPORT), "matrix": matrix}
+
+def compute_scores(score_index, filter_index, weights, preferences=None):
+    """
+    全部學校的加權分數 (0-100，float32)，一次矩陣乘法完成。
+    weights 為 {準則: 權重}；preferences 為 {"religion"/"lang": [偏好選項]}，對應的權重同樣在 weights。
+    所有權重為 0 時返回全 0。
+    """
+    preferences = preferences or {}
+    unknown = set(weights) - set(SCORE_KEYS)
+    if unknown:
+        raise ValueError(f"unknown score criteria: {sorted(unknown)}")
+    vector = np.array([float(weights.get(key, 0)) for key in score_index["keys"]], dtype=np.float32)
+    scores = score_index["matrix"] @ vector
+    total = float(vector.sum())
+    for facet in SCORE_PREFERENCE_FACETS:
+        weight = float(weights.get(facet, 0))
+        if weight and preferences.get(facet):
+            scores += weight * query_filter_index(filter_index, {facet: preferences[facet]})
+        total += weight if preferences.get(facet) else 0
+    return scores * (100 / total) if total > 0 else np.zeros_like(scores)
+
+def top_k_rows(rows, scores, k):
+    """
+    rows 中分數最高的 k 間學校 (由高至低)。以 argpartition 在 O(n) 內找出第 k 高的分數，只排序這 k 個；
+    同分時按 rows 原有次序，令不同 k (例如第 1 頁與第 2 頁) 的結果前後一致。
+    """
+    k = min(k, len(rows))
+    if k <= 0:
+        return rows[:0]
+    negated = -scores[rows]
+    partition = np.argpartition(negated, k - 1)
+    kth = negated[partition[k - 1]]
+    better = partition[:k][negated[partition[:k]] < kth]
+    ties = np.flatnonzero(negated == kth)[:k - len(better)]
+    chosen = np.concatenate([better, ties])
+    return rows[chosen[np.lexsort((chosen, negated[chosen]))]]
+
+# --- 學校比較 (COMPARE) ---
+COMPARE_SECTIONS = {
+    "費用": ["學費", "堂費", "家長教師會費", "非標準項目的核准收費", "其他收費_費用"],
+    "測考安排": ASSESSMENT_COUNT_COLS + [COL_MAP["g1_diverse_assessment"], COL_MAP["tutorial_session"], COL_MAP["no_test_after_holiday"]],
+    "師資": TEACHER_COUNT_COLS + PERCENT_COLS,
+    "班級結構": [col for col in CLASS_COUNT_COLS if col.startswith("本學年")],
+    "上課時間": ["上課時間", "一般上學時間", "一般放學時間", "午膳開始時間", "午膳結束時間"],
+    "關聯中學": RELATED_COLS,
+}
+COMPARE_MAX_SCHOOLS = 20
+
+def compare_schools(school_df, school_ids, sections=COMPARE_SECTIONS):
+    """
+    已選學校的對照表：列為 (分類, 欄位)，欄為 school id。
+    以 take() 一次過取出所選學校的欄位切片 (保留各欄型別) 再轉置，不逐行讀取。
+    返回 (table, differs)；differs 標示哪些列的數值不全相同 (兩個缺失值視為相同)。
+    不在 school_df 的 id (例如資料更新後已移除的學校) 略去；沒有任何學校時返回沒有欄的 table。
+    """
+    rows = [(section, col) for section, cols in sections.items() for col in cols if col in school_df.columns]
+    positions = school_df.index.get_indexer(school_ids)
+    school_ids = [school_id for school_id, position in zip(school_ids, positions) if position >= 0]
+    subset = school_df.take(positions[positions >= 0])[[col for _, col in rows]]
+    index = pd.MultiIndex.from_tuples(rows)
+    if subset.empty:
+        return pd.DataFrame(index=index, columns=[], dtype=object), pd.Series(False, index=index)
+    first = subset.iloc[0]
+    same = subset.eq(first) | (subset.isna() & first.isna())
+    differs = pd.Series(~same.all(axis=0).to_numpy(), index=index)
+    table = pd.DataFrame(subset.to_numpy(dtype=object).T, index=index, columns=school_ids)
+    return table, differs
+
+# --- 查詢引擎：按 facet 快取部分結果 (INCREMENTAL QUERY ENGINE) ---
+def rows_to_mask(rows, size):
+    mask = np.zeros(size, dtype=bool)
+    mask[rows] = True
+    return mask
+
+def compute_facet(facet, selection, school_df, indexes):
+    """
+    計算單一 facet 的部分結果，返回 (mask, ranking)：
+    mask 為 None 表示該 facet 沒有限制；ranking 為按相關度排列的列位置 (只有名稱及全文檢索提供)。
+    """
+    size = len(school_df)
+    if facet in FACET_COLS or facet in ("related", "transport"):
+        return (query_filter_index(indexes["filter"], {facet: selection}) if selection else None), None
+
+    if facet == "name":
+        rows = query_name_index(indexes["name"], selection)
+        return (None, None) if rows is None else (rows_to_mask(rows, size), rows)
+
+    if facet in ASSESSMENT_FACETS:
+        if selection not in ASSESSMENT_RANGES:
+            return None, None
+        # 測驗/考試次數已解析為數值，NaN 在比較時自然為 False
+        low, high = ASSESSMENT_RANGES[selection]
+        counts = school_df[COL_MAP[facet]].to_numpy()
+        return (counts >= low) & (counts <= high), None
+
+    if facet == "diverse":
+        return ((school_df[COL_MAP["g1_diverse_assessment"]] == "有").to_numpy(dtype=bool) if selection else None), None
+    if facet == "tutorial":
+        return ((school_df[COL_MAP["tutorial_session"]] == "有").to_numpy(dtype=bool) if selection else None), None
+
+    if facet == "teacher":
+        thresholds, include_missing = selection
+        return (query_threshold_index(indexes["threshold"], dict(thresholds), include_missing) if thresholds else None), None
+
+    if facet == "fulltext":
+        hits = indexes["fulltext"].search(selection, FULLTEXT_BOOSTS) if selection else None
+        return (None, None) if hits is None else (rows_to_mask(hits[0], size), hits[0])
+
+    if facet == "near":
+        # 位置條件只保留有坐標的學校 (指定半徑時再限於半徑內)；最近 k 間要在所有 mask 合併後才能決定，見 order_rows
+        if not selection:
+            return None, None
+        spatial = indexes.get("spatial")
+        if spatial is None:
+            return np.zeros(size, dtype=bool), None
+        lat, lon, radius_km, _ = selection
+        return (spatial.within(lat, lon, radius_km) if radius_km else spatial.present.copy()), None
+
+    raise KeyError(facet)
+
+def order_rows(mask, rankings, selections, indexes):
+    """
+    所有 facet 合併後的結果列位置：全文檢索有結果時按 BM25 排序，否則按名稱配對排序，兩者皆無時保持原有次序。
+    有位置條件時先取符合篩選的最近 k 間 (k 為 0 則全部)，沒有相關度排序時按距離由近至遠排列。
+    """
+    ranking = rankings.get("fulltext", rankings.get("name"))
+    near = selections.get("near")
+    if near and indexes.get("spatial") is not None and (near[3] or ranking is None):
+        lat, lon, _, k = near
+        nearest = indexes["spatial"].nearest(lat, lon, k, mask)
+        if ranking is None:
+            return nearest
+        mask = rows_to_mask(nearest, len(mask))
+    return ranking[mask[ranking]] if ranking is not None else np.flatnonzero(mask)
+
+def build_spatial_index(school_df):
+    # 沒有坐標欄 (即沒有坐標表) 或全部學校都沒有坐標時返回 None
+    if not set(COORD_COLS) <= set(school_df.columns) or school_df[COORD_COLS].isna().any(axis=1).all():
+        return None
+    return GridIndex(school_df["緯度"].to_numpy(), school_df["經度"].to_numpy())
+
+
+# --- 跨 session 查詢結果快取 (RESULT CACHE) ---
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class ResultCache:
+    """
+    跨 session 共用的查詢結果 LRU (執行緒安全)，以估計的位元組總數作容量上限；資料版本改變時整個清空。
+    熱門查詢 (例如只選一個區域或校網) 只需計算一次，所有使用者共用同一份唯讀結果。
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (value, nbytes)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, version, compute):
+        # compute() 返回 (value, 估計位元組)；在鎖外計算，避免阻塞其他 session
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self._size = 0
+                self.version = version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        value, nbytes = compute()
+        with self._lock:
+            if version == self.version and key not in self._entries and nbytes <= self.max_bytes:
+                self._entries[key] = (value, nbytes)
+                self._size += nbytes
+                while self._size > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self._size -= evicted
+        return value
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+# --- 資料更新記錄 (CHANGE LOG) ---
+# refresh.py 以逐行比對產生，每個資料版本一個 JSON 檔：
+# {"version", "previous_version", "created", "added": [school id], "removed": [學校名稱], "changed": {"school id": {欄位: [舊值, 新值]}}}
+def change_log_path(version):
+    return os.path.join(CACHE_DIR, f"changes-{version}.json")
+
+def load_change_log(version):
+    # 沒有記錄 (例如首次載入或重新建立) 時返回 None
+    try:
+        with open(change_log_path(version), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# --- 共用唯讀資料集 (IMMUTABLE DATASET) ---
+# 一個進程只保存一份資料表及索引，由所有 session / 連線共用而不複製；任何修改都會拋出 ReadOnlyDataError。
+class ReadOnlyDataError(TypeError):
+    pass
+
+def _read_only(*args, **kwargs):
+    raise ReadOnlyDataError("the shared dataset is read-only; call .copy() before modifying it")
+
+class _ReadOnlyIndexer:
+    # 包裝 .loc / .iloc / .at / .iat：讀取照常，賦值拋出錯誤
+    __slots__ = ("_indexer",)
+
+    def __init__(self, indexer):
+        object.__setattr__(self, "_indexer", indexer)
+
+    def __getitem__(self, key):
+        return self._indexer[key]
+
+    def __getattr__(self, name):
+        return getattr(self._indexer, name)
+
+    def __call__(self, axis=None):
+        return _ReadOnlyIndexer(self._indexer(axis))
+
+    __setitem__ = _read_only
+    __setattr__ = _read_only
+
+class FrozenDataFrame(pd.DataFrame):
+    """
+    禁止修改的 DataFrame：欄位賦值、刪除、inplace 操作及經 .loc/.iloc/.at/.iat 賦值都會拋出 ReadOnlyDataError。
+    切片、排序等操作返回普通 DataFrame (pandas copy-on-write，毋須先複製)，可自由修改。
+    """
+    _metadata = ["_frozen"]
+
+    @property
+    def _constructor(self):
+        return pd.DataFrame
+
+    def __setattr__(self, name, value):
+        if not name.startswith("_") and getattr(self, "_frozen", False):
+            _read_only()
+        super().__setattr__(name, value)
+
+    __setitem__ = _read_only
+    __delitem__ = _read_only
+    _update_inplace = _read_only
+    insert = _read_only
+    pop = _read_only
+    update = _read_only
+
+    @property
+    def loc(self):
+        return _ReadOnlyIndexer(super().loc)
+
+    @property
+    def iloc(self):
+        return _ReadOnlyIndexer(super().iloc)
+
+    @property
+    def at(self):
+        return _ReadOnlyIndexer(super().at)
+
+    @property
+    def iat(self):
+        return _ReadOnlyIndexer(super().iat)
+
+def _reject_inplace(method):
+    # 部分 inplace 操作 (例如 replace、fillna) 會先修改資料才呼叫 _update_inplace，因此要在呼叫前攔截
+    @functools.wraps(method)
+    def guarded(self, *args, **kwargs):
+        if kwargs.get("inplace"):
+            _read_only()
+        return method(self, *args, **kwargs)
+    return guarded
+
+# 接受 inplace 參數的 DataFrame 方法 (pandas 2.x 至 3.x)。明確列出而不在 import 時掃描 pandas 的方法簽名，
+# 行為不隨 pandas 版本改變；pandas 增加新的 inplace 方法時需加入此列表
+INPLACE_METHODS = (
+    "bfill", "clip", "drop", "drop_duplicates", "dropna", "eval", "ffill", "fillna", "interpolate", "mask",
+    "query", "rename", "rename_axis", "replace", "reset_index", "set_index", "sort_index", "sort_values", "where",
+)
+for _name in INPLACE_METHODS:
+    setattr(FrozenDataFrame, _name, _reject_inplace(getattr(pd.DataFrame, _name)))
+
+def freeze_frame(df):
+    frozen = FrozenDataFrame(df)
+    frozen._frozen = True
+    return frozen
+
+def freeze_index(value):
+    # 遞迴地把索引變為唯讀：dict -> MappingProxyType，list -> tuple，NumPy 陣列設為不可寫入，DataFrame -> FrozenDataFrame
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze_index(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_index(item) for item in value)
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    if isinstance(value, pd.DataFrame):
+        return freeze_frame(value)
+    return value
+
+
+_LAT_LON_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*[,，\s]\s*(-?\d+(?:\.\d+)?)\s*$")
+
+
+class SearchEngine:
+    """
+    擁有資料表及所有索引的搜尋核心。school id 即學校在 database_school_info.csv 中的列位置
+    (亦是 school_df 的 index)。資料表為 FrozenDataFrame，索引為唯讀，可安全地在多個 session 之間共用。
+    長篇敘述欄位不在 school_df，由 cold (ColdStore) 按 school id 讀取，見 school_record() / records()。
+
+    run() 接受 normalize_query 的結果及一個由呼叫者保存的 facet 快取 (dict)，
+    只重新計算 selection 有改變的 facet；search() 是不需快取的簡便版本。
+    """
+
+    def __init__(self, school_df, article_df, version, cold=None, prebuilt=None):
+        # prebuilt：已建立的索引 (例如 refresh.py 增量更新的全文索引)，其餘索引照常建立
+        prebuilt = prebuilt or {}
+        self.school_df = freeze_frame(school_df)
+        self.article_df = freeze_frame(article_df)
+        self.cold = cold
+        self.version = version
+        filter_index = freeze_index(build_filter_index(school_df))
+        self.indexes = MappingProxyType({
+            "filter": filter_index,
+            "threshold": freeze_index(build_threshold_index(school_df)),
+            "name": freeze_index(build_name_index(school_df)),
+            "fulltext": prebuilt.get("fulltext") or build_fulltext_index(school_df, version, cold), # FullTextIndex 的陣列建立時已設為唯讀
+            "aggregates": freeze_index(build_group_aggregates(school_df)),
+            "score": freeze_index(build_score_index(school_df, filter_index)),
+            "spatial": build_spatial_index(school_df), # GridIndex 的陣列建立時已設為唯讀
+        })
+        self.article_index = freeze_index(build_article_index(article_df))
+        self.change_log = freeze_index(load_change_log(version))
+        # 由 refresh.py 增量更新時設定：(上一個版本, 上一版本每個 school id 對應的新 id，-1 為已移除)
+        self.id_remap = None
+
+    def __setstate__(self, state):
+        # 由共用資料段 (segments.py) 附加時：資料段以普通 dict / DataFrame 保存，在此重新凍結
+        self.__dict__.update(state)
+        self.school_df = freeze_frame(self.school_df)
+        self.article_df = freeze_frame(self.article_df)
+        self.indexes = MappingProxyType({
+            name: index if isinstance(index, (FullTextIndex, GridIndex)) else freeze_index(index)
+            for name, index in self.indexes.items()
+        })
+        self.article_index = freeze_index(self.article_index)
+        self.change_log = freeze_index(self.change_log)
+        if self.id_remap is not None:
+            self.id_remap = (self.id_remap[0], freeze_index(self.id_remap[1]))
+
+    @classmethod
+    def load(cls, school_csv=SCHOOL_CSV, article_csv=ARTICLE_CSV, coords_csv=COORDS_CSV, shared=False):
+        """
+        shared=True 時經共用資料段載入 (多個進程部署用)：同一資料版本只由一個進程建立，
+        其他進程以 mmap 附加同一個檔案，資料及索引只佔一份頁面快取，見 segments.py。
+        """
+        version = data_version(school_csv, article_csv, coords_csv)
+        if version is None:
+            raise FileNotFoundError(f"{school_csv} / {article_csv}")
+
+        def build():
+            school_df, article_df, cold = load_tables(school_csv, article_csv, coords_csv)
+            return cls(school_df, article_df, version, cold=cold)
+        if shared:
+            return load_or_build_segment(segment_path(version), build)
+        return build()
+
+    def school_record(self, school_id, row=None):
+        """
+        一間學校的完整資料 (Series，欄位次序與 CSV 相同)：school_df 的一行加上冷資料欄位。
+        row 為已取得的 school_df 行 (可選)；冷資料經 ColdStore 的 LRU 讀取。
+        """
+        row = self.school_df.loc[school_id] if row is None else row
+        if self.cold is None:
+            return row
+        # 缺失值與 school_df 一致為 NaN (is_valid_data 等以此判斷)
+        cold_values = {col: np.nan if value is None else value for col, value in self.cold.get(school_id).items()}
+        record = pd.concat([row.astype(object), pd.Series(cold_values, dtype=object)])
+        order = [col for col in self.cold.table_columns if col in record.index]
+        return record[order + [col for col in record.index if col not in self.cold.table_columns]].rename(row.name)
+
+    def records(self, rows):
+        # 多間學校 (列位置) 的完整資料 (DataFrame)，供匯出及比較使用
+        return join_cold(self.school_df.iloc[rows], self.cold)
+
+    def run(self, selections, cache=None):
+        """
+        返回 (結果列位置, {facet: mask 或 None})。cache 為呼叫者保存的 dict (例如 session state)，
+        資料版本改變時自動清空；selection 未改變的 facet 直接沿用上次的部分 mask，再將所有 mask 以 AND 合併。
+        結果次序見 order_rows。
+        """
+        cache = {} if cache is None else cache
+        if cache.get("version") != self.version:
+            cache.clear()
+            cache["version"] = self.version
+        facets = cache.setdefault("facets", {})
+
+        mask = np.ones(len(self.school_df), dtype=bool)
+        rankings = {}
+        facet_masks = {}
+        for facet, selection in selections.items():
+            entry = facets.get(facet)
+            if entry is None or entry[0] != selection:
+                entry = (selection, *compute_facet(facet, selection, self.school_df, self.indexes))
+                facets[facet] = entry
+            _, facet_mask, ranking = entry
+            facet_masks[facet] = facet_mask
+            if facet_mask is not None:
+                mask &= facet_mask
+            if ranking is not None:
+                rankings[facet] = ranking
+
+        return order_rows(mask, rankings, selections, self.indexes), facet_masks
+
+    def query(self, selections, result_cache):
+        """
+        與 run() 相同的查詢，但使用跨 session 的 ResultCache：整個查詢的結果以 query_key 為鍵，
+        每個 facet 的部分結果 (以 np.packbits 壓縮的 mask) 亦分別快取，改變一個條件時其餘 facet 毋須重新計算。
+        返回 (rows, option_counts)；rows 為唯讀的 int32 列位置陣列，option_counts 為側邊欄選項計數。
+        """
+        return result_cache.get_or_compute(
+            ("query", query_key(selections)), self.version, lambda: self._compute_query(selections, result_cache)
+        )
+
+    def _compute_query(self, selections, result_cache):
+        size = len(self.school_df)
+        mask = np.ones(size, dtype=bool)
+        rankings = {}
+        facet_masks = {}
+        for facet, selection in selections.items():
+            packed, ranking = result_cache.get_or_compute(
+                ("facet", facet, selection), self.version, lambda: self._compute_packed_facet(facet, selection)
+            )
+            facet_mask = None if packed is None else np.unpackbits(packed, count=size).view(bool)
+            facet_masks[facet] = facet_mask
+            if facet_mask is not None:
+                mask &= facet_mask
+            if ranking is not None:
+                rankings[facet] = ranking
+
+        rows = order_rows(mask, rankings, selections, self.indexes).astype(np.int32)
+        option_counts = freeze_index(facet_option_counts(self.indexes["filter"], facet_masks))
+        n_options = sum(len(counts) for counts in option_counts.values())
+        return (freeze_index(rows), option_counts), rows.nbytes + 64 * n_options
+
+    def _compute_packed_facet(self, facet, selection):
+        facet_mask, ranking = compute_facet(facet, selection, self.school_df, self.indexes)
+        packed = None if facet_mask is None else freeze_index(np.packbits(facet_mask))
+        ranking = None if ranking is None else freeze_index(ranking.astype(np.int32))
+        nbytes = 64 + (0 if packed is None else packed.nbytes) + (0 if ranking is None else ranking.nbytes)
+        return (packed, ranking), nbytes
+
+    def score(self, weights, preferences=None):
+        # 全部學校的偏好分數 (見 compute_scores)；與篩選無關，改變權重毋須重新搜尋
+        return compute_scores(self.indexes["score"], self.indexes["filter"], weights, preferences)
+
+    def percentile_ranks(self, school_id):
+        # 見 school_percentile_ranks；統計在建立 SearchEngine 時已計算，這裡只是查表
+        return school_percentile_ranks(self.indexes["aggregates"], self.school_df, school_id)
+
+    def distances(self, near, rows):
+        # rows 各學校與 near 位置的距離 (公里)；沒有位置條件或沒有坐標表時返回 None
+        if not near or self.indexes["spatial"] is None:
+            return None
+        return self.indexes["spatial"].distances(near[0], near[1], rows)
+
+    def locate(self, text):
+        """
+        把使用者輸入的位置轉為 (緯度, 經度)：「22.38, 114.19」形式的坐標，或學校名稱 (取名稱配對最佳而有坐標的學校)。
+        無法解析時返回 None。
+        """
+        text = str(text).strip()
+        match = _LAT_LON_RE.match(text)
+        if match:
+            lat, lon = float(match.group(1)), float(match.group(2))
+            return (lat, lon) if -90 <= lat <= 90 and -180 <= lon <= 180 else None
+        spatial = self.indexes["spatial"]
+        rows = query_name_index(self.indexes["name"], text) if text and spatial is not None else None
+        if rows is None:
+            return None
+        rows = rows[spatial.present[rows]]
+        if not len(rows):
+            return None
+        lat, lon = self.school_df[COORD_COLS].iloc[rows[0]]
+        return float(lat), float(lon)
+
+    def school_changes(self, school_id):
+        # 上次資料更新後此學校的變更：{"status": "added"} 或 {"status": "changed", "fields": {欄位: [舊值, 新值]}}；沒有變更時返回 None
+        if self.change_log is None:
+            return None
+        if school_id in self.change_log["added"]:
+            return {"status": "added"}
+        fields = self.change_log["changed"].get(str(school_id))
+        return None if fields is None else {"status": "changed", "fields": {col: list(values) for col, values in fields.items()}}
+
+    def search(self, query_spec):
+        # 返回符合查詢規格的 school id (list)，次序與 run() 相同
+        rows, _ = self.run(normalize_query(query_spec))
+        return self.school_df.index[rows].tolist()
+
+    def option_counts(self, facet_masks):
+        return facet_option_counts(self.indexes["filter"], facet_masks)
+
+
+# --- 命令列 (CLI) ---
+def _read_specs(source):
+    # 單一 JSON 物件，或每行一個 JSON 物件 (JSON Lines)
+    text = source.read() if hasattr(source, "read") else source
+    text = text.strip()
+    if text.startswith("{") and text.endswith("}"):
+        try:
+            return [json.loads(text)]
+        except ValueError:
+            pass
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以 JSON 查詢規格搜尋學校，每個查詢輸出一行 JSON。")
+    parser.add_argument("spec", nargs="?", default="-", help="JSON 查詢、JSON / JSON Lines 檔案路徑，或 - 從 stdin 讀取 (預設)")
+    parser.add_argument("--school-csv", default=SCHOOL_CSV)
+    parser.add_argument("--article-csv", default=ARTICLE_CSV)
+    parser.add_argument("--limit", type=int, default=None, help="每個查詢最多輸出的學校數目")
+    parser.add_argument("--ids-only", action="store_true", help="只輸出 school id，不附學校名稱")
+    args = parser.parse_args(argv)
+
+    if args.spec == "-":
+        specs = _read_specs(sys.stdin)
+    elif os.path.exists(args.spec):
+        with open(args.spec, encoding="utf-8") as f:
+            specs = _read_specs(f)
+    else:
+        specs = _read_specs(args.spec)
+
+    engine = SearchEngine.load(args.school_csv, args.article_csv)
+    names = engine.school_df["學校名稱"]
+    for spec in specs:
+        try:
+            ids = engine.search(spec)
+        except ValueError as e:
+            print(json.dumps({"error": str(e)}, ensure_ascii=False))
+            continue
+        result = {"version": engine.version, "count": len(ids), "ids": ids[:args.limit]}
+        if not args.ids_only:
+            result["names"] = names.loc[result["ids"]].tolist()
+        print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,378 @@
+"""
+小學概覽搜尋的 HTTP JSON 服務 (只用標準庫 asyncio)，供手機及合作夥伴前端使用。
+
+整個進程只載入一份 SearchEngine (資料表及索引皆唯讀)，所有連線共用。伺服器每隔數秒檢查 CSV：
+替換 database_school_info.csv 等檔案後以 refresh.py 增量建立新版本並一次過切換，毋須重新啟動：
+
+    python search_server.py --port 8765
+    python search_server.py --port 8766 --shared   (多個進程共用一份資料，見 segments.py)
+
+    GET  /search?region=沙田區&region=大埔區&fulltext=STEM&limit=20&offset=0
+    GET  /search?spec={"teacher": {"碩士／博士或以上人數百分率": 25}}
+    POST /search            (body 為 JSON 查詢規格，可另加 "limit" / "offset")
+    GET  /facets?...        側邊欄各選項在其他條件下的學校數目
+    GET  /schools/<id>      單一學校的所有欄位及相關文章
+    GET  /health
+
+查詢規格與 search_engine.normalize_query 相同。回應以「正規化後的查詢」作快取鍵，
+ETag 由資料版本及該鍵組成，客戶端以 If-None-Match 重新驗證時毋須重新計算。
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+
+from refresh import LiveEngine
+from search_engine import ARTICLE_CSV, QUERY_DEFAULTS, SCHOOL_CSV, normalize_query, normalize_school_name
+
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 500
+MAX_BODY_BYTES = 64 * 1024
+KEEPALIVE_TIMEOUT = 15 # 秒；閒置的 keep-alive 連線會被關閉
+REFRESH_INTERVAL = 5 # 秒；檢查 CSV 是否已更新的間隔
+
+# 搜尋結果每間學校附帶的欄位 (完整資料以 /schools/<id> 取得)
+RESULT_FIELDS = ["學校名稱", "區域", "小一學校網", "資助類型", "學生性別", "宗教", "教學語言", "相關文章數目"]
+
+HTTP_REASONS = {
+    200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def json_value(value):
+    # NaN / 缺失值轉為 null，NumPy 純量轉為 Python 型別
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, np.generic):
+        return json_value(value.item())
+    return value
+
+
+def records(school_df, rows, fields):
+    frame = school_df.iloc[rows]
+    columns = [col for col in fields if col in frame.columns]
+    return [
+        {"id": int(school_id), **{col: json_value(value) for col, value in zip(columns, values)}}
+        for school_id, values in zip(frame.index, zip(*(frame[col].tolist() for col in columns)))
+    ]
+
+
+def spec_from_params(params):
+    """
+    將 URL 參數轉為查詢規格：多選 facet 可重複出現 (region=A&region=B)，布林值接受 1/true/yes，
+    師資門檻等巢狀條件可放在 spec 參數 (JSON) 內，其餘參數會覆蓋 spec 中的同名鍵。
+    """
+    spec = {}
+    if "spec" in params:
+        try:
+            spec = json.loads(params["spec"][-1])
+        except ValueError:
+            raise HTTPError(400, "spec is not valid JSON")
+        if not isinstance(spec, dict):
+            raise HTTPError(400, "spec must be a JSON object")
+    for key, values in params.items():
+        if key in ("spec", "limit", "offset"):
+            continue
+        if key not in QUERY_DEFAULTS:
+            raise HTTPError(400, f"unknown query key: {key}")
+        default = QUERY_DEFAULTS[key]
+        if isinstance(default, list):
+            spec[key] = values
+        elif isinstance(default, bool):
+            spec[key] = values[-1].lower() in ("1", "true", "yes", "on")
+        elif isinstance(default, dict):
+            raise HTTPError(400, f"{key} must be given inside spec")
+        else:
+            spec[key] = values[-1]
+    return spec
+
+
+def int_param(value, default, minimum, maximum):
+    try:
+        number = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"not an integer: {value}")
+    return max(minimum, min(maximum, number))
+
+
+class SearchService:
+    """
+    與傳輸層無關的請求處理：handle() 接受 method、target、body 及 If-None-Match，
+    返回 (status, JSON bytes, ETag)。回應以 LRU 快取 (按位元組總數淘汰)，資料版本改變時清空。
+    engine 為 SearchEngine (固定資料) 或 LiveEngine：後者由 refresh() 在 CSV 更新後切換到新版本。
+    """
+
+    def __init__(self, engine, cache_max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.source = engine
+        if isinstance(engine, LiveEngine) and engine.engine is None:
+            engine.current() # 啟動時即載入，資料檔不存在時立即失敗
+        self.cache_max_bytes = cache_max_bytes
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def engine(self):
+        return self.source.engine if isinstance(self.source, LiveEngine) else self.source
+
+    def refresh(self):
+        # CSV 已更新時增量建立新版本 (需時數百毫秒，serve() 在執行緒中呼叫)；更新失敗時繼續使用目前版本
+        if isinstance(self.source, LiveEngine):
+            self.source.current()
+            if self.source.error:
+                logger.warning("data refresh to %s failed: %s", *self.source.error)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._cache), "bytes": self._cache_bytes, "hits": self.hits, "misses": self.misses}
+
+    def handle(self, method, target, body=b"", if_none_match=None):
+        engine = self.engine # 整個請求使用同一個資料版本
+        try:
+            if method not in ("GET", "HEAD", "POST"):
+                raise HTTPError(405, f"method not allowed: {method}")
+            url = urlsplit(target)
+            path = unquote(url.path).rstrip("/") or "/"
+            params = parse_qs(url.query, keep_blank_values=False)
+
+            if path == "/health":
+                return 200, self._dumps({"version": engine.version, "schools": len(engine.school_df), "cache": self.stats()}), None
+            if path in ("/search", "/facets"):
+                spec = self._read_spec(method, params, body)
+                limit = int_param(spec.pop("limit", params.get("limit", [None])[-1]), DEFAULT_LIMIT, 0, MAX_LIMIT)
+                offset = int_param(spec.pop("offset", params.get("offset", [None])[-1]), 0, 0, len(engine.school_df))
+                try:
+                    selections = normalize_query(spec)
+                except (ValueError, TypeError, AttributeError) as e:
+                    raise HTTPError(400, str(e))
+                if selections["near"] and engine.indexes["spatial"] is None:
+                    raise HTTPError(400, "near needs the school coordinates table, which is not loaded")
+                if path == "/search":
+                    key = ("search", tuple(selections.items()), limit, offset)
+                    return self._cached(engine, key, if_none_match, lambda: self._search(engine, selections, limit, offset))
+                key = ("facets", tuple(selections.items()))
+                return self._cached(engine, key, if_none_match, lambda: self._facets(engine, selections))
+            if path.startswith("/schools/"):
+                school_id = path[len("/schools/"):]
+                if not school_id.isdigit() or int(school_id) not in engine.school_df.index:
+                    raise HTTPError(404, f"no such school: {school_id}")
+                return self._cached(engine, ("school", int(school_id)), if_none_match, lambda: self._school(engine, int(school_id)))
+            raise HTTPError(404, f"no such endpoint: {path}")
+        except HTTPError as e:
+            return e.status, self._dumps({"error": str(e)}), None
+        except Exception: # 任何其他錯誤都要回應 500，不可令連線沒有回應就關閉
+            logger.exception("error handling %s %s", method, target)
+            return 500, self._dumps({"error": "internal server error"}), None
+
+    def _read_spec(self, method, params, body):
+        spec = spec_from_params(params)
+        if method == "POST" and body:
+            try:
+                posted = json.loads(body)
+            except ValueError:
+                raise HTTPError(400, "request body is not valid JSON")
+            if not isinstance(posted, dict):
+                raise HTTPError(400, "request body must be a JSON object")
+            spec.update(posted)
+        return spec
+
+    def _cached(self, engine, key, if_none_match, compute):
+        # 同一資料版本下，相同的正規化查詢必定得到相同回應，因此 ETag 毋須先計算內容
+        etag = f'"{engine.version}-{hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]}"'
+        if if_none_match:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            if etag in tags or "*" in tags:
+                return 304, b"", etag
+        key = (engine.version, key) # 切換版本期間仍在處理的舊版本請求不會寫入新版本的項目
+        with self._lock:
+            if self._cache_version != engine.version:
+                self._cache.clear()
+                self._cache_bytes = 0
+                self._cache_version = engine.version
+            payload = self._cache.get(key)
+            if payload is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return 200, payload, etag
+            self.misses += 1
+        payload = self._dumps(compute())
+        with self._lock:
+            if key not in self._cache and len(payload) <= self.cache_max_bytes:
+                self._cache[key] = payload
+                self._cache_bytes += len(payload)
+                while self._cache_bytes > self.cache_max_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_bytes -= len(evicted)
+        return 200, payload, etag
+
+    def _dumps(self, payload):
+        return json.dumps(payload, ensure_ascii=False, allow_nan=False).encode("utf-8")
+
+    def _search(self, engine, selections, limit, offset):
+        # 伺服器上同時有大量不同查詢，每個 facet 只記住上一次的選擇並無好處，因此不使用 facet 快取
+        rows, _ = engine.run(selections)
+        page = rows[offset:offset + limit]
+        schools = records(engine.school_df, page, RESULT_FIELDS)
+        distances = engine.distances(selections["near"], page)
+        if distances is not None:
+            for school, distance in zip(schools, distances):
+                school["distance_km"] = json_value(round(float(distance), 3))
+        return {
+            "version": engine.version,
+            "count": len(rows),
+            "offset": offset,
+            "limit": limit,
+            "schools": schools,
+        }
+
+    def _facets(self, engine, selections):
+        _, facet_masks = engine.run(selections)
+        return {"version": engine.version, "facets": engine.option_counts(facet_masks)}
+
+    def _school(self, engine, school_id):
+        row = engine.school_record(school_id)
+        articles = engine.article_index.get(normalize_school_name(row["學校名稱"]), ())
+        return {
+            "version": engine.version,
+            "id": school_id,
+            "school": {col: json_value(value) for col, value in row.items()},
+            "articles": [{"title": title, "link": link} for title, link in articles],
+            "percentile_ranks": engine.percentile_ranks(school_id),
+            "changes": engine.school_changes(school_id),
+        }
+
+
+# --- HTTP/1.1 傳輸層 (asyncio streams) ---
+async def read_request(reader):
+    # 返回 (method, target, http_version, headers, body)；連線已關閉時返回 None
+    request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+    if not request_line.strip():
+        return None
+    try:
+        method, target, http_version = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, http_version, headers, body
+
+
+def format_response(status, payload, etag=None, keep_alive=True, head=False):
+    headers = [
+        f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+        "Content-Type: application/json; charset=utf-8",
+        f"Content-Length: {len(payload)}",
+        "Cache-Control: no-cache", # 允許快取，但每次使用前以 ETag 重新驗證
+        "Access-Control-Allow-Origin: *",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    if etag:
+        headers.append(f"ETag: {etag}")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + (b"" if head or status == 304 else payload)
+
+
+def make_handler(service):
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    writer.write(format_response(e.status, service._dumps({"error": str(e)}), keep_alive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, http_version, headers, body = request
+                # 查詢以 NumPy 在記憶體內完成 (約 0.1–2 ms)，直接在事件迴圈中處理比交給執行緒池更快
+                status, payload, etag = service.handle(method, target, body, headers.get("if-none-match"))
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" or (http_version == "HTTP/1.1" and connection != "close")
+                writer.write(format_response(status, payload, etag, keep_alive, head=method == "HEAD"))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    return handle_connection
+
+
+async def refresh_periodically(service, interval=REFRESH_INTERVAL):
+    # 增量更新在執行緒中進行，期間事件迴圈繼續以舊版本回應
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        version = service.engine.version
+        try:
+            await loop.run_in_executor(None, service.refresh)
+        except Exception:
+            logger.exception("data refresh failed")
+        if service.engine.version != version:
+            print(f"switched to data version {service.engine.version}", flush=True)
+
+
+async def serve(service, host, port):
+    server = await asyncio.start_server(make_handler(service), host, port, backlog=1024)
+    addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"serving data version {service.engine.version} on {addresses}", flush=True)
+    refresher = asyncio.create_task(refresh_periodically(service))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        refresher.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="小學概覽搜尋 HTTP JSON 服務")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--school-csv", default=SCHOOL_CSV)
+    parser.add_argument("--article-csv", default=ARTICLE_CSV)
+    parser.add_argument("--cache-mb", type=int, default=RESPONSE_CACHE_MAX_BYTES // (1024 * 1024), help="回應快取上限 (MB)")
+    parser.add_argument("--shared", action="store_true", help="經共用資料段載入，與其他進程共用同一份資料及索引")
+    args = parser.parse_args(argv)
+
+    engine = LiveEngine(args.school_csv, args.article_csv, shared=args.shared)
+    service = SearchService(engine, args.cache_mb * 1024 * 1024)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+多個進程共用的資料段 (segment)：在小一派位等繁忙期間以多個 Streamlit 進程服務時，
+由第一個進程建立 SearchEngine (資料表及所有索引) 並寫成一個檔案，其他進程以 mmap 附加，
+毋須各自解析 CSV 及建立索引，資料亦只在作業系統的頁面快取中保存一份。
+
+檔案以 pickle protocol 5 的 out-of-band buffer 寫成：NumPy 陣列及 Arrow 欄位的資料區直接寫入檔案 (對齊 64 位元組)，
+載入時以 mmap 的唯讀 memoryview 還原，不會複製；pickle 本身只保存結構 (dict、欄位名稱等細小物件)。
+資料段以資料版本命名，更新資料時寫入新檔案，已附加舊版本的進程不受影響。
+
+檔案格式：MAGIC、header 長度 (uint64)、header JSON ({"buffers": [[位移, 長度], ...], "pickle": [位移, 長度]}，
+位移由資料區開始計算)、補齊至 64 位元組、資料區。
+"""
+import io
+import json
+import mmap
+import os
+import pickle
+import struct
+import threading
+from types import MappingProxyType
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError: # Windows：沒有 flock，各進程可能同時建立同一版本 (結果相同，以 os.replace 寫入)
+    fcntl = None
+
+MAGIC = b"SCHSEG01"
+ALIGN = 64
+SEGMENTS_KEPT = 2 # 保留最近的資料段數目 (目前及上一個版本)；已附加的進程在檔案刪除後仍可繼續使用
+# 載入時只容許以下 (模組, 名稱)：SearchEngine 各部分的資料型別及其 pickle 還原函數。
+# 資料段因此不能引用 eval、os.system 等任意函數；但快取目錄仍應只有部署者可寫入，不應載入來歷不明的資料段。
+# NumPy 1.x 的模組為 numpy.core，2.x 為 numpy._core
+ALLOWED_GLOBALS = {
+    ("builtins", "dict"), ("builtins", "slice"),
+    ("numpy", "dtype"), ("numpy", "ndarray"),
+    *((f"{core}.numeric", "_frombuffer") for core in ("numpy.core", "numpy._core")),
+    *((f"{core}.multiarray", name) for core in ("numpy.core", "numpy._core") for name in ("_reconstruct", "scalar")),
+    ("pandas", "DataFrame"), ("pandas", "Index"), ("pandas", "RangeIndex"), ("pandas", "MultiIndex"),
+    ("pandas", "CategoricalIndex"), ("pandas", "Categorical"), ("pandas", "CategoricalDtype"), ("pandas", "StringDtype"),
+    ("pandas.arrays", "ArrowStringArray"),
+    ("pandas._libs.arrays", "__pyx_unpickle_NDArrayBacked"),
+    ("pandas._libs.internals", "_unpickle_block"),
+    ("pandas.core.indexes.base", "_new_Index"),
+    ("pandas.core.internals.managers", "BlockManager"),
+    ("pyarrow.lib", "_restore_array"), ("pyarrow.lib", "py_buffer"), ("pyarrow.lib", "type_for_alias"),
+    ("coldstore", "ColdStore"), ("fulltext", "FullTextIndex"), ("search_engine", "SearchEngine"), ("spatial", "GridIndex"),
+}
+
+
+class _SegmentPickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        # 唯讀包裝以普通物件保存，附加後由呼叫者重新凍結 (見 SearchEngine.__setstate__)
+        if isinstance(obj, MappingProxyType):
+            return dict, (dict(obj),)
+        if isinstance(obj, pd.DataFrame) and type(obj) is not pd.DataFrame:
+            return pd.DataFrame, (pd.DataFrame(obj),) # 子類別 (FrozenDataFrame) 以普通 DataFrame 保存，不複製資料
+        return NotImplemented
+
+
+class _SegmentUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) not in ALLOWED_GLOBALS:
+            raise pickle.UnpicklingError(f"segment refers to a disallowed class: {module}.{name}")
+        return super().find_class(module, name)
+
+
+def write_segment(path, value):
+    buffers = []
+    out = io.BytesIO()
+    _SegmentPickler(out, protocol=5, buffer_callback=buffers.append).dump(value)
+    payload = out.getvalue()
+
+    layout = []
+    offset = 0
+    for buffer in buffers:
+        offset += -offset % ALIGN
+        layout.append([offset, buffer.raw().nbytes])
+        offset += buffer.raw().nbytes
+    header = json.dumps({"buffers": layout, "pickle": [offset, len(payload)]}).encode("utf-8")
+    head = MAGIC + struct.pack("<Q", len(header)) + header
+    head += b"\0" * (-len(head) % ALIGN)
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(head)
+        position = 0
+        for (start, _), buffer in zip(layout, buffers):
+            f.write(b"\0" * (start - position))
+            f.write(buffer.raw())
+            position = start + buffer.raw().nbytes
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def attach_segment(path):
+    """
+    以 mmap 載入資料段並返回其內容。陣列直接引用 mmap (唯讀)，mmap 在最後一個引用消失後才關閉。
+    檔案損壞或格式不符時拋出 ValueError。
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if mapped[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"not a segment file: {path}")
+        (header_len,) = struct.unpack_from("<Q", mapped, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(mapped[header_start:header_start + header_len])
+        data_start = -(-(header_start + header_len) // ALIGN) * ALIGN
+        view = memoryview(mapped)
+        buffers = [view[data_start + start:data_start + start + length] for start, length in header["buffers"]]
+        start, length = header["pickle"]
+        payload = mapped[data_start + start:data_start + start + length]
+        return _SegmentUnpickler(io.BytesIO(payload), buffers=buffers).load()
+    except (pickle.UnpicklingError, EOFError, struct.error, KeyError, AttributeError, ImportError) as e:
+        raise ValueError(f"invalid segment {path}: {e}") from e
+
+
+def load_or_build_segment(path, build):
+    """
+    附加 path 的資料段；不存在時由一個進程建立：以 flock 選出負責建立的進程，其他進程在鎖上等候，
+    建立完成後全部附加同一個檔案 (建立的進程亦改用附加的版本，釋放自己的副本)。
+    build() 返回要寫入的物件。快取目錄不可寫入時直接返回 build() 的結果。
+    """
+    if os.path.exists(path):
+        try:
+            return attach_segment(path)
+        except (OSError, ValueError):
+            pass # 損壞或舊格式：在鎖內重新建立
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lock = open(f"{path}.lock", "a+b")
+    except OSError:
+        return build()
+    with lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX) # 另一個進程正在建立時在此等候
+        try:
+            if os.path.exists(path):
+                try:
+                    return attach_segment(path)
+                except (OSError, ValueError):
+                    pass
+            value = build()
+            try:
+                write_segment(path, value)
+                prune_segments(os.path.dirname(path), keep=path)
+                return attach_segment(path)
+            except (OSError, ValueError, pickle.PicklingError):
+                return value
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def prune_segments(directory, keep, kept=SEGMENTS_KEPT):
+    # 刪除較舊的資料段 (按修改時間保留最近 kept 個，keep 一定保留)；已附加的進程不受影響
+    try:
+        names = [name for name in os.listdir(directory) if name.startswith("segment-") and name.endswith(".seg")]
+        paths = sorted((os.path.join(directory, name) for name in names), key=os.path.getmtime, reverse=True)
+        for path in paths[kept:]:
+            if path != keep:
+                os.remove(path)
+                if os.path.exists(f"{path}.lock"):
+                    os.remove(f"{path}.lock")
+    except OSError:
+        pass
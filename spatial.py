@@ -0,0 +1,136 @@
+"""
+學校坐標的網格索引 (uniform grid)，回答「附近的學校」：半徑內的學校及最近的 k 間學校。
+
+坐標以學校所在緯度的等距圓柱投影換算為公里 (x = 經度 × 111.32 × cos(參考緯度)，y = 緯度 × 110.57)，
+在香港範圍內與大圓距離相差不足 0.1%，距離只需歐氏距離。
+學校按所在網格排序後存成 CSR 形式 (rows / cell_start)，每個網格的學校為 rows[cell_start[c]:cell_start[c + 1]]。
+"""
+import math
+
+import numpy as np
+
+GRID_CELL_KM = 1.0
+MAX_GRID_CELLS = 1_000_000 # 坐標範圍很大時自動放大網格，避免 cell_start 過大
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LON = 111.320 # 赤道上；再乘以 cos(緯度)
+
+
+class GridIndex:
+    def __init__(self, lat, lon, cell_km=GRID_CELL_KM):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        self.size = len(lat)
+        self.present = ~(np.isnan(lat) | np.isnan(lon))
+        ref_lat = float(np.mean(lat[self.present])) if self.present.any() else 0.0
+        self.kx = KM_PER_DEGREE_LON * math.cos(math.radians(ref_lat))
+        self.ky = KM_PER_DEGREE_LAT
+        self.x = lon * self.kx
+        self.y = lat * self.ky
+
+        rows = np.flatnonzero(self.present).astype(np.int32)
+        if len(rows):
+            self.x0, self.y0 = float(self.x[rows].min()), float(self.y[rows].min())
+            width, height = float(self.x[rows].max()) - self.x0, float(self.y[rows].max()) - self.y0
+        else:
+            self.x0 = self.y0 = width = height = 0.0
+        self.cell_km = max(cell_km, math.sqrt(width * height / MAX_GRID_CELLS))
+        self.ncols = int(width // self.cell_km) + 1
+        self.nrows = int(height // self.cell_km) + 1
+
+        cell_ids = self._cell_of(self.x[rows], self.y[rows])
+        order = np.argsort(cell_ids, kind="stable")
+        self.rows = rows[order]
+        self.cell_start = np.searchsorted(cell_ids[order], np.arange(self.ncols * self.nrows + 1)).astype(np.int64)
+        for array in (self.present, self.x, self.y, self.rows, self.cell_start):
+            array.flags.writeable = False
+
+    def _cell_of(self, x, y):
+        cx = np.clip(((x - self.x0) // self.cell_km).astype(np.int64), 0, self.ncols - 1)
+        cy = np.clip(((y - self.y0) // self.cell_km).astype(np.int64), 0, self.nrows - 1)
+        return cy * self.ncols + cx
+
+    def _project(self, lat, lon):
+        return lon * self.kx, lat * self.ky
+
+    def distances(self, lat, lon, rows=None):
+        # 由 (lat, lon) 到各學校的距離 (公里)；沒有坐標的學校為 NaN
+        px, py = self._project(lat, lon)
+        x, y = (self.x, self.y) if rows is None else (self.x[rows], self.y[rows])
+        return np.hypot(x - px, y - py)
+
+    def _cells_rows(self, cx_range, cy_range):
+        # 矩形範圍內 (已裁剪至網格) 所有網格的學校
+        cx_lo, cx_hi = max(cx_range[0], 0), min(cx_range[1], self.ncols - 1)
+        cy_lo, cy_hi = max(cy_range[0], 0), min(cy_range[1], self.nrows - 1)
+        if cx_lo > cx_hi or cy_lo > cy_hi:
+            return self.rows[:0]
+        # 同一行的網格在 rows 中是連續的，每行只需一個切片
+        starts = self.cell_start[np.arange(cy_lo, cy_hi + 1) * self.ncols + cx_lo]
+        ends = self.cell_start[np.arange(cy_lo, cy_hi + 1) * self.ncols + cx_hi + 1]
+        return np.concatenate([self.rows[start:end] for start, end in zip(starts, ends)])
+
+    def within(self, lat, lon, radius_km):
+        # 半徑內的學校 (bool mask)：只檢查與外接正方形重疊的網格
+        px, py = self._project(lat, lon)
+        cells = lambda low, high, origin: (int((low - origin) // self.cell_km), int((high - origin) // self.cell_km))
+        candidates = self._cells_rows(cells(px - radius_km, px + radius_km, self.x0), cells(py - radius_km, py + radius_km, self.y0))
+        mask = np.zeros(self.size, dtype=bool)
+        mask[candidates[np.hypot(self.x[candidates] - px, self.y[candidates] - py) <= radius_km]] = True
+        return mask
+
+    def nearest(self, lat, lon, k, mask=None):
+        """
+        最近的 k 間學校 (由近至遠的列位置)，只考慮 mask 為 True 的學校 (即已套用其他篩選)。
+        由所在網格開始逐圈向外搜尋：第 r 圈之外的學校距離最少 r × cell_km，
+        已找到 k 間且第 k 近的距離不超過此下限時即可停止。篩選後學校太少 (要搜尋大部分網格) 時改為直接計算全部距離。
+        """
+        allowed = self.present if mask is None else (self.present & mask)
+        px, py = self._project(lat, lon)
+        cx, cy = (px - self.x0) // self.cell_km, (py - self.y0) // self.cell_km
+        max_ring = max(self.ncols, self.nrows)
+        inside = 0 <= cx < self.ncols and 0 <= cy < self.nrows
+        if k <= 0 or not inside or k * 4 > allowed.sum():
+            return self._nearest_brute(px, py, k, allowed)
+
+        cx, cy = int(cx), int(cy)
+        found = [self.rows[:0]]
+        count = 0
+        for ring in range(max_ring + 1):
+            if ring == 0:
+                ring_rows = self._cells_rows((cx, cx), (cy, cy))
+            else:
+                # 第 ring 圈：上下兩行及左右兩列 (不重複角落)
+                ring_rows = np.concatenate([
+                    self._cells_rows((cx - ring, cx + ring), (cy - ring, cy - ring)),
+                    self._cells_rows((cx - ring, cx + ring), (cy + ring, cy + ring)),
+                    self._cells_rows((cx - ring, cx - ring), (cy - ring + 1, cy + ring - 1)),
+                    self._cells_rows((cx + ring, cx + ring), (cy - ring + 1, cy + ring - 1)),
+                ])
+            ring_rows = ring_rows[allowed[ring_rows]]
+            found.append(ring_rows)
+            count += len(ring_rows)
+            if count >= k:
+                candidates = np.concatenate(found)
+                dist = np.hypot(self.x[candidates] - px, self.y[candidates] - py)
+                if np.partition(dist, k - 1)[k - 1] <= ring * self.cell_km:
+                    return _k_smallest(candidates, dist, k)
+            if ring > 0 and (2 * ring + 1) ** 2 > self.ncols * self.nrows // 4:
+                break
+        return self._nearest_brute(px, py, k, allowed)
+
+    def _nearest_brute(self, px, py, k, allowed):
+        candidates = np.flatnonzero(allowed)
+        dist = np.hypot(self.x[candidates] - px, self.y[candidates] - py)
+        return _k_smallest(candidates, dist, k if k > 0 else len(candidates))
+
+
+def _k_smallest(rows, dist, k):
+    # 距離最小的 k 個 (由近至遠)；同距離按列位置，結果穩定
+    k = min(k, len(rows))
+    if k < len(rows):
+        part = np.argpartition(dist, k - 1)[:k]
+        kth = dist[part].max()
+        keep = np.flatnonzero(dist <= kth)
+        rows, dist = rows[keep], dist[keep]
+    order = np.lexsort((rows, dist))[:k]
+    return rows[order].astype(np.int32)
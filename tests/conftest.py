@@ -0,0 +1,38 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import search_engine # noqa: E402
+
+SCHOOL_CSV = os.path.join(ROOT, search_engine.SCHOOL_CSV)
+ARTICLE_CSV = os.path.join(ROOT, search_engine.ARTICLE_CSV)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def cache_dir(tmp_path_factory):
+    # 測試產生的快取檔寫入臨時目錄，不影響 repo 的 .cache
+    path = str(tmp_path_factory.mktemp("cache"))
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(search_engine, "CACHE_DIR", path)
+        yield path
+
+
+@pytest.fixture(scope="session")
+def engine():
+    return search_engine.SearchEngine.load(SCHOOL_CSV, ARTICLE_CSV)
+
+
+@pytest.fixture
+def data_copy(tmp_path):
+    # 可修改的 CSV 副本：返回 (學校 CSV, 文章 CSV) 的路徑
+    paths = []
+    for source in (SCHOOL_CSV, ARTICLE_CSV):
+        target = tmp_path / os.path.basename(source)
+        shutil.copy(source, target)
+        paths.append(str(target))
+    return tuple(paths)
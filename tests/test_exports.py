@@ -0,0 +1,78 @@
+import html
+import io
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+
+import pandas as pd
+import pytest
+
+from exports import export_bytes, export_file
+from search_engine import normalize_query, parse_school_csv
+
+SHEET_NS = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+
+@pytest.fixture(scope="module")
+def rows(engine):
+    return engine.run(normalize_query({"region": ["沙田區", "元朗區"]}))[0]
+
+
+def test_csv_round_trip(engine, rows):
+    data = export_bytes("csv", engine.school_df, rows, cold=engine.cold)
+    assert data.startswith(b"\xef\xbb\xbf")
+    back = parse_school_csv(io.BytesIO(data))
+    expected = engine.records(rows).reset_index(drop=True)
+    back["相關文章數目"] = pd.to_numeric(back["相關文章數目"])
+    pd.testing.assert_frame_equal(back, expected, check_dtype=False, check_categorical=False)
+
+
+def test_csv_writes_integral_numbers_without_decimal_point(engine, rows):
+    text = pd.read_csv(io.BytesIO(export_bytes("csv", engine.school_df, rows, cold=engine.cold)), dtype=str)
+    for col in ["創校年份", "本學年總班數", "教師總人數"]:
+        values = text[col].dropna()
+        assert len(values) and values.str.fullmatch(r"\d+").all(), col
+
+
+def test_chunking_does_not_change_output(engine, rows):
+    for fmt in ("csv", "xlsx"):
+        whole = export_bytes(fmt, engine.school_df, rows, cold=engine.cold)
+        chunked = export_bytes(fmt, engine.school_df, rows, cold=engine.cold, chunk_rows=7)
+        if fmt == "xlsx":
+            whole, chunked = (zipfile.ZipFile(io.BytesIO(data)).read("xl/worksheets/sheet1.xml") for data in (whole, chunked))
+        assert whole == chunked
+
+
+def test_xlsx_round_trip(engine, rows):
+    with zipfile.ZipFile(io.BytesIO(export_bytes("xlsx", engine.school_df, rows, cold=engine.cold))) as archive:
+        assert archive.testzip() is None
+        sheet = ET.fromstring(archive.read("xl/worksheets/sheet1.xml"))
+    table = [
+        [cell.findtext("x:v", namespaces=SHEET_NS) or cell.findtext("x:is/x:t", namespaces=SHEET_NS) for cell in row]
+        for row in sheet.iterfind("x:sheetData/x:row", SHEET_NS)
+    ]
+    expected = engine.records(rows)
+    assert table[0] == list(expected.columns)
+    assert len(table) == len(rows) + 1
+    names = [row[table[0].index("學校名稱")] for row in table[1:]]
+    assert names == expected["學校名稱"].tolist()
+    years = [row[table[0].index("創校年份")] for row in table[1:]]
+    assert [int(year) for year in years if year] == expected["創校年份"].dropna().astype(int).tolist()
+    assert all(re.fullmatch(r"\d+", year) for year in years if year)
+
+
+def test_html_lists_every_school(engine, rows):
+    data = export_bytes(
+        "html", engine.school_df, rows, cold=engine.cold,
+        article_index=engine.article_index, aggregates=engine.indexes["aggregates"],
+    ).decode("utf-8")
+    for name in engine.school_df["學校名稱"].iloc[rows]:
+        assert html.escape(name) in data
+
+
+def test_export_file_is_rewound_and_closed(engine, rows):
+    with export_file("csv", engine.school_df, rows, cold=engine.cold) as out:
+        assert out.tell() == 0
+        assert out.read(3) == b"\xef\xbb\xbf"
+    assert out.closed
+
@@ -0,0 +1,79 @@
+import pandas as pd
+
+import search_engine
+from refresh import LiveEngine, refresh_engine
+from search_engine import SearchEngine
+
+NEW_WORD = "海洋探究"
+
+
+def edit_school_csv(path):
+    """
+    修改學校 CSV：移除第 1 行、更改第 0 行的教師人數、在第 2 行的辦學宗旨加入 NEW_WORD，並在最後新增一間學校。
+    返回 (被移除的學校名稱, 新增的學校名稱, 第 0 行的新舊教師人數)。
+    """
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    removed = df.at[1, "學校名稱"]
+    old_teachers = df.at[0, "教師總人數"]
+    new_teachers = str(int(old_teachers) + 7)
+    df.at[0, "教師總人數"] = new_teachers
+    df.at[2, "辦學宗旨"] += NEW_WORD
+    added = df.iloc[[5]].assign(學校名稱="測試新小學")
+    pd.concat([df.drop(index=1), added]).to_csv(path, index=False)
+    return removed, "測試新小學", (float(old_teachers), float(new_teachers))
+
+
+def test_refresh_engine_applies_changes(data_copy, monkeypatch, tmp_path):
+    school_csv, article_csv = data_copy
+    old = SearchEngine.load(school_csv, article_csv)
+    assert refresh_engine(old, school_csv, article_csv) == (old, None)
+
+    removed, added, teachers = edit_school_csv(school_csv)
+    new, log = refresh_engine(old, school_csv, article_csv)
+    size = len(old.school_df)
+
+    assert new.version != old.version and len(new.school_df) == size
+    assert log["removed"] == [removed]
+    assert log["added"] == [size - 1] and new.school_df.at[size - 1, "學校名稱"] == added
+    assert new.school_changes(0) == {"status": "changed", "fields": {"教師總人數": list(teachers)}}
+    assert set(new.school_changes(1)["fields"]) == {"辦學宗旨"}
+    assert new.school_changes(size - 1) == {"status": "added"}
+    # 舊 id -> 新 id：第 1 行已移除，其後的學校上移一行
+    assert new.id_remap[0] == old.version
+    assert new.id_remap[1][:4].tolist() == [0, -1, 1, 2]
+
+    # 增量更新的結果與重新載入相同
+    assert old.search({"fulltext": NEW_WORD}) == []
+    monkeypatch.setattr(search_engine, "CACHE_DIR", str(tmp_path / "fresh"))
+    fresh = SearchEngine.load(school_csv, article_csv)
+    assert fresh.version == new.version
+    for spec in [{"fulltext": NEW_WORD}, {"fulltext": "電子學習"}, {"name": "測試"}, {"region": ["沙田區"]}, {}]:
+        assert new.search(spec) == fresh.search(spec), spec
+    assert new.search({"fulltext": NEW_WORD}) == [1]
+
+
+def test_live_engine_switches_versions(data_copy):
+    school_csv, article_csv = data_copy
+    live = LiveEngine(school_csv, article_csv)
+    old = live.current()
+    assert live.current() is old
+
+    edit_school_csv(school_csv)
+    new = live.current()
+    assert new is not old and new.version != old.version
+    assert live.engine is new and live.error is None
+    assert new.search({"name": "測試新小學"}) == [len(new.school_df) - 1]
+
+
+def test_live_engine_keeps_current_version_on_bad_data(data_copy):
+    school_csv, article_csv = data_copy
+    live = LiveEngine(school_csv, article_csv)
+    old = live.current()
+    with open(school_csv, "w", encoding="utf-8") as f:
+        f.write("欄位\n1\n")
+
+    assert live.current() is old
+    version, error = live.error
+    assert version != old.version and isinstance(error, (KeyError, ValueError))
+    assert live.current() is old # 同一版本不再重試
+
@@ -0,0 +1,117 @@
+import inspect
+
+import pandas as pd
+import pytest
+
+from conftest import SCHOOL_CSV
+from search_engine import COLUMN_RENAMES, INPLACE_METHODS, ReadOnlyDataError, is_valid_data, normalize_query
+
+# 原本 app.py 的 run_search：以字串讀入 CSV，逐個條件以 pandas 比較 (師資門檻為「≥ X%」)
+ASSESSMENT_VALUES = {"0次": ["0"], "不多於1次": ["0", "1"], "不多於2次": ["0", "1", "2"], "3次": ["3"]}
+
+
+@pytest.fixture(scope="module")
+def raw_df():
+    df = pd.read_csv(SCHOOL_CSV, dtype=str)
+    df.columns = df.columns.str.strip()
+    df = df.rename(columns=COLUMN_RENAMES)
+    return df.apply(lambda column: column.str.strip())
+
+
+def baseline_search(df, spec):
+    mask = pd.Series(True, index=df.index)
+    for key, col in {"region": "區域", "cat1": "資助類型", "gender": "學生性別", "lang": "教學語言", "net": "小一學校網"}.items():
+        if spec.get(key):
+            mask &= df[col].isin(spec[key])
+    if spec.get("related"):
+        mask &= pd.concat([df[col].apply(is_valid_data) for col in spec["related"]], axis=1).any(axis=1)
+    if spec.get("transport"):
+        mask &= pd.concat([df[col] == "有" for col in spec["transport"]], axis=1).any(axis=1)
+    for key, col in {"g1_tests": "全年全科測驗次數_一年級", "g2_6_exams": "全年全科考試次數_二至六年級"}.items():
+        if key in spec:
+            mask &= df[col].isin(ASSESSMENT_VALUES[spec[key]])
+    if spec.get("tutorial"):
+        mask &= df["按校情靈活編排時間表_盡量在下午安排導修時段_讓學生能在教師指導下完成部分家課"] == "有"
+    for col, minimum in spec.get("teacher", {}).items():
+        values = pd.to_numeric(df[col], errors="coerce")
+        mask &= (values >= minimum) | (values.isna() & spec.get("include_missing", False))
+    return df.index[mask].tolist()
+
+
+@pytest.mark.parametrize("spec", [
+    {},
+    {"region": ["元朗區", "沙田區"]},
+    {"region": ["九龍城區"], "cat1": ["資助", "直資"], "gender": ["男女"]},
+    {"lang": ["中文及英文", "英文"], "net": ["48", "72", "95"]},
+    {"related": ["一條龍中學", "直屬中學"]},
+    {"transport": ["校車", "保姆車"], "region": ["屯門區"]},
+    {"g1_tests": "0次", "g2_6_exams": "不多於2次"},
+    {"g1_tests": "3次", "tutorial": True},
+    {"teacher": {"碩士／博士或以上人數百分率": 35}},
+    {"teacher": {"碩士／博士或以上人數百分率": 15, "10年年資或以上人數百分率": 40}, "include_missing": True},
+    {"region": ["觀塘區"], "transport": ["校車"], "teacher": {"特殊教育培訓人數百分率": 30}, "g1_tests": "不多於1次"},
+])
+def test_filters_match_baseline(engine, raw_df, spec):
+    assert engine.search(spec) == baseline_search(raw_df, spec)
+
+
+def test_no_match_is_empty(engine):
+    assert engine.search({"region": ["不存在的地區"]}) == []
+
+
+@pytest.mark.parametrize("spec", [
+    {"unknown": 1},
+    {"g1_tests": "5次"},
+    {"teacher": {"不存在的欄位": 10}},
+])
+def test_normalize_query_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        normalize_query(spec)
+
+
+# --- 共用唯讀資料集 ---
+def test_inplace_methods_cover_pandas():
+    # pandas 增加新的 inplace 方法時此測試失敗，提醒更新 INPLACE_METHODS
+    found = {
+        name for name, method in inspect.getmembers(pd.DataFrame, inspect.isfunction)
+        if not name.startswith("_") and "inplace" in inspect.signature(method).parameters
+    }
+    assert found <= set(INPLACE_METHODS)
+
+
+@pytest.mark.parametrize("mutate", [
+    lambda df: df.__setitem__("學校名稱", ""),
+    lambda df: df.__delitem__("學校名稱"),
+    lambda df: df.loc.__setitem__((0, "學校名稱"), ""),
+    lambda df: df.iloc.__setitem__((0, 0), ""),
+    lambda df: df.at.__setitem__((0, "學校名稱"), ""),
+    lambda df: df.iat.__setitem__((0, 0), ""),
+    lambda df: df.insert(0, "新欄位", 1),
+    lambda df: df.pop("學校名稱"),
+    lambda df: df.update(df.head(1)),
+    lambda df: setattr(df, "columns", range(len(df.columns))),
+    lambda df: df.fillna(0, inplace=True),
+    lambda df: df.sort_values("學校名稱", inplace=True),
+    lambda df: df.drop(columns="學校名稱", inplace=True),
+    lambda df: df.rename(columns={"學校名稱": "名稱"}, inplace=True),
+])
+def test_shared_frame_is_read_only(engine, mutate):
+    before = engine.school_df.head(3).copy()
+    with pytest.raises(ReadOnlyDataError):
+        mutate(engine.school_df)
+    pd.testing.assert_frame_equal(engine.school_df.head(3), before)
+
+
+def test_derived_frames_are_writable(engine):
+    subset = engine.school_df.sort_values("學校名稱").head(5)
+    subset["學校名稱"] = ""
+    assert type(subset) is pd.DataFrame
+    assert (engine.school_df["學校名稱"] != "").all()
+
+
+def test_indexes_are_read_only(engine):
+    with pytest.raises(TypeError):
+        engine.indexes["filter"]["region"] = {}
+    bitmap = next(iter(engine.indexes["filter"]["region"].values()))
+    with pytest.raises(ValueError):
+        bitmap[0] = True
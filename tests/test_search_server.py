@@ -0,0 +1,97 @@
+import json
+import os
+
+import pytest
+
+from refresh import LiveEngine
+from search_server import SearchService
+
+
+@pytest.fixture
+def service(engine):
+    return SearchService(engine)
+
+
+def get(service, target, method="GET", body=b"", if_none_match=None):
+    status, payload, etag = service.handle(method, target, body, if_none_match)
+    return status, (json.loads(payload) if payload else None), etag
+
+
+def test_health_and_search(service, engine):
+    status, payload, _ = get(service, "/health")
+    assert status == 200 and payload["schools"] == len(engine.school_df)
+    status, payload, _ = get(service, "/search?region=元朗區&limit=5")
+    assert status == 200
+    assert payload["count"] == len(engine.search({"region": ["元朗區"]}))
+    assert len(payload["schools"]) == 5
+
+
+def test_etag_not_modified(service):
+    status, _, etag = get(service, "/search?gender=女")
+    assert status == 200 and etag
+    assert get(service, "/search?gender=女", if_none_match=etag)[0] == 304
+
+
+@pytest.mark.parametrize("target", [
+    "/search?unknown=1",
+    "/search?limit=abc",
+    "/search?g1_tests=5次",
+    "/search?teacher=10",
+    "/search?spec=[1]",
+    "/search?spec=not-json",
+    '/search?spec={"teacher":{"學士人數百分率":"nan"}}',
+    '/search?spec={"teacher":{"學士人數百分率":"abc"}}',
+    '/search?spec={"near":{"lat":22.3}}',
+    '/facets?spec={"near":{"lat":95,"lon":114}}',
+])
+def test_bad_query_is_400(service, target):
+    status, payload, _ = get(service, target)
+    assert status == 400 and payload["error"]
+
+
+def test_near_without_coordinates_is_400(service, engine):
+    assert engine.indexes["spatial"] is None # 測試資料沒有坐標表
+    status, payload, _ = get(service, '/search?spec={"near":{"lat":22.3,"lon":114.2}}')
+    assert status == 400 and "coordinates" in payload["error"]
+
+
+@pytest.mark.parametrize("body", [b"{", b"[1, 2]"])
+def test_bad_post_body_is_400(service, body):
+    assert get(service, "/search", method="POST", body=body)[0] == 400
+
+
+@pytest.mark.parametrize("target", ["/schools/abc", "/schools/999999", "/nowhere"])
+def test_not_found_is_404(service, target):
+    assert get(service, target)[0] == 404
+
+
+def test_method_not_allowed_is_405(service):
+    assert get(service, "/search", method="DELETE")[0] == 405
+
+
+def test_unexpected_error_is_500(service, monkeypatch, caplog):
+    def broken(*args):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(service, "_search", broken)
+    status, payload, _ = get(service, "/search?region=沙田區")
+    assert status == 500 and payload == {"error": "internal server error"}
+    assert "boom" in caplog.text
+    assert get(service, "/health")[0] == 200
+
+
+def test_refresh_serves_updated_data(data_copy):
+    school_csv, article_csv = data_copy
+    service = SearchService(LiveEngine(school_csv, article_csv))
+    old_version = get(service, "/health")[1]["version"]
+    name = get(service, "/schools/0")[1]["school"]["學校名稱"]
+
+    with open(school_csv, encoding="utf-8") as f:
+        text = f.read()
+    with open(school_csv, "w", encoding="utf-8") as f:
+        f.write(text.replace(name, name + "（新校舍）", 1))
+    os.utime(school_csv, (1, 1)) # 確保修改時間改變
+
+    service.refresh()
+    status, payload, _ = get(service, "/health")
+    assert status == 200 and payload["version"] != old_version
+    assert get(service, "/schools/0")[1]["school"]["學校名稱"] == name + "（新校舍）"
@@ -0,0 +1,79 @@
+import os
+from types import MappingProxyType
+
+import numpy as np
+import pytest
+
+import search_engine
+from conftest import ARTICLE_CSV, SCHOOL_CSV
+from search_engine import ReadOnlyDataError, SearchEngine
+from segments import attach_segment, load_or_build_segment, write_segment
+
+SPECS = [{}, {"region": ["沙田區"], "transport": ["校車"]}, {"name": "聖"}, {"fulltext": "電子學習"}]
+
+
+class Exploit:
+    # 還原時會呼叫 builtins.open 建立檔案：資料段不可引用允許清單以外的函數
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return open, (self.path, "w")
+
+
+def test_write_and_attach_engine(engine, tmp_path):
+    path = str(tmp_path / "engine.seg")
+    write_segment(path, engine)
+    attached = attach_segment(path)
+
+    assert isinstance(attached, SearchEngine) and attached.version == engine.version
+    for spec in SPECS:
+        assert attached.search(spec) == engine.search(spec)
+    assert attached.school_record(3).equals(engine.school_record(3))
+
+    # 陣列直接引用 mmap 而不複製，附加後仍然唯讀
+    bitmap = next(iter(attached.indexes["filter"]["region"].values()))
+    assert not bitmap.flags.owndata and not bitmap.flags.writeable
+    assert isinstance(attached.indexes["filter"], MappingProxyType)
+    with pytest.raises(ReadOnlyDataError):
+        attached.school_df["學校名稱"] = ""
+    with pytest.raises(ValueError):
+        bitmap[0] = not bitmap[0]
+
+
+def test_load_shared_builds_once_and_attaches(monkeypatch, tmp_path):
+    monkeypatch.setattr(search_engine, "CACHE_DIR", str(tmp_path))
+    calls = []
+    original = SearchEngine.__init__
+
+    def counting_init(self, *args, **kwargs):
+        calls.append(1)
+        original(self, *args, **kwargs)
+    monkeypatch.setattr(SearchEngine, "__init__", counting_init)
+
+    first = SearchEngine.load(SCHOOL_CSV, ARTICLE_CSV, shared=True)
+    second = SearchEngine.load(SCHOOL_CSV, ARTICLE_CSV, shared=True)
+    assert len(calls) == 1 # 第二次直接附加第一次寫入的資料段
+    assert os.path.exists(search_engine.segment_path(first.version))
+    assert not second.indexes["threshold"]["學士人數百分率"]["sorted"].flags.owndata
+    assert second.search(SPECS[1]) == first.search(SPECS[1])
+
+
+def test_disallowed_global_is_rejected(tmp_path):
+    path = str(tmp_path / "exploit.seg")
+    target = tmp_path / "created"
+    write_segment(path, {"payload": Exploit(str(target))})
+    with pytest.raises(ValueError, match="disallowed"):
+        attach_segment(path)
+    assert not target.exists()
+
+
+def test_corrupt_segment_is_rebuilt(tmp_path):
+    path = str(tmp_path / "segment-test.seg")
+    with open(path, "wb") as f:
+        f.write(b"not a segment")
+    with pytest.raises(ValueError):
+        attach_segment(path)
+    value = load_or_build_segment(path, lambda: {"values": np.arange(10)})
+    assert value["values"].tolist() == list(range(10))
+    assert attach_segment(path)["values"].sum() == 45